@@ -0,0 +1,89 @@
+"""
+Per-chunk overhead of the OpenAI stream aggregator on long streams.
+
+    python benchmarks/stream_aggregator.py --tokens 10000
+"""
+
+import argparse
+import time
+
+from openai.types.chat import ChatCompletionChunk
+
+from mosaicpy.llm import LLMEventManager
+from mosaicpy.llm.openai.stream_aggregator import ChunkAggregator
+
+
+def make_chunks(num_tokens, num_tool_calls=0):
+    def chunk(delta, finish_reason=None):
+        return ChatCompletionChunk.model_validate(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": 1,
+                "model": "bench",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+        )
+
+    chunks = [chunk({"role": "assistant", "content": ""})]
+    chunks += [chunk({"content": f"tok{i} "}) for i in range(num_tokens)]
+    for i in range(num_tool_calls):
+        chunks.append(
+            chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": i,
+                            "id": f"call_{i}",
+                            "type": "function",
+                            "function": {"name": "f", "arguments": ""},
+                        }
+                    ]
+                }
+            )
+        )
+        chunks += [
+            chunk({"tool_calls": [{"index": i, "function": {"arguments": '{"x": 1}'[j : j + 2]}}]})
+            for j in range(0, 8, 2)
+        ]
+    chunks.append(chunk({}, "tool_calls" if num_tool_calls else "stop"))
+    return chunks
+
+
+def bench(chunks, event_manager, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        aggregator = ChunkAggregator(event_manger=event_manager)
+        for chunk in chunks:
+            aggregator.update(chunk)
+        aggregator.to_chat_completion()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=10000)
+    parser.add_argument("--tool-calls", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.tokens, args.tool_calls)
+
+    with_listener = LLMEventManager()
+    with_listener.on_new_chat_token(lambda token: None)
+
+    for name, event_manager in (
+        ("no listeners", LLMEventManager()),
+        ("one listener", with_listener),
+    ):
+        elapsed = bench(chunks, event_manager, args.repeat)
+        print(
+            f"{name:>14}: {elapsed * 1e3:8.2f} ms total, "
+            f"{elapsed / len(chunks) * 1e6:6.2f} us/chunk ({len(chunks)} chunks)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 from . import notebook, utils, llm, collections
 
-from .collections import dict, groupby, pmap, sample, lists
+from .collections import dict, groupby, ipmap, pmap, sample, lists
 from .collections.lists import flatten
 from .llm.openai.agent import OpenAIAgent
 from .llm.anthropic.agent import AnthropicAgent
-from .utils.file import load_jsonl, dump_jsonl, load_pickle, dump_pickle
+from .utils.file import iter_jsonl, load_jsonl, dump_jsonl, load_pickle, dump_pickle
 from .annotations import time_it
 
 __all__ = [
@@ -15,11 +15,13 @@ __all__ = [
     "dict",
     "groupby",
     "pmap",
+    "ipmap",
     "sample",
     "lists",
     "flatten",
     "OpenAIAgent",
     "AnthropicAgent",
+    "iter_jsonl",
     "load_jsonl",
     "dump_jsonl",
     "load_pickle",
@@ -1,4 +1,13 @@
+from .profile import ProfileRegistry, default_registry, profile, report, reset, timer
 from .time_it import time_it
 
 
-__all__ = ["time_it"]
+__all__ = [
+    "ProfileRegistry",
+    "default_registry",
+    "profile",
+    "report",
+    "reset",
+    "time_it",
+    "timer",
+]
@@ -0,0 +1,215 @@
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+from mosaicpy.utils.stats import Histogram
+
+
+class _Stat:
+    __slots__ = ("calls", "samples", "total_ns", "min_ns", "max_ns", "histogram")
+
+    def __init__(self, max_samples):
+        self.calls = 0
+        self.samples = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.histogram = Histogram(max_samples)
+
+
+class ProfileRegistry:
+    """
+    Thread-safe timings aggregated by name: call counts, total time and a histogram
+    of durations for percentiles.
+
+    Args:
+        max_samples (int, optional): The reservoir size of each name's histogram.
+    """
+
+    def __init__(self, max_samples: int = 1024):
+        self.max_samples = max_samples
+        self.enabled = True
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, elapsed_ns: int, calls: Optional[int] = None):
+        """
+        Record one timed call of `name`. `calls` is the number of calls so far when
+        only some calls are timed; by default every call is.
+        """
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = _Stat(self.max_samples)
+            stat.calls = stat.calls + 1 if calls is None else max(stat.calls, calls)
+            stat.samples += 1
+            stat.total_ns += elapsed_ns
+            if stat.min_ns is None or elapsed_ns < stat.min_ns:
+                stat.min_ns = elapsed_ns
+            if stat.max_ns is None or elapsed_ns > stat.max_ns:
+                stat.max_ns = elapsed_ns
+        stat.histogram.observe(elapsed_ns / 1e9)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: {name: {calls, samples, total, mean, min, max, p50, p95, p99}}, in
+            seconds. `total` is extrapolated to all calls when only some were timed.
+        """
+        with self._lock:
+            items = list(self._stats.items())
+
+        result = {}
+        for name, stat in items:
+            mean = stat.total_ns / stat.samples / 1e9
+            result[name] = dict(
+                calls=stat.calls,
+                samples=stat.samples,
+                total=mean * stat.calls,
+                mean=mean,
+                min=stat.min_ns / 1e9,
+                max=stat.max_ns / 1e9,
+                **stat.histogram.percentiles(),
+            )
+        return result
+
+    def report(self, format: str = "table", sort: str = "total") -> str:
+        """
+        Render the stats as a text table (durations in milliseconds) or as JSON
+        (durations in seconds), sorted by `sort` in descending order.
+        """
+        stats = sorted(self.stats().items(), key=lambda item: -item[1][sort])
+        if format == "json":
+            return json.dumps(dict(stats), indent=2)
+        if format != "table":
+            raise ValueError(f"Unknown report format: {format}")
+
+        columns = ["calls", "total", "mean", "p50", "p95", "p99", "max"]
+        rows = [["name", *columns]]
+        for name, stat in stats:
+            rows.append(
+                [name, str(stat["calls"])]
+                + [f"{stat[column] * 1000:.3f}" for column in columns[1:]]
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for row in rows:
+            cells = [row[0].ljust(widths[0])]
+            cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            lines.append("  ".join(cells))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+default_registry = ProfileRegistry()
+
+
+def _qualified_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def profile(
+    func: Optional[Callable] = None,
+    *,
+    name: Optional[str] = None,
+    sample_rate: float = 1.0,
+    registry: Optional[ProfileRegistry] = None,
+):
+    """
+    Time every call of a function, sync or async, into a registry. Use as `@profile` or
+    `@profile(name=..., sample_rate=...)`.
+
+    Args:
+        name (str, optional): The name to aggregate under. Defaults to the function's
+            qualified name.
+        sample_rate (float, optional): The fraction of calls to time. Hot functions
+            can time every n-th call only; the others just bump a counter.
+        registry (ProfileRegistry, optional): Defaults to `default_registry`.
+    """
+    if func is None:
+        return functools.partial(profile, name=name, sample_rate=sample_rate, registry=registry)
+
+    name = name or _qualified_name(func)
+    every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+    # next() on a count is atomic under the GIL, so counting needs no lock
+    counter = itertools.count(1)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            n = next(counter)
+            reg = registry or default_registry
+            if not every or n % every or not reg.enabled:
+                return await func(*args, **kwargs)
+
+            start = time.perf_counter_ns()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                reg.record(name, time.perf_counter_ns() - start, n if every > 1 else None)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        n = next(counter)
+        reg = registry or default_registry
+        if not every or n % every or not reg.enabled:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            reg.record(name, time.perf_counter_ns() - start, n if every > 1 else None)
+
+    return wrapper
+
+
+class timer:
+    """
+    Time a block into a registry, with `with timer(name):` or `async with timer(name):`.
+    The duration in seconds is available as `elapsed` after the block.
+    """
+
+    __slots__ = ("name", "registry", "elapsed", "_start")
+
+    def __init__(self, name: str, registry: Optional[ProfileRegistry] = None):
+        self.name = name
+        self.registry = registry
+        self.elapsed = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_ns = time.perf_counter_ns() - self._start
+        self.elapsed = elapsed_ns / 1e9
+        reg = self.registry if self.registry is not None else default_registry
+        if reg.enabled:
+            reg.record(self.name, elapsed_ns)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+def report(format: str = "table", sort: str = "total") -> str:
+    return default_registry.report(format=format, sort=sort)
+
+
+def reset():
+    default_registry.reset()
@@ -1,11 +1,64 @@
-def time_it(func):
-    import time
+import functools
+import inspect
+import time
+from typing import Callable, Optional
 
+from mosaicpy.annotations.profile import ProfileRegistry, _qualified_name, default_registry
+
+
+def time_it(
+    func: Optional[Callable] = None,
+    *,
+    verbose: bool = True,
+    registry: Optional[ProfileRegistry] = None,
+):
+    """
+    Time each call of a function, sync or async, and record it in the profile registry
+    under the function's name, unless the registry is disabled. Use as `@time_it` or
+    `@time_it(verbose=False)`.
+
+    Args:
+        verbose (bool, optional): Print the duration of every call.
+        registry (ProfileRegistry, optional): Defaults to the profile default registry.
+    """
+    if func is None:
+        return functools.partial(time_it, verbose=verbose, registry=registry)
+
+    name = _qualified_name(func)
+
+    def done(start, reg):
+        elapsed_ns = time.perf_counter_ns() - start
+        if reg.enabled:
+            reg.record(name, elapsed_ns)
+        if verbose:
+            print(f"{func.__name__} took {elapsed_ns / 1e9:.4f} seconds")
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            reg = registry if registry is not None else default_registry
+            if not verbose and not reg.enabled:
+                return await func(*args, **kwargs)
+
+            start = time.perf_counter_ns()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                done(start, reg)
+
+        return async_wrapper
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print(f"{func.__name__} took {end - start:.4f} seconds")
-        return result
+        reg = registry if registry is not None else default_registry
+        if not verbose and not reg.enabled:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            done(start, reg)
 
     return wrapper
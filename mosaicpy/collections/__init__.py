@@ -2,6 +2,10 @@ import builtins
 from collections.abc import Iterable
 import itertools
 
+from .parallel import ipmap, pmap, pmap_array
+
+__all__ = ["dict", "groupby", "sample", "ipmap", "pmap", "pmap_array"]
+
 
 def dict(**kwargs):
     return kwargs
@@ -56,40 +60,3 @@ def sample(collection, n, seed=None):
         return random.sample(collection, n)
     else:
         raise TypeError("Input collection must be a list, set, or dictionary.")
-
-
-def pmap(
-    collection, map_func, workers=-1, use_process=False, collect_as_dict=False, show_progress=False
-):
-    if show_progress:
-        from tqdm import tqdm
-
-    if use_process:
-        import multiprocessing
-
-        if workers == -1:
-            workers = multiprocessing.cpu_count()
-
-        with multiprocessing.Pool(workers) as pool:
-            if show_progress:
-                results = list(tqdm(pool.imap(map_func, collection), total=len(collection)))
-            else:
-                results = pool.map(map_func, collection)
-    else:
-        from concurrent.futures import ThreadPoolExecutor
-
-        if workers == -1:
-            import multiprocessing
-
-            workers = multiprocessing.cpu_count()
-
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            if show_progress:
-                results = list(tqdm(executor.map(map_func, collection), total=len(collection)))
-            else:
-                results = list(executor.map(map_func, collection))
-
-    if collect_as_dict:
-        return {k: v for k, v in zip(collection, results)}
-
-    return results
@@ -0,0 +1,520 @@
+import atexit
+import functools
+import itertools
+import math
+import sys
+import threading
+import time
+from collections.abc import Sized
+from typing import Any, NamedTuple, Optional
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# adaptive chunking aims for tasks of roughly this many seconds
+_TARGET_TASK_SECONDS = 0.05
+_MAX_CHUNKSIZE = 4096
+# how often queued items are checked for having started, so their timeout can begin
+_START_POLL_SECONDS = 0.01
+
+
+def _resolve_workers(workers):
+    if workers == -1:
+        import multiprocessing
+
+        return multiprocessing.cpu_count()
+    return workers
+
+
+def _get_executor_class(use_process):
+    if use_process:
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor
+
+
+def get_pool(workers=-1, use_process=True):
+    """
+    Return a process (or thread) pool executor that is kept alive and shared across
+    calls with the same number of workers, until `shutdown_pools` or interpreter exit.
+    """
+    workers = _resolve_workers(workers)
+    key = (use_process, workers)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None or getattr(pool, "_broken", False) or getattr(pool, "_shutdown", False):
+            pool = _get_executor_class(use_process)(max_workers=workers)
+            _POOLS[key] = pool
+        return pool
+
+
+@atexit.register
+def shutdown_pools():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class MapResult(NamedTuple):
+    """The outcome of one item when errors are captured instead of raised."""
+
+    index: int
+    value: Any = None
+    error: Optional[BaseException] = None
+    attempts: int = 1
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _apply_chunk(map_func, items, capture=False):
+    start = time.perf_counter()
+    if capture:
+        results = []
+        for item in items:
+            try:
+                results.append((True, map_func(item)))
+            except Exception as e:
+                results.append((False, e))
+    else:
+        results = [map_func(item) for item in items]
+    return results, time.perf_counter() - start
+
+
+def _load_checkpoint(file_path):
+    import pickle
+
+    completed = {}
+    try:
+        with open(file_path, "rb") as f:
+            while True:
+                try:
+                    index, value = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                completed[index] = value
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+class _Chunker:
+    """
+    Split an iterable into lists of `size` items. With adaptive=True the size is tuned
+    from the measured per-item run time so every task takes about
+    _TARGET_TASK_SECONDS.
+    """
+
+    def __init__(self, collection, size, adaptive=False):
+        self.iterator = iter(collection)
+        self.size = size
+        self.adaptive = adaptive
+
+    def next(self):
+        return list(itertools.islice(self.iterator, self.size)) or None
+
+    def observe(self, num_items, elapsed):
+        if not self.adaptive or num_items == 0:
+            return
+        per_item = max(elapsed / num_items, 1e-7)
+        target = min(max(int(_TARGET_TASK_SECONDS / per_item), 1), _MAX_CHUNKSIZE)
+        self.size = max(1, (self.size + target) // 2)
+
+
+def _make_chunker(collection, chunksize, workers, use_process):
+    if chunksize is not None:
+        return _Chunker(collection, chunksize)
+    if not use_process:
+        return _Chunker(collection, 1)
+    if isinstance(collection, Sized):
+        # same heuristic as multiprocessing.Pool.map
+        return _Chunker(collection, max(1, math.ceil(len(collection) / (workers * 4))))
+    return _Chunker(collection, 1, adaptive=True)
+
+
+def ipmap(
+    collection,
+    map_func,
+    workers=-1,
+    use_process=False,
+    ordered=True,
+    max_in_flight=None,
+    chunksize=None,
+    persistent=False,
+    retries=0,
+    backoff=1.0,
+    timeout=None,
+    capture_errors=False,
+    checkpoint=None,
+    show_progress=False,
+):
+    """
+    Lazily apply `map_func` to every item of `collection` in parallel.
+
+    Items are pulled from `collection` only as workers free up, so it can be any
+    iterable, including generators of unknown length.
+
+    Args:
+        collection (Iterable): The items to map.
+        map_func (callable): The function to apply. Must be picklable if use_process=True.
+        workers (int, optional): The number of workers. -1 means one per CPU.
+        use_process (bool, optional): Use processes instead of threads. Defaults to False.
+        ordered (bool, optional): Yield results in input order. If False, yield them as
+            they complete. Defaults to True.
+        max_in_flight (int, optional): The maximum number of submitted tasks not yet
+            yielded. Defaults to twice the number of workers.
+        chunksize (int, optional): Items sent to a worker per task. By default threads
+            get one item per task, processes get Pool.map's heuristic when the length is
+            known and an adaptively tuned size otherwise.
+        persistent (bool, optional): Reuse a shared pool from `get_pool` instead of
+            starting a new one per call. Defaults to False.
+        retries (int, optional): Retry a failed item up to this many times, waiting
+            `backoff * 2 ** (attempt - 1)` seconds before each retry. Defaults to 0.
+        backoff (float, optional): The base retry delay in seconds. Defaults to 1.
+        timeout (float, optional): Fail an item (and possibly retry it) when it has not
+            finished this many seconds after a worker started it; time spent queued
+            does not count. Forces one item per task. A timed-out call is abandoned, not
+            interrupted, and keeps its worker busy until it returns.
+        capture_errors (bool, optional): Yield a MapResult per item, holding either the
+            value or the final exception, instead of raising. Defaults to False.
+        checkpoint (str, optional): A file to which every successful (index, value) is
+            appended with pickle. Items already in it are not run again, so a restarted
+            run over the same input skips finished work.
+        show_progress (bool, optional): Show a tqdm progress bar. Defaults to False.
+
+    Yields:
+        The results of `map_func`, or MapResult envelopes if capture_errors=True.
+    """
+    import heapq
+    import pickle
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    workers = _resolve_workers(workers)
+    max_in_flight = max_in_flight or workers * 2
+    capture = capture_errors or retries > 0 or timeout is not None
+    if timeout is not None:
+        chunksize = 1
+
+    progress = None
+    if show_progress:
+        from tqdm import tqdm
+
+        progress = tqdm(total=len(collection) if isinstance(collection, Sized) else None)
+
+    completed = {}
+    checkpoint_file = None
+    if checkpoint is not None:
+        completed = _load_checkpoint(checkpoint)
+        checkpoint_file = open(checkpoint, "ab")
+
+    chunker = _make_chunker(collection, chunksize, workers, use_process)
+    if persistent:
+        executor = get_pool(workers, use_process)
+    else:
+        executor = _get_executor_class(use_process)(max_workers=workers)
+
+    counter = itertools.count()
+    pending = {}
+    retry_queue = []
+    ready = {}
+    outputs = deque()
+    next_index = 0
+    exhausted = False
+
+    def emit(index, value, error=None, attempts=1):
+        if capture_errors:
+            value = MapResult(index, value, error, attempts)
+        if ordered:
+            ready[index] = value
+        else:
+            outputs.append(value)
+        if progress is not None:
+            progress.update(1)
+
+    def submit(indices, items, attempt):
+        future = executor.submit(_apply_chunk, map_func, items, capture)
+        # the deadline is set by start_clocks once a worker picks the item up
+        pending[future] = (indices, items, attempt, None)
+
+    def start_clocks(now):
+        queued = False
+        for future, (indices, items, attempt, deadline) in list(pending.items()):
+            if deadline is not None:
+                continue
+            if future.running():
+                pending[future] = (indices, items, attempt, now + timeout)
+            else:
+                queued = True
+        return queued
+
+    def fill():
+        nonlocal exhausted
+        while not exhausted and len(pending) + len(retry_queue) < max_in_flight:
+            if ordered and len(ready) >= max_in_flight * chunker.size:
+                return
+            chunk = chunker.next()
+            if chunk is None:
+                exhausted = True
+                return
+
+            indices, items = [], []
+            for item in chunk:
+                index = next(counter)
+                if index in completed:
+                    emit(index, completed.pop(index), attempts=0)
+                else:
+                    indices.append(index)
+                    items.append(item)
+            if items:
+                submit(indices, items, 1)
+
+    def succeed(index, value, attempt):
+        if checkpoint_file is not None:
+            pickle.dump((index, value), checkpoint_file)
+            checkpoint_file.flush()
+        emit(index, value, attempts=attempt)
+
+    def fail(index, item, error, attempt):
+        if attempt <= retries:
+            delay = backoff * 2 ** (attempt - 1)
+            heapq.heappush(retry_queue, (time.monotonic() + delay, index, item, attempt + 1))
+        elif capture_errors:
+            emit(index, None, error, attempt)
+        else:
+            raise error
+
+    def handle(future):
+        indices, items, attempt, _ = pending.pop(future)
+        try:
+            results, elapsed = future.result()
+        except Exception as e:
+            if not capture:
+                raise
+            results, elapsed = [(False, e)] * len(items), 0
+        chunker.observe(len(results), elapsed)
+
+        if not capture:
+            for index, value in zip(indices, results):
+                succeed(index, value, attempt)
+            return
+
+        for index, item, (ok, value) in zip(indices, items, results):
+            if ok:
+                succeed(index, value, attempt)
+            else:
+                fail(index, item, value, attempt)
+
+    try:
+        while True:
+            if ordered:
+                while next_index in ready:
+                    yield ready.pop(next_index)
+                    next_index += 1
+            else:
+                while outputs:
+                    yield outputs.popleft()
+
+            fill()
+            if not pending and not retry_queue:
+                if ready or outputs:
+                    continue
+                break
+
+            now = time.monotonic()
+            while retry_queue and retry_queue[0][0] <= now:
+                _, index, item, attempt = heapq.heappop(retry_queue)
+                submit([index], [item], attempt)
+
+            wake_times = []
+            if timeout is not None:
+                if start_clocks(now):
+                    wake_times.append(now + _START_POLL_SECONDS)
+                wake_times += [entry[3] for entry in pending.values() if entry[3] is not None]
+            if retry_queue:
+                wake_times.append(retry_queue[0][0])
+            wait_timeout = max(min(wake_times) - now, 0) if wake_times else None
+
+            if not pending:
+                time.sleep(wait_timeout or 0)
+                continue
+
+            done, _ = wait(list(pending), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                handle(future)
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, (indices, items, attempt, deadline) in list(pending.items()):
+                    if deadline is not None and deadline <= now and not future.done():
+                        future.cancel()
+                        del pending[future]
+                        error = TimeoutError(f"Item {indices[0]} timed out after {timeout}s")
+                        fail(indices[0], items[0], error, attempt)
+    finally:
+        if persistent:
+            for future in pending:
+                future.cancel()
+        else:
+            executor.shutdown(wait=timeout is None, cancel_futures=True)
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+        if progress is not None:
+            progress.close()
+
+
+def pmap(
+    collection,
+    map_func,
+    workers=-1,
+    use_process=False,
+    collect_as_dict=False,
+    show_progress=False,
+    chunksize=None,
+    persistent=False,
+    retries=0,
+    backoff=1.0,
+    timeout=None,
+    capture_errors=False,
+    checkpoint=None,
+):
+    if collect_as_dict and not isinstance(collection, Sized):
+        collection = list(collection)
+
+    results = list(
+        ipmap(
+            collection,
+            map_func,
+            workers=workers,
+            use_process=use_process,
+            chunksize=chunksize,
+            persistent=persistent,
+            retries=retries,
+            backoff=backoff,
+            timeout=timeout,
+            capture_errors=capture_errors,
+            checkpoint=checkpoint,
+            show_progress=show_progress,
+        )
+    )
+
+    if collect_as_dict:
+        return {k: v for k, v in zip(collection, results)}
+
+    return results
+
+
+def _attach_array(spec):
+    from multiprocessing import shared_memory
+
+    import numpy as np
+
+    name, shape, dtype = spec
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _map_shared_range(map_func, input_spec, output_spec, bounds):
+    input_shm, inputs = _attach_array(input_spec)
+    output_shm, outputs = _attach_array(output_spec)
+    try:
+        for i in range(*bounds):
+            outputs[i] = map_func(inputs[i])
+    finally:
+        del inputs, outputs
+        input_shm.close()
+        output_shm.close()
+
+
+def pmap_array(
+    array,
+    map_func,
+    workers=-1,
+    out_shape=None,
+    out_dtype=None,
+    chunksize=None,
+    persistent=False,
+    show_progress=False,
+):
+    """
+    Apply `map_func` to every row of a NumPy array in worker processes.
+
+    The input and output arrays live in `multiprocessing.shared_memory`, so workers
+    read rows and write results in place and only (start, end) ranges are pickled.
+
+    Args:
+        array (np.ndarray): The input; `map_func` receives `array[i]`.
+        map_func (callable): A picklable function returning an array-like per row.
+        workers (int, optional): The number of processes. -1 means one per CPU.
+        out_shape (tuple, optional): The shape of one output row. Inferred by calling
+            `map_func` on the first row when not given.
+        out_dtype (optional): The output dtype. Inferred like `out_shape`.
+        chunksize (int, optional): Rows per task. Defaults to Pool.map's heuristic.
+        persistent (bool, optional): Reuse a shared pool from `get_pool`.
+
+    Returns:
+        np.ndarray: An array of shape (len(array), *out_shape).
+    """
+    from multiprocessing import shared_memory
+
+    import numpy as np
+
+    array = np.ascontiguousarray(array)
+    workers = _resolve_workers(workers)
+
+    if out_shape is None or out_dtype is None:
+        if len(array) == 0:
+            raise ValueError("out_shape and out_dtype are required for an empty array")
+        sample = np.asarray(map_func(array[0]))
+        out_shape = sample.shape if out_shape is None else out_shape
+        out_dtype = sample.dtype if out_dtype is None else out_dtype
+
+    output_shape = (len(array), *out_shape)
+    output_nbytes = math.prod(output_shape) * np.dtype(out_dtype).itemsize
+    if len(array) == 0:
+        return np.empty(output_shape, dtype=out_dtype)
+
+    if chunksize is None:
+        chunksize = max(1, math.ceil(len(array) / (workers * 4)))
+    ranges = [
+        (start, min(start + chunksize, len(array))) for start in range(0, len(array), chunksize)
+    ]
+
+    input_shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    output_shm = shared_memory.SharedMemory(create=True, size=max(output_nbytes, 1))
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=input_shm.buf)[:] = array
+
+        task = functools.partial(
+            _map_shared_range,
+            map_func,
+            (input_shm.name, array.shape, array.dtype.str),
+            (output_shm.name, output_shape, np.dtype(out_dtype).str),
+        )
+        for _ in ipmap(
+            ranges,
+            task,
+            workers=workers,
+            use_process=True,
+            chunksize=1,
+            persistent=persistent,
+            show_progress=show_progress,
+        ):
+            pass
+
+        return np.ndarray(output_shape, dtype=out_dtype, buffer=output_shm.buf).copy()
+    finally:
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
@@ -1,9 +1,31 @@
 from abc import ABC, abstractmethod
+import asyncio
+import copy
 import logging
+import threading
 from typing import Any, Optional, Union
 
 from mosaicpy.collections import dict as mdict
-from mosaicpy.llm.schema import BaseConfig, ChatResponse, Event, SimpleMessage, TokenUsage
+from mosaicpy.llm.cache import ResponseCache, make_cache_key
+from mosaicpy.llm.history import (
+    ConversationHistory,
+    KeepLastN,
+    SlidingWindow,
+    Summarize,
+    format_transcript,
+)
+from mosaicpy.llm.metrics import CallMetrics, MetricsRecorder
+from mosaicpy.llm.prompt import replace_magic_placeholders
+from mosaicpy.llm.retry import RetryAttempt, RetryPolicy, get_retry_after
+from mosaicpy.llm.schema import (
+    BaseConfig,
+    ChatResponse,
+    Event,
+    SimpleMessage,
+    TextDelta,
+    TokenUsage,
+    UsageDelta,
+)
 from mosaicpy.utils.event import SimpleEventManager
 
 logger = logging.getLogger(__name__)
@@ -25,13 +47,49 @@ class LLMEventManager(SimpleEventManager):
     def publish_finish_chat(self, repsponse: ChatResponse):
         self.publish(Event.FINISH_CHAT, response=repsponse)
 
+    def on_rate_limit(self, callback):
+        return self.subscribe(
+            Event.RATE_LIMIT,
+            lambda data: callback(data["error"], data["retry_after"]),
+        )
+
+    def publish_rate_limit(self, error: Exception):
+        self.publish(Event.RATE_LIMIT, error=error, retry_after=get_retry_after(error))
+
+    def on_retry(self, callback):
+        return self.subscribe(Event.RETRY, lambda data: callback(data["attempt"]))
+
+    def publish_retry(self, attempt: RetryAttempt):
+        self.publish(Event.RETRY, attempt=attempt)
+
+    def on_call_metrics(self, callback):
+        return self.subscribe(Event.CALL_METRICS, lambda data: callback(data["metrics"]))
+
+    def publish_call_metrics(self, metrics: CallMetrics):
+        self.publish(Event.CALL_METRICS, metrics=metrics)
+
+
+SUMMARIZE_PROMPT = (
+    "Summarize the following conversation in a few sentences, keeping every fact, "
+    "decision and open question needed to continue it:\n\n"
+)
+
 
 class Agent(ABC):
     ROLE_USER = "user"
     ROLE_ASSISTANT = "assistant"
 
-    def __init__(self, config: BaseConfig, tools: list[Any], **kwargs):
+    def __init__(
+        self,
+        config: BaseConfig,
+        tools: list[Any],
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[MetricsRecorder] = None,
+        **kwargs,
+    ):
         self.config = config
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else MetricsRecorder()
 
         if isinstance(tools, list):
             tools = {tool.name: tool for tool in tools}
@@ -40,20 +98,108 @@ class Agent(ABC):
         self.tools = tools
 
         self.token_usage = TokenUsage()
-        self.conversation_state = []
+        self.conversation_state = ConversationHistory(
+            max_tokens=config.max_history_tokens,
+            strategy=self._create_history_strategy(),
+            encoding_name=config.model_name,
+        )
         self.event_manager = LLMEventManager()
+        self.retry_policy = RetryPolicy.from_config(config)
+        self._usage_lock = threading.Lock()
 
         def on_finish_chat(response: ChatResponse):
-            self.token_usage.update(response.usage)
-            self.conversation_state.append(
-                SimpleMessage(role=self.ROLE_USER, content=response.input_contents)
-            )
-            self.conversation_state.append(
-                SimpleMessage.from_text(self.ROLE_ASSISTANT, response.content)
+            with self._usage_lock:
+                self.token_usage.update(response.usage)
+
+            if not self.config.keep_conversation_state:
+                return
+            # trimming may summarize with a request, which must not run inside the
+            # listener (achat fires it on the event loop); it runs before the next request
+            self.conversation_state.extend(
+                [
+                    SimpleMessage(role=self.ROLE_USER, content=response.input_contents),
+                    SimpleMessage.from_text(self.ROLE_ASSISTANT, response.content),
+                ],
+                trim=False,
             )
 
         self.on_finish_chat(on_finish_chat)
 
+    def _create_history_strategy(self):
+        strategy = self.config.history_strategy
+        if strategy == "sliding_window":
+            return SlidingWindow()
+        elif strategy == "keep_last":
+            return KeepLastN(self.config.history_keep_last)
+        elif strategy == "summarize":
+            return Summarize(
+                self._summarize_history,
+                keep_last=self.config.history_keep_last,
+                asummarizer=self._asummarize_history,
+            )
+        else:
+            raise ValueError(f"Unknown history strategy: {strategy}")
+
+    def _on_retry(self, attempt: RetryAttempt):
+        self.event_manager.publish_retry(attempt)
+        if getattr(attempt.error, "status_code", None) == 429:
+            self.event_manager.publish_rate_limit(attempt.error)
+
+    def _start_call(self) -> CallMetrics:
+        return CallMetrics(self.config.model_name)
+
+    def _retry_callback(self, metrics: CallMetrics):
+        metrics.on_request()
+
+        def on_retry(attempt):
+            metrics.on_retry(attempt)
+            self._on_retry(attempt)
+
+        return on_retry
+
+    def _finish_call(self, metrics: CallMetrics, usage: TokenUsage):
+        self.metrics.record(metrics.finish(usage))
+        self.event_manager.publish_call_metrics(metrics)
+
+    def _compact_history(self):
+        if self.config.keep_conversation_state:
+            self.conversation_state.trim()
+
+    async def _acompact_history(self):
+        if self.config.keep_conversation_state:
+            await self.conversation_state.atrim()
+
+    def _create_summarizer(self) -> "Agent":
+        """
+        A stateless copy of this agent, whose calls stay out of its events, metrics and
+        retry stats.
+        """
+        agent = copy.copy(self)
+        agent.config = self.config.model_copy(
+            update=dict(keep_conversation_state=False, stream=False)
+        )
+        agent.event_manager = LLMEventManager()
+        agent.metrics = MetricsRecorder()
+        agent.retry_policy = RetryPolicy.from_config(agent.config)
+        return agent
+
+    def _add_summary_usage(self, response: ChatResponse) -> str:
+        with self._usage_lock:
+            self.token_usage.update(response.usage)
+        return response.content
+
+    def _summarize_history(self, messages) -> str:
+        response = self._create_summarizer().chat(
+            SUMMARIZE_PROMPT + format_transcript(messages), return_all=True
+        )
+        return self._add_summary_usage(response)
+
+    async def _asummarize_history(self, messages) -> str:
+        response = await self._create_summarizer().achat(
+            SUMMARIZE_PROMPT + format_transcript(messages), return_all=True
+        )
+        return self._add_summary_usage(response)
+
     def get_token_usage(self) -> TokenUsage:
         return self.token_usage
 
@@ -65,6 +211,59 @@ class Agent(ABC):
     def on_finish_chat(self, callback):
         self.event_manager.on_finish_chat(callback)
 
+    def on_rate_limit(self, callback):
+        """
+        Call `callback(error, retry_after)` whenever a request hits a rate limit,
+        before the agent backs off and retries.
+        """
+        return self.event_manager.on_rate_limit(callback)
+
+    def on_call_metrics(self, callback):
+        """
+        Call `callback(metrics)` with the CallMetrics of every finished call.
+        """
+        return self.event_manager.on_call_metrics(callback)
+
+    def _get_tool_tokens(self) -> int:
+        """
+        The prompt tokens of the tool definitions sent with each request.
+        """
+        return 0
+
+    def _get_system_prompt(self) -> str:
+        if self.config.enable_magic_placeholders:
+            return replace_magic_placeholders(self.config.system_prompt)
+        return self.config.system_prompt
+
+    def _get_cache_key(self, request: dict) -> Optional[str]:
+        # only deterministic requests are worth replaying
+        if self.cache is None or request.get("temperature"):
+            return None
+        return make_cache_key(request)
+
+    def _get_cached(self, cache_key, response_cls):
+        """
+        Return the cached response for `cache_key` and the stream tokens it was
+        delivered in, or (None, None) on a miss.
+        """
+        if cache_key is None:
+            return None, None
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None, None
+        return response_cls.model_validate(cached["response"]), cached["tokens"]
+
+    def _set_cached(self, cache_key, response, tokens):
+        if cache_key is None:
+            return
+        self.cache.set(cache_key, dict(response=response.model_dump(mode="json"), tokens=tokens))
+
+    def _replay_tokens(self, tokens, metrics):
+        metrics.on_cache_hit()
+        for token in tokens:
+            metrics.on_token()
+            self.event_manager.publish_new_chat_token(token)
+
     def _add_history(self, role, content):
         if not self.config.keep_conversation_state:
             return
@@ -73,7 +272,7 @@ class Agent(ABC):
             message = mdict(role=role, content=[mdict(type="text", text=content)])
         elif isinstance(content, list):
             message = mdict(role=role, content=content)
-        self.conversation_state.append(message)
+        self.conversation_state.append(message, trim=False)
 
     def add_ai_history(self, history_message):
         self._add_history(self.ROLE_ASSISTANT, history_message)
@@ -81,9 +280,14 @@ class Agent(ABC):
     def add_user_history(self, history_message):
         self._add_history(self.ROLE_USER, history_message)
 
-    @abstractmethod
     def _assemble_request_messages(self, user_contents):
-        pass
+        msgs = []
+        if self.config.keep_conversation_state:
+            msgs.extend(self.conversation_state)
+
+        msgs.append(SimpleMessage(role=self.ROLE_USER, content=user_contents))
+
+        return msgs
 
     @abstractmethod
     def chat(
@@ -100,6 +304,92 @@ class Agent(ABC):
         """
         pass
 
+    async def achat(
+        self,
+        user_input: str,
+        image: Optional[str] = None,
+        return_all: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: int = 1024,
+        **kwargs,
+    ) -> Union[str, ChatResponse]:
+        """
+        Async version of `chat`. Agents without a native async client run `chat` in a
+        worker thread.
+        """
+        return await asyncio.to_thread(
+            self.chat,
+            user_input,
+            image=image,
+            return_all=return_all,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+
+    def chat_stream(
+        self,
+        user_input: str,
+        image: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: int = 1024,
+        **kwargs,
+    ):
+        """
+        Yield TextDelta, ToolCallDelta and UsageDelta events as the response arrives,
+        then the final ChatResponse. Closing the generator early closes the underlying
+        HTTP stream.
+        """
+        response = self.chat(
+            user_input,
+            image=image,
+            return_all=True,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+        yield TextDelta(response.content)
+        yield UsageDelta(response.usage)
+        yield response
+
+    async def achat_stream(
+        self,
+        user_input: str,
+        image: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: int = 1024,
+        **kwargs,
+    ):
+        """
+        Async version of `chat_stream`.
+        """
+        response = await self.achat(
+            user_input,
+            image=image,
+            return_all=True,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+        yield TextDelta(response.content)
+        yield UsageDelta(response.usage)
+        yield response
+
+    async def astream(
+        self,
+        user_input: str,
+        image: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: int = 1024,
+        **kwargs,
+    ):
+        """
+        Yield the text of the response as it is generated.
+        """
+        yield await self.achat(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        )
+
 
 def get_agent(agent_type: str, **kwargs):
     if agent_type == "openai":
@@ -110,5 +400,12 @@ def get_agent(agent_type: str, **kwargs):
         from mosaicpy.llm.anthropic.agent import AnthropicAgent
 
         return AnthropicAgent(**kwargs)
+    elif agent_type == "router":
+        from mosaicpy.llm.router import RouterAgent
+
+        return RouterAgent(**kwargs)
     else:
         raise ValueError(f"Unknown agent type: {agent_type}")
+
+
+from mosaicpy.llm.batch import batch_chat  # noqa: E402, F401
@@ -3,9 +3,8 @@ import imghdr
 import logging
 import mimetypes
 import os
-import time
 from typing import Any
-from anthropic import Anthropic, RateLimitError
+from anthropic import Anthropic, AsyncAnthropic
 from mosaicpy.collections import dict as mdict
 import urllib
 
@@ -19,12 +18,13 @@ from anthropic.types import (
     MessageStopEvent,
 )
 from mosaicpy.llm import Agent
-from mosaicpy.llm.prompt import replace_magic_placeholders
+from mosaicpy.llm.client import get_shared_async_client, get_shared_client
 from mosaicpy.llm.schema import (
     BaseConfig,
     ChatResponse,
-    SimpleMessage,
+    TextDelta,
     TokenUsage,
+    UsageDelta,
 )
 
 logger = logging.getLogger(__name__)
@@ -56,18 +56,48 @@ def _create_image_content(image_path):
     raise Exception(f"Invalid image path: {image_path}")
 
 
+def _to_token_usage(usage):
+    return TokenUsage(
+        prompt=usage.input_tokens,
+        completion=usage.output_tokens,
+        cache_read=getattr(usage, "cache_read_input_tokens", None) or 0,
+        cache_write=getattr(usage, "cache_creation_input_tokens", None) or 0,
+    )
+
+
 def _assemble_chat_response(msg: Message, user_contents: list[dict]):
     return ChatResponse(
         content=msg.content[0].text,
         model=msg.model,
         finish_reason="completed",
-        usage=TokenUsage(prompt=msg.usage.input_tokens, completion=msg.usage.output_tokens),
+        usage=_to_token_usage(msg.usage),
         input_contents=user_contents,
     )
 
 
+CACHE_CONTROL = {"type": "ephemeral"}
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+
+
+def _with_cache_control(message):
+    """
+    Return a copy of `message` whose last content block is a cache breakpoint.
+    """
+    if hasattr(message, "model_dump"):
+        message = message.model_dump(exclude_none=True)
+    else:
+        message = dict(message)
+    content = message["content"]
+    if isinstance(content, str):
+        content = [mdict(type="text", text=content)]
+    message["content"] = [*content[:-1], {**content[-1], "cache_control": CACHE_CONTROL}]
+    return message
+
+
 class AgentConfig(BaseConfig):
     model_name: str = "claude-3-haiku-20240307"
+    # mark the system prompt and prior history as cacheable prefixes
+    prompt_caching: bool = False
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -82,72 +112,251 @@ class AnthropicAgent(Agent):
         if config.verbose:
             logger.setLevel(logging.DEBUG)
 
-        self._client = Anthropic(
-            api_key=api_key or os.environ.get("ANTHROPIC_API_KEY", ""),
+        self._api_key = api_key or os.environ.get("ANTHROPIC_API_KEY", "")
+
+    def _client_key(self):
+        return ("anthropic", self.config.base_url, self._api_key)
+
+    @property
+    def _client(self):
+        return get_shared_client(
+            self._client_key(),
+            lambda: Anthropic(api_key=self._api_key, base_url=self.config.base_url, max_retries=0),
+        )
+
+    def _get_async_client(self):
+        return get_shared_async_client(
+            self._client_key(),
+            lambda: AsyncAnthropic(
+                api_key=self._api_key, base_url=self.config.base_url, max_retries=0
+            ),
         )
 
     def _get_system_msg(self):
-        if self.config.enable_magic_placeholders:
-            return replace_magic_placeholders(self.config.system_prompt)
-        else:
-            return self.config.system_prompt
+        return self._get_system_prompt()
+
+    def _prepare_request(self, user_input, image, kwargs):
+        if kwargs:
+            user_input = user_input.format(**kwargs)
+        user_contents = [mdict(type="text", text=user_input)]
+        if image is not None:
+            user_contents.append(_create_image_content(image))
+
+        return user_contents, self._assemble_request_messages(user_contents)
+
+    def _handle_stream_event(self, message, event):
+        """
+        Apply one stream event to the message being built and return it, along with
+        the text delta carried by the event, if any.
+        """
+        delta_text = None
+        if isinstance(event, MessageStartEvent):
+            message = Message(
+                id=event.message.id,
+                model=event.message.model,
+                role=event.message.role,
+                type="message",
+                content=[],
+                usage=event.message.usage,
+            )
+        elif isinstance(event, ContentBlockStartEvent):
+            message.content.append(event.content_block)
+        elif isinstance(event, ContentBlockDeltaEvent):
+            delta_text = event.delta.text
+            self.event_manager.publish_new_chat_token(delta_text)
+            message.content[-1].text += delta_text
+        elif isinstance(event, ContentBlockStopEvent):
+            pass
+        elif isinstance(event, MessageDeltaEvent):
+            message.usage.output_tokens = event.usage.output_tokens
+        elif isinstance(event, MessageStopEvent):
+            pass
+
+        return message, delta_text
+
+    def _handle_stream(self, stream, metrics):
+        message, tokens = None, []
+        for event in stream:
+            message, delta_text = self._handle_stream_event(message, event)
+            if delta_text:
+                metrics.on_token()
+                tokens.append(delta_text)
+
+        return message, tokens
+
+    def _build_message_kwargs(self, messages, temperature=None, max_tokens=None, stream=None):
+        system = self._get_system_msg()
+
+        extra = {}
+        if getattr(self.config, "prompt_caching", False):
+            # breakpoints after the system prompt and after the previous turn, so each
+            # request reads the prefix the last one wrote
+            system = [mdict(type="text", text=system, cache_control=CACHE_CONTROL)]
+            if len(messages) > 1:
+                messages = [*messages[:-2], _with_cache_control(messages[-2]), messages[-1]]
+            extra["extra_headers"] = {"anthropic-beta": PROMPT_CACHING_BETA}
+
+        return dict(
+            model=self.config.model_name,
+            system=system,
+            messages=messages,
+            stream=self.config.stream if stream is None else stream,
+            max_tokens=max_tokens or self.config.max_tokens,
+            temperature=temperature or self.config.temperature,
+            **extra,
+        )
 
-    def _assemble_request_messages(self, user_contents):
-        msgs = []
-        if self.config.keep_conversation_state:
-            msgs.extend(self.conversation_state)
+    def _create_message(self, messages, metrics, temperature=None, max_tokens=None, stream=None):
+        kwargs = self._build_message_kwargs(messages, temperature, max_tokens, stream)
+        return self.retry_policy.call(
+            lambda: self._client.messages.create(**kwargs), self._retry_callback(metrics)
+        )
 
-        msgs.append(SimpleMessage(role=self.ROLE_USER, content=user_contents))
+    async def _acreate_message(
+        self, messages, metrics, temperature=None, max_tokens=None, stream=None
+    ):
+        kwargs = self._build_message_kwargs(messages, temperature, max_tokens, stream)
+        return await self.retry_policy.acall(
+            lambda: self._get_async_client().messages.create(**kwargs),
+            self._retry_callback(metrics),
+        )
 
-        return msgs
+    def _get_message(self, messages, metrics, temperature=None, max_tokens=None):
+        cache_key = self._get_cache_key(
+            self._build_message_kwargs(messages, temperature, max_tokens)
+        )
+        message, tokens = self._get_cached(cache_key, Message)
+        if message is not None:
+            if self.config.stream:
+                self._replay_tokens(tokens, metrics)
+            return message
+
+        res = self._create_message(
+            messages, metrics, max_tokens=max_tokens, temperature=temperature
+        )
 
-    def _handle_stream(self, stream):
-        message = None
-        for event in stream:
-            if isinstance(event, MessageStartEvent):
-                message = Message(
-                    id=event.message.id,
-                    model=event.message.model,
-                    role=event.message.role,
-                    type="message",
-                    content=[],
-                    usage=event.message.usage,
-                )
-            elif isinstance(event, ContentBlockStartEvent):
-                message.content.append(event.content_block)
-            elif isinstance(event, ContentBlockDeltaEvent):
-                delta_text = event.delta.text
-                self.event_manager.publish_new_chat_token(delta_text)
-                message.content[-1].text += delta_text
-            elif isinstance(event, ContentBlockStopEvent):
-                pass
-            elif isinstance(event, MessageDeltaEvent):
-                message.usage.output_tokens = event.usage.output_tokens
-            elif isinstance(event, MessageStopEvent):
-                pass
+        if self.config.stream:
+            message, tokens = self._handle_stream(res, metrics)
+        else:
+            message, tokens = res, [res.content[0].text]
 
+        metrics.on_response()
+        self._set_cached(cache_key, message, tokens)
         return message
 
-    def _create_message(self, messages, temperature=None, max_tokens=None, retry=5):
+    async def _aget_message(self, messages, metrics, temperature=None, max_tokens=None):
+        cache_key = self._get_cache_key(
+            self._build_message_kwargs(messages, temperature, max_tokens)
+        )
+        message, tokens = self._get_cached(cache_key, Message)
+        if message is not None:
+            if self.config.stream:
+                self._replay_tokens(tokens, metrics)
+            return message
+
+        res = await self._acreate_message(
+            messages, metrics, max_tokens=max_tokens, temperature=temperature
+        )
+
+        if self.config.stream:
+            message, tokens = None, []
+            async for event in res:
+                message, delta_text = self._handle_stream_event(message, event)
+                if delta_text:
+                    metrics.on_token()
+                    tokens.append(delta_text)
+        else:
+            message, tokens = res, [res.content[0].text]
+
+        metrics.on_response()
+        self._set_cached(cache_key, message, tokens)
+        return message
+
+    def _event_delta(self, message, event, delta_text):
+        if delta_text:
+            return TextDelta(delta_text)
+        if isinstance(event, MessageDeltaEvent):
+            return UsageDelta(_to_token_usage(message.usage))
+        return None
+
+    def _replay_deltas(self, message, tokens, metrics):
+        metrics.on_cache_hit()
+        for token in tokens:
+            metrics.on_token()
+            self.event_manager.publish_new_chat_token(token)
+            yield TextDelta(token)
+        yield UsageDelta(_to_token_usage(message.usage))
+
+    def _stream_message(self, messages, metrics, temperature=None, max_tokens=None):
+        """
+        Yield the delta events of a streamed message, then the complete Message.
+        """
+        cache_key = self._get_cache_key(
+            self._build_message_kwargs(messages, temperature, max_tokens)
+        )
+        message, tokens = self._get_cached(cache_key, Message)
+        if message is not None:
+            yield from self._replay_deltas(message, tokens, metrics)
+            yield message
+            return
+
+        stream = self._create_message(messages, metrics, temperature, max_tokens, stream=True)
+
+        message, tokens = None, []
         try:
-            return self._client.messages.create(
-                model=self.config.model_name,
-                system=self._get_system_msg(),
-                messages=messages,
-                stream=self.config.stream,
-                max_tokens=max_tokens or self.config.max_tokens,
-                temperature=temperature or self.config.temperature,
-            )
-        except RateLimitError as e:
-            if retry > 0:
-                backoff_time = 2 ** (5 - retry)
-                logger.warning(f"Rate limit exceeded. Retrying in {backoff_time} seconds.")
-                time.sleep(backoff_time)
-                return self._create_message(
-                    messages, temperature=temperature, max_tokens=max_tokens, retry=retry - 1
-                )
-            else:
-                raise e
+            for event in stream:
+                message, delta_text = self._handle_stream_event(message, event)
+                if delta_text:
+                    metrics.on_token()
+                    tokens.append(delta_text)
+                delta = self._event_delta(message, event, delta_text)
+                if delta is not None:
+                    yield delta
+        finally:
+            stream.close()
+
+        metrics.on_response()
+        self._set_cached(cache_key, message, tokens)
+        yield message
+
+    async def _astream_message(self, messages, metrics, temperature=None, max_tokens=None):
+        cache_key = self._get_cache_key(
+            self._build_message_kwargs(messages, temperature, max_tokens)
+        )
+        message, tokens = self._get_cached(cache_key, Message)
+        if message is not None:
+            for delta in self._replay_deltas(message, tokens, metrics):
+                yield delta
+            yield message
+            return
+
+        stream = await self._acreate_message(
+            messages, metrics, max_tokens=max_tokens, temperature=temperature, stream=True
+        )
+
+        message, tokens = None, []
+        try:
+            async for event in stream:
+                message, delta_text = self._handle_stream_event(message, event)
+                if delta_text:
+                    metrics.on_token()
+                    tokens.append(delta_text)
+                delta = self._event_delta(message, event, delta_text)
+                if delta is not None:
+                    yield delta
+        finally:
+            await stream.close()
+
+        metrics.on_response()
+        self._set_cached(cache_key, message, tokens)
+        yield message
+
+    def _finish_chat(self, message, user_contents, metrics):
+        response = _assemble_chat_response(message, user_contents)
+        self._finish_call(metrics, response.usage)
+        self.event_manager.publish_finish_chat(response)
+
+        return response
 
     def chat(
         self,
@@ -158,23 +367,68 @@ class AnthropicAgent(Agent):
         max_tokens=None,
         **kwargs,
     ):
-        if kwargs:
-            user_input = user_input.format(**kwargs)
-        user_contents = [mdict(type="text", text=user_input)]
-        if image is not None:
-            user_contents.append(_create_image_content(image))
+        self._compact_history()
+        metrics = self._start_call()
+        user_contents, messages = self._prepare_request(user_input, image, kwargs)
 
-        messages = self._assemble_request_messages(user_contents)
+        message = self._get_message(
+            messages, metrics, max_tokens=max_tokens, temperature=temperature
+        )
+        response = self._finish_chat(message, user_contents, metrics)
 
-        res = self._create_message(messages, max_tokens=max_tokens, temperature=temperature)
+        return response if return_all else response.content
 
-        message = None
-        if self.config.stream:
-            message = self._handle_stream(res)
-        else:
-            message = res
+    async def achat(
+        self,
+        user_input,
+        image=None,
+        return_all=False,
+        temperature=None,
+        max_tokens=None,
+        **kwargs,
+    ):
+        await self._acompact_history()
+        metrics = self._start_call()
+        user_contents, messages = self._prepare_request(user_input, image, kwargs)
 
-        response = _assemble_chat_response(message, user_contents)
-        self.event_manager.publish_finish_chat(response)
+        message = await self._aget_message(
+            messages, metrics, max_tokens=max_tokens, temperature=temperature
+        )
+        response = self._finish_chat(message, user_contents, metrics)
 
         return response if return_all else response.content
+
+    def chat_stream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        self._compact_history()
+        metrics = self._start_call()
+        user_contents, messages = self._prepare_request(user_input, image, kwargs)
+
+        for item in self._stream_message(messages, metrics, temperature, max_tokens):
+            if isinstance(item, Message):
+                message = item
+            else:
+                yield item
+
+        yield self._finish_chat(message, user_contents, metrics)
+
+    async def achat_stream(
+        self, user_input, image=None, temperature=None, max_tokens=None, **kwargs
+    ):
+        await self._acompact_history()
+        metrics = self._start_call()
+        user_contents, messages = self._prepare_request(user_input, image, kwargs)
+
+        async for item in self._astream_message(messages, metrics, temperature, max_tokens):
+            if isinstance(item, Message):
+                message = item
+            else:
+                yield item
+
+        yield self._finish_chat(message, user_contents, metrics)
+
+    async def astream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        async for item in self.achat_stream(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        ):
+            if isinstance(item, TextDelta):
+                yield item.text
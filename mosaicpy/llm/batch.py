@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from typing import Iterable, Optional, Union
+
+from mosaicpy.collections.parallel import ipmap
+from mosaicpy.llm.metrics import queued_since
+from mosaicpy.llm.schema import ChatResponse, Event, SimpleMessage
+from mosaicpy.llm.token import estimate_request_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled at `per_minute` units per minute, holding at
+    most `capacity` units (defaults to one minute's worth).
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float = 1):
+        # requests larger than the bucket wait for a full bucket and go into debt
+        needed = min(amount, self.capacity)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+
+                wait = max(self.paused_until - now, (needed - self.tokens) / self.rate)
+                self._cond.wait(max(wait, 0.001))
+
+    def pause(self, seconds: float):
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self._cond.notify_all()
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit that halves on rate-limit errors and grows back by one slot
+    after `limit` consecutive successes (AIMD), between 1 and `max_limit`.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, success: bool = True):
+        with self._cond:
+            self.active -= 1
+            if success:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def decrease(self):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+
+# the `chat` arguments that are not placeholders of the user input
+_CHAT_ARGS = frozenset(
+    {"user_input", "image", "temperature", "max_tokens", "return_all", "full_response"}
+)
+
+
+def _estimate_tokens(agent, request: dict) -> int:
+    """
+    Estimate what a request counts against a token rate limit: the system prompt, the
+    user input and the tool definitions, plus max_tokens.
+    """
+    user_input = str(request["user_input"])
+    placeholders = {k: v for k, v in request.items() if k not in _CHAT_ARGS}
+    if placeholders:
+        user_input = user_input.format(**placeholders)
+
+    msgs = [
+        SimpleMessage.from_text("system", agent._get_system_prompt()),
+        SimpleMessage.from_text(agent.ROLE_USER, user_input),
+    ]
+    prompt_tokens = estimate_request_tokens(
+        msgs,
+        encoding_name=agent.config.model_name,
+        tool_tokens=agent._get_tool_tokens() if agent.tools else 0,
+    )
+    # rate limits count the requested max_tokens, not the tokens actually generated
+    return prompt_tokens + (request.get("max_tokens") or agent.config.max_tokens)
+
+
+def batch_chat(
+    agent,
+    prompts: Iterable[Union[str, dict]],
+    max_concurrency: int = 8,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    progress_file: Optional[str] = None,
+    capture_errors: bool = False,
+    **chat_kwargs,
+) -> Iterable[ChatResponse]:
+    """
+    Run `agent.chat` over many prompts concurrently while staying under rate limits.
+
+    Requests are admitted by token buckets for requests and tokens per minute (the
+    token cost is estimated from the system prompt, user input and tool definitions
+    plus max_tokens) and by a concurrency
+    limit that halves whenever the agent reports a rate limit and slowly grows back.
+    A rate limit carrying a Retry-After header also pauses all admissions for that long.
+    The time a prompt waits for admission counts towards the queue time of its call.
+
+    Args:
+        agent (Agent): A stateless agent (keep_conversation_state=False).
+        prompts (Iterable): User inputs, or dicts of `chat` keyword arguments with at
+            least "user_input".
+        max_concurrency (int, optional): The maximum number of requests in flight.
+        requests_per_minute (float, optional): The request budget.
+        tokens_per_minute (float, optional): The token budget.
+        progress_file (str, optional): Responses are appended to this file as they
+            complete; rerunning with the same prompts skips the finished ones.
+        capture_errors (bool, optional): Yield a MapResult per prompt instead of raising
+            on the first failed request.
+        **chat_kwargs: Passed to every `chat` call.
+
+    Yields:
+        ChatResponse: One response per prompt, in input order.
+    """
+    if agent.config.keep_conversation_state:
+        raise ValueError("batch_chat requires an agent with keep_conversation_state=False")
+
+    request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+    token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+    limiter = AdaptiveLimiter(max_concurrency)
+
+    def on_rate_limit(data):
+        limiter.decrease()
+        retry_after = data.get("retry_after")
+        logger.warning(
+            f"Rate limited, concurrency lowered to {limiter.limit}, retry after {retry_after}s"
+        )
+        if retry_after:
+            for bucket in (request_bucket, token_bucket):
+                if bucket is not None:
+                    bucket.pause(retry_after)
+
+    def run(prompt):
+        queued_at = time.perf_counter()
+        request = dict(user_input=prompt) if isinstance(prompt, str) else dict(prompt)
+        request = {**chat_kwargs, **request, "return_all": True}
+
+        if token_bucket is not None:
+            token_bucket.acquire(_estimate_tokens(agent, request))
+        if request_bucket is not None:
+            request_bucket.acquire()
+
+        limiter.acquire()
+        success = False
+        try:
+            with queued_since(queued_at):
+                response = agent.chat(**request)
+            success = True
+            return response
+        finally:
+            limiter.release(success)
+
+    listener = agent.event_manager.subscribe(Event.RATE_LIMIT, on_rate_limit)
+    try:
+        yield from ipmap(
+            prompts,
+            run,
+            workers=max_concurrency,
+            ordered=True,
+            checkpoint=progress_file,
+            capture_errors=capture_errors,
+        )
+    finally:
+        agent.event_manager.unsubscribe(Event.RATE_LIMIT, listener)
@@ -0,0 +1,181 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+# request fields that do not change the response
+_IGNORED_FIELDS = ("stream", "timeout")
+
+
+def _canonical(value):
+    if isinstance(value, BaseModel):
+        return _canonical(value.model_dump(mode="json", exclude_none=True))
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def make_cache_key(request: dict) -> str:
+    """
+    Hash a request (model, messages, tools and sampling params) into a stable key.
+    Pydantic messages and plain dicts with the same content hash the same, and None
+    values and transport settings such as `stream` and `timeout` are ignored.
+    """
+    request = {k: v for k, v in request.items() if k not in _IGNORED_FIELDS}
+    payload = json.dumps(
+        _canonical(request), sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A two-tier cache for LLM responses: an in-memory LRU in front of an optional SQLite
+    file that persists across runs and processes.
+
+    Args:
+        path (str, optional): The SQLite file. Memory only if None.
+        max_entries (int, optional): The size of the in-memory LRU.
+        max_disk_entries (int, optional): Evict the least recently used rows beyond this.
+        max_disk_bytes (int, optional): Evict the least recently used rows until the
+            stored values fit in this many bytes.
+        ttl (float, optional): Seconds before an entry expires. Never if None.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = 1024,
+        max_disk_entries: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._db.execute(
+                            "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                        )
+                        value = json.loads(value)
+                        self._remember(key, expires_at, value)
+                        self.hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: dict, ttl: Optional[float] = None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+
+        with self._lock:
+            self._remember(key, expires_at, value)
+
+            if self._db is not None:
+                data = json.dumps(value, ensure_ascii=False)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), expires_at, now),
+                )
+                self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+
+        if self.max_disk_entries is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+
+        if self.max_disk_bytes is not None:
+            # keep the most recently used rows whose running size fits the budget
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM (SELECT key, "
+                "SUM(size) OVER (ORDER BY accessed_at DESC, key) AS total FROM responses) "
+                "WHERE total > ?)",
+                (self.max_disk_bytes,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return len(self._memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
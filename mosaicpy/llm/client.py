@@ -0,0 +1,36 @@
+import asyncio
+import os
+import threading
+import weakref
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_shared_client(key, factory):
+    """
+    Return the client created by `factory` for `key`, creating it once per process so
+    every agent with the same settings shares one HTTP connection pool.
+    """
+    key = (os.getpid(), *key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = factory()
+        return client
+
+
+def get_shared_async_client(key, factory):
+    """
+    Like `get_shared_client` for async clients. Async connection pools are bound to an
+    event loop, so there is one client per process and running loop.
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), *key)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = clients[key] = factory()
+        return client
@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import itertools
+from typing import Awaitable, Callable, Optional
+
+from mosaicpy.llm.schema import SimpleMessage
+from mosaicpy.llm.token import DEFAULT_ENCODING, count_message_tokens
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_ACK = "Understood."
+
+
+def _role(message):
+    return message["role"] if isinstance(message, dict) else message.role
+
+
+def message_text(message) -> str:
+    content = message["content"] if isinstance(message, dict) else message.content
+    if isinstance(content, list):
+        return "\n".join(part["text"] for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def format_transcript(messages) -> str:
+    return "\n\n".join(f"{_role(message)}: {message_text(message)}" for message in messages)
+
+
+def _align_to_user_turn(history, dropped=None):
+    # providers expect the history to start with a user turn
+    while len(history) and _role(history[0]) != "user":
+        message = history.popleft()
+        if dropped is not None:
+            dropped.append(message)
+
+
+class SlidingWindow:
+    """
+    Drop the oldest turns until the history fits the token budget.
+    """
+
+    def trim(self, history):
+        if not history.over_budget():
+            return
+        while history.over_budget() and len(history):
+            history.popleft()
+        _align_to_user_turn(history)
+
+
+class KeepLastN:
+    """
+    Keep only the last `n` messages, then drop more if still over the token budget.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def trim(self, history):
+        if len(history) > self.n:
+            while len(history) > self.n:
+                history.popleft()
+            _align_to_user_turn(history)
+        SlidingWindow().trim(history)
+
+
+class Summarize:
+    """
+    Fold the oldest turns into a summary once the history is over the token budget,
+    keeping at least the last `keep_last` messages verbatim. `summarizer` maps the
+    dropped messages (including any previous summary) to the summary text;
+    `asummarizer` is its async version, used by `atrim` when given.
+    """
+
+    def __init__(
+        self,
+        summarizer: Optional[Callable[[list], str]] = None,
+        keep_last: int = 2,
+        asummarizer: Optional[Callable[[list], Awaitable[str]]] = None,
+    ):
+        self.summarizer = summarizer
+        self.keep_last = keep_last
+        self.asummarizer = asummarizer
+
+    def _select(self, history) -> int:
+        """
+        The number of oldest messages to fold into the summary. Nothing is removed
+        yet, so the history is unchanged if summarizing fails.
+        """
+        if not history.over_budget() or len(history) <= self.keep_last:
+            return 0
+
+        n, total = 0, history.total_tokens
+        while total > history.max_tokens and len(history) - n > self.keep_last:
+            total -= history.tokens_at(n)
+            n += 1
+        # providers expect the history to start with a user turn
+        while n < len(history) and _role(history[n]) != "user":
+            n += 1
+        return n
+
+    def _fold(self, history, n, summary):
+        for _ in range(n):
+            history.popleft()
+        history.appendleft(SimpleMessage.from_text("assistant", SUMMARY_ACK))
+        history.appendleft(SimpleMessage.from_text("user", SUMMARY_PREFIX + summary))
+
+    def trim(self, history):
+        n = self._select(history)
+        if n:
+            self._fold(history, n, self.summarizer(list(itertools.islice(history, n))))
+
+    async def atrim(self, history):
+        n = self._select(history)
+        if not n:
+            return
+        dropped = list(itertools.islice(history, n))
+        if self.asummarizer is not None:
+            summary = await self.asummarizer(dropped)
+        else:
+            summary = await asyncio.to_thread(self.summarizer, dropped)
+        self._fold(history, n, summary)
+
+
+class ConversationHistory:
+    """
+    The turns an agent resends with every request, trimmed to a token budget by a
+    pluggable strategy. Each message is tokenized once when added and the total is
+    kept as a running sum, so adding a turn costs O(1) regardless of history length.
+
+    Args:
+        max_tokens (int, optional): The token budget for the history. Unbounded if None.
+        strategy (optional): An object with a `trim(history)` method. Defaults to
+            SlidingWindow.
+        encoding_name (str, optional): The encoding or model used to count tokens.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, strategy=None, encoding_name=None):
+        self.max_tokens = max_tokens
+        self.strategy = strategy or SlidingWindow()
+        self.encoding_name = encoding_name or DEFAULT_ENCODING
+        self.total_tokens = 0
+
+        self._messages = collections.deque()
+        self._tokens = collections.deque()
+
+    def _count(self, message):
+        if self.max_tokens is None:
+            return 0
+        return count_message_tokens(message, self.encoding_name)
+
+    def over_budget(self) -> bool:
+        return self.max_tokens is not None and self.total_tokens > self.max_tokens
+
+    def _push(self, message):
+        tokens = self._count(message)
+        self._messages.append(message)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def append(self, message, trim: bool = True):
+        self._push(message)
+        if trim:
+            self.trim()
+
+    def extend(self, messages, trim: bool = True):
+        # trim once so a user/assistant pair is added as a unit
+        for message in messages:
+            self._push(message)
+        if trim:
+            self.trim()
+
+    def trim(self):
+        self.strategy.trim(self)
+
+    async def atrim(self):
+        """
+        Async version of `trim`, for strategies such as Summarize that make requests.
+        """
+        atrim = getattr(self.strategy, "atrim", None)
+        if atrim is None:
+            self.strategy.trim(self)
+        else:
+            await atrim(self)
+
+    def appendleft(self, message):
+        tokens = self._count(message)
+        self._messages.appendleft(message)
+        self._tokens.appendleft(tokens)
+        self.total_tokens += tokens
+
+    def tokens_at(self, index: int) -> int:
+        return self._tokens[index]
+
+    def popleft(self):
+        self.total_tokens -= self._tokens.popleft()
+        return self._messages.popleft()
+
+    def clear(self):
+        self._messages.clear()
+        self._tokens.clear()
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __repr__(self):
+        return f"ConversationHistory({list(self._messages)!r})"
@@ -0,0 +1,227 @@
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Optional
+
+from mosaicpy.utils.stats import Histogram
+
+# set by callers that queue requests before handing them to an agent (e.g. batch_chat)
+_queued_at = contextvars.ContextVar("mosaicpy_llm_queued_at", default=None)
+
+
+@contextlib.contextmanager
+def queued_since(timestamp: float):
+    """
+    Mark the agent calls made inside the block as queued since `timestamp` (a
+    `time.perf_counter()` value), so the wait counts towards their queue time.
+    """
+    token = _queued_at.set(timestamp)
+    try:
+        yield
+    finally:
+        _queued_at.reset(token)
+
+
+class CallMetrics:
+    """
+    The timings of one agent call, in seconds. A call spans every request it makes,
+    including tool rounds.
+
+    Attributes:
+        queue_time: From queueing (or the call) until the first request was sent.
+        retry_time: The backoff slept between retried requests.
+        ttft: From queueing (or the call) until the first token arrived. For
+            responses that are not streamed, until the whole response arrived.
+        inter_token_latency: The mean gap between streamed tokens.
+        total_time: From queueing (or the call) until the final response.
+        tokens_per_second: Completion tokens per second of generation.
+        tool_time: Time spent running tools.
+    """
+
+    __slots__ = (
+        "model",
+        "requests",
+        "retries",
+        "retry_time",
+        "cached",
+        "queue_time",
+        "ttft",
+        "inter_token_latency",
+        "total_time",
+        "tokens_per_second",
+        "tool_time",
+        "prompt_tokens",
+        "completion_tokens",
+        "_start",
+        "_first_output",
+        "_first_token",
+        "_last_token",
+        "_num_tokens",
+    )
+
+    def __init__(self, model: str):
+        self.model = model
+        self.requests = 0
+        self.retries = 0
+        self.retry_time = 0.0
+        self.cached = False
+        self.queue_time = None
+        self.ttft = None
+        self.inter_token_latency = None
+        self.total_time = None
+        self.tokens_per_second = None
+        self.tool_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+        queued_at = _queued_at.get()
+        self._start = time.perf_counter() if queued_at is None else queued_at
+        self._first_output = None
+        self._first_token = None
+        self._last_token = None
+        self._num_tokens = 0
+
+    def on_request(self):
+        if self.queue_time is None:
+            self.queue_time = time.perf_counter() - self._start
+        self.requests += 1
+
+    def on_retry(self, attempt):
+        self.retries += 1
+        self.retry_time += attempt.delay
+
+    def on_cache_hit(self):
+        self.cached = True
+
+    def on_response(self):
+        """
+        A response arrived; its first token counts as arriving now unless it streamed.
+        """
+        if self._first_output is None:
+            self._first_output = time.perf_counter()
+
+    def on_token(self):
+        now = time.perf_counter()
+        if self._first_token is None:
+            self._first_token = now
+            if self._first_output is None:
+                self._first_output = now
+        self._last_token = now
+        self._num_tokens += 1
+
+    def on_tools(self, seconds: float):
+        self.tool_time += seconds
+
+    def finish(self, usage):
+        now = time.perf_counter()
+        self.total_time = now - self._start
+        self.ttft = (self._first_output or now) - self._start
+        if self.queue_time is None:
+            self.queue_time = self.ttft
+
+        generation_time = None
+        if self._num_tokens > 1:
+            generation_time = self._last_token - self._first_token
+            self.inter_token_latency = generation_time / (self._num_tokens - 1)
+
+        self.prompt_tokens = usage.prompt
+        self.completion_tokens = usage.completion
+        if not generation_time:
+            generation_time = self.total_time - self.queue_time
+        if generation_time > 0:
+            self.tokens_per_second = self.completion_tokens / generation_time
+
+        return self
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if name[0] != "_"}
+
+    def __repr__(self):
+        return f"CallMetrics({self.to_dict()})"
+
+
+HISTOGRAM_FIELDS = (
+    "queue_time",
+    "ttft",
+    "inter_token_latency",
+    "total_time",
+    "tokens_per_second",
+    "tool_time",
+    "retries",
+    "prompt_tokens",
+    "completion_tokens",
+)
+
+
+class MetricsRecorder:
+    """
+    Aggregate CallMetrics into per-model histograms. One recorder can be shared by
+    several agents.
+
+    Args:
+        max_samples (int, optional): The reservoir size of each histogram.
+    """
+
+    def __init__(self, max_samples: int = 4096):
+        self.max_samples = max_samples
+        self.calls = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, metrics: CallMetrics):
+        with self._lock:
+            histograms = self.histograms.get(metrics.model)
+            if histograms is None:
+                histograms = self.histograms[metrics.model] = {
+                    name: Histogram(self.max_samples) for name in HISTOGRAM_FIELDS
+                }
+            self.calls[metrics.model] = self.calls.get(metrics.model, 0) + 1
+
+        for name, histogram in histograms.items():
+            value = getattr(metrics, name)
+            if value is not None:
+                histogram.observe(value)
+
+    def summary(self, model: Optional[str] = None) -> dict:
+        """
+        Returns:
+            dict: {model: {field: {count, mean, min, max, p50, p95, p99}}}, or only the
+            inner dict for `model`.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+        summary = {
+            name: {field: hist.summary() for field, hist in fields.items()}
+            for name, fields in histograms.items()
+        }
+        return summary.get(model, {}) if model is not None else summary
+
+    def to_prometheus(self, prefix: str = "mosaicpy_llm") -> str:
+        """
+        Render the histograms in the Prometheus text exposition format, as summaries
+        with 0.5, 0.95 and 0.99 quantiles labelled by model.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+
+        lines = []
+        for field in HISTOGRAM_FIELDS:
+            metric = f"{prefix}_{field}"
+            lines.append(f"# TYPE {metric} summary")
+            for model, fields in sorted(histograms.items()):
+                hist = fields[field]
+                label = model.replace("\\", "\\\\").replace('"', '\\"')
+                for q in (0.5, 0.95, 0.99):
+                    value = hist.quantile(q)
+                    value = "NaN" if value is None else repr(value)
+                    lines.append(f'{metric}{{model="{label}",quantile="{q}"}} {value}')
+                lines.append(f'{metric}_sum{{model="{label}"}} {hist.sum!r}')
+                lines.append(f'{metric}_count{{model="{label}"}} {hist.count}')
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.histograms.clear()
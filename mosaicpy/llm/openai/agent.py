@@ -3,24 +3,32 @@ import json
 import logging
 import os
 import time
-import openai
 import urllib
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
 from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion
 
 from mosaicpy.collections import dict as mdict
 from mosaicpy.llm import Agent
-from mosaicpy.llm.openai.function import build_function_signature
+from mosaicpy.llm.client import get_shared_async_client, get_shared_client
+from mosaicpy.llm.openai.executor import ToolExecutor
+from mosaicpy.llm.openai.function import compile_tool
 from mosaicpy.llm.openai.stream_aggregator import ChunkAggregator
 from mosaicpy.llm.openai.tools import Tool
-from mosaicpy.llm.prompt import replace_magic_placeholders
 from mosaicpy.llm.schema import (
     BaseConfig,
     ChatResponse,
     SimpleMessage,
+    TextDelta,
     TokenUsage,
+    ToolCallDelta,
+    UsageDelta,
+)
+from mosaicpy.llm.token import (
+    count_openai_token,
+    estimate_request_tokens,
+    estimate_response_tokens,
 )
-from mosaicpy.llm.token import estimate_request_tokens, estimate_response_tokens
 
 
 logger = logging.getLogger(__name__)
@@ -51,6 +59,41 @@ def _create_image_content(image_path):
         raise Exception(f"Invalid image path: {image_path}")
 
 
+def _get_cached_tokens(usage):
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def _to_token_usage(usage):
+    return TokenUsage(
+        prompt=usage.prompt_tokens,
+        completion=usage.completion_tokens,
+        cache_read=_get_cached_tokens(usage),
+    )
+
+
+def _chunk_deltas(chunk):
+    if not chunk.choices:
+        return
+    delta = chunk.choices[0].delta
+    if delta.content:
+        yield TextDelta(delta.content)
+    for tool_call in delta.tool_calls or ():
+        function = tool_call.function
+        yield ToolCallDelta(
+            tool_call.index,
+            tool_call.id,
+            function.name if function else None,
+            function.arguments if function else None,
+        )
+
+
+def _has_content(chunk):
+    return bool(chunk.choices) and bool(chunk.choices[0].delta.content)
+
+
 class AgentConfig(BaseConfig):
     model_name: str = "gpt-3.5-turbo-0125"
     frequency_penalty: float = 0
@@ -67,7 +110,9 @@ class AgentConfig(BaseConfig):
 class OpenAIAgent(Agent):
     ROLE_SYSTEM = "system"
 
-    def __init__(self, config: AgentConfig = None, tools: list[Tool] = None, **kwargs):
+    def __init__(
+        self, config: AgentConfig = None, tools: list[Tool] = None, api_key=None, **kwargs
+    ):
         if config is None:
             config = AgentConfig(**kwargs)
 
@@ -76,26 +121,54 @@ class OpenAIAgent(Agent):
         if config.verbose:
             logger.setLevel(logging.DEBUG)
 
-    def _get_client(self):
+        self._api_key = api_key
+        self._system_msg = None
+        self._compiled_tools = None
+        self._get_compiled_tools()
+        self.tool_executor = ToolExecutor(
+            self.tools, max_workers=config.max_tool_workers, timeout=config.tool_timeout
+        )
+
+    def _client_key(self):
+        return (
+            "openai",
+            self.config.use_azure,
+            self.config.azure_endpoint,
+            self.config.base_url,
+            self._api_key,
+        )
+
+    def _create_client(self, use_async=False):
         if self.config.use_azure:
             assert (
                 os.environ["AZURE_OPENAI_API_KEY"] is not None
             ), "AZURE_OPENAI_API_KEY must be provided"
             assert self.config.azure_endpoint is not None, "Azure endpoint must be provided"
-            return AzureOpenAI(
+            client_cls = AsyncAzureOpenAI if use_async else AzureOpenAI
+            return client_cls(
                 api_version="2023-07-01-preview",
                 azure_endpoint=self.config.azure_endpoint,
+                max_retries=0,
             )
-        else:
-            return openai
+
+        # retries are left to the agent's retry policy, so they are not multiplied
+        client_cls = AsyncOpenAI if use_async else OpenAI
+        return client_cls(api_key=self._api_key, base_url=self.config.base_url, max_retries=0)
+
+    def _get_client(self):
+        return get_shared_client(self._client_key(), self._create_client)
+
+    def _get_async_client(self):
+        return get_shared_async_client(
+            self._client_key(), lambda: self._create_client(use_async=True)
+        )
 
     def _get_system_msg(self):
-        if self.config.enable_magic_placeholders:
-            return SimpleMessage.from_text(
-                self.ROLE_SYSTEM, replace_magic_placeholders(self.config.system_prompt)
-            )
-        else:
-            return SimpleMessage.from_text(self.ROLE_SYSTEM, self.config.system_prompt)
+        # reuse the message so the request prefix stays byte-identical for prompt caching
+        system_prompt = self._get_system_prompt()
+        if self._system_msg is None or self._system_msg.content[0]["text"] != system_prompt:
+            self._system_msg = SimpleMessage.from_text(self.ROLE_SYSTEM, system_prompt)
+        return self._system_msg
 
     def _assemble_request_messages(self, user_contents):
         msgs = [self._get_system_msg()]
@@ -105,7 +178,47 @@ class OpenAIAgent(Agent):
         msgs.append(SimpleMessage(role=self.ROLE_USER, content=user_contents))
         return msgs
 
-    def _call_completion(self, msgs, max_tokens, generate_n, temperature, tools=None):
+    def _prepare_request(self, user_input, image, kwargs):
+        # if kwargs is not None, loop it to format the user_input
+        if kwargs:
+            user_input = user_input.format(**kwargs)
+
+        user_contents = [mdict(type="text", text=user_input)]
+        if image is not None:
+            user_contents.append(_create_image_content(image))
+        msgs = self._assemble_request_messages(user_contents)
+
+        return user_contents, msgs
+
+    def _get_compiled_tools(self):
+        # recompile only when the registered tools change
+        compiled, tools = self._compiled_tools, self.tools
+        if (
+            compiled is None
+            or len(compiled) != len(tools)
+            or any(c.tool is not tool for c, tool in zip(compiled, tools.values()))
+        ):
+            compiled = self._compiled_tools = [compile_tool(tool) for tool in tools.values()]
+            self._tool_signatures = [c.signature for c in compiled]
+        return compiled
+
+    def add_tool(self, tool: Tool):
+        self.tools[tool.name] = tool
+        self._get_compiled_tools()
+
+    def _get_tool_signatures(self):
+        self._get_compiled_tools()
+        return self._tool_signatures
+
+    def _get_tool_tokens(self):
+        encoding_name = self.config.model_name
+        return count_openai_token("Tools:\n", encoding_name) + sum(
+            c.count_tokens(encoding_name) for c in self._get_compiled_tools()
+        )
+
+    def _build_completion_kwargs(
+        self, msgs, max_tokens, generate_n, temperature, tools=None, stream=None
+    ):
         kwargs = {
             "model": self.config.model_name,
             "messages": msgs,
@@ -122,7 +235,7 @@ class OpenAIAgent(Agent):
             kwargs["tools"] = tools
             kwargs["tool_choice"] = "auto"
 
-        if self.config.stream:
+        if self.config.stream if stream is None else stream:
             kwargs["stream"] = True
 
         if self.config.json_output:
@@ -130,40 +243,39 @@ class OpenAIAgent(Agent):
 
         logger.debug(f"Request to OpenAI: {kwargs}")
 
-        for _ in range(self.config.max_retry):
-            try:
-                client = self._get_client()
-                completion = client.chat.completions.create(**kwargs)
-                break
-            except openai.RateLimitError:
-                if self.config.verbose:
-                    logger.warning(f"Rate limit exceeded. Retrying in {2 ** _} seconds...")
-                time.sleep(2**_)
-            except openai.APITimeoutError:
-                pass
-        else:
-            raise Exception("Max retries exceeded")
-
-        if self.config.stream:
-            ca = ChunkAggregator(event_manger=self.event_manager)
-
-            for chunk in completion:
-                ca.update(chunk)
-
-            completion = ca.to_chat_completion()
+        return kwargs
 
-        estimated_usage_prompt = estimate_request_tokens(msgs, tools=tools)
-        estimated_usage_completion = estimate_response_tokens(completion)
+    def _create_completion(self, kwargs, metrics):
+        return self.retry_policy.call(
+            lambda: self._get_client().chat.completions.create(**kwargs),
+            self._retry_callback(metrics),
+        )
 
-        logger.debug(
-            f"Estimated token usage: prompt={estimated_usage_prompt}, completion={estimated_usage_completion}"
+    async def _acreate_completion(self, kwargs, metrics):
+        return await self.retry_policy.acall(
+            lambda: self._get_async_client().chat.completions.create(**kwargs),
+            self._retry_callback(metrics),
         )
 
+    def _finalize_completion(self, completion, msgs, tools=None):
         if completion.usage:
             logger.debug(
                 f"Actual token usage: prompt={completion.usage.prompt_tokens}, completion={completion.usage.completion_tokens}"
             )
         else:
+            # streamed responses carry no usage, so estimate it locally
+            estimated_usage_prompt = estimate_request_tokens(
+                msgs,
+                encoding_name=self.config.model_name,
+                tool_tokens=self._get_tool_tokens() if tools else None,
+            )
+            estimated_usage_completion = estimate_response_tokens(
+                completion, encoding_name=self.config.model_name
+            )
+            logger.debug(
+                f"Estimated token usage: prompt={estimated_usage_prompt}, completion={estimated_usage_completion}"
+            )
+
             completion.usage = CompletionUsage(
                 completion_tokens=estimated_usage_completion,
                 prompt_tokens=estimated_usage_prompt,
@@ -174,6 +286,186 @@ class OpenAIAgent(Agent):
 
         return completion
 
+    def _get_tokens(self, completion):
+        content = completion.choices[0].message.content
+        return [content] if content else []
+
+    def _call_completion(self, msgs, max_tokens, generate_n, temperature, metrics, tools=None):
+        kwargs = self._build_completion_kwargs(msgs, max_tokens, generate_n, temperature, tools)
+
+        cache_key = self._get_cache_key(kwargs)
+        completion, tokens = self._get_cached(cache_key, ChatCompletion)
+        if completion is not None:
+            if self.config.stream:
+                self._replay_tokens(tokens, metrics)
+            return completion
+
+        completion = self._create_completion(kwargs, metrics)
+
+        if self.config.stream:
+            ca = ChunkAggregator(event_manger=self.event_manager)
+
+            for chunk in completion:
+                if _has_content(chunk):
+                    metrics.on_token()
+                ca.update(chunk)
+
+            tokens = ca.tokens
+            completion = ca.to_chat_completion()
+
+        metrics.on_response()
+        completion = self._finalize_completion(completion, msgs, tools=tools)
+        self._set_cached(cache_key, completion, tokens or self._get_tokens(completion))
+
+        return completion
+
+    async def _acall_completion(
+        self, msgs, max_tokens, generate_n, temperature, metrics, tools=None
+    ):
+        kwargs = self._build_completion_kwargs(msgs, max_tokens, generate_n, temperature, tools)
+
+        cache_key = self._get_cache_key(kwargs)
+        completion, tokens = self._get_cached(cache_key, ChatCompletion)
+        if completion is not None:
+            if self.config.stream:
+                self._replay_tokens(tokens, metrics)
+            return completion
+
+        completion = await self._acreate_completion(kwargs, metrics)
+
+        if self.config.stream:
+            ca = ChunkAggregator(event_manger=self.event_manager)
+
+            async for chunk in completion:
+                if _has_content(chunk):
+                    metrics.on_token()
+                ca.update(chunk)
+
+            tokens = ca.tokens
+            completion = ca.to_chat_completion()
+
+        metrics.on_response()
+        completion = self._finalize_completion(completion, msgs, tools=tools)
+        self._set_cached(cache_key, completion, tokens or self._get_tokens(completion))
+
+        return completion
+
+    def _replay_deltas(self, completion, tokens, metrics):
+        metrics.on_cache_hit()
+        for token in tokens:
+            metrics.on_token()
+            self.event_manager.publish_new_chat_token(token)
+            yield TextDelta(token)
+        for index, tool_call in enumerate(completion.choices[0].message.tool_calls or ()):
+            yield ToolCallDelta(
+                index, tool_call.id, tool_call.function.name, tool_call.function.arguments
+            )
+        yield UsageDelta(_to_token_usage(completion.usage))
+
+    def _stream_completion(self, msgs, max_tokens, temperature, metrics, tools=None):
+        """
+        Yield the delta events of a streamed completion, then the finalized completion.
+        """
+        kwargs = self._build_completion_kwargs(msgs, max_tokens, 1, temperature, tools, stream=True)
+
+        cache_key = self._get_cache_key(kwargs)
+        completion, tokens = self._get_cached(cache_key, ChatCompletion)
+        if completion is not None:
+            yield from self._replay_deltas(completion, tokens, metrics)
+            yield completion
+            return
+
+        stream = self._create_completion(kwargs, metrics)
+        ca = ChunkAggregator(event_manger=self.event_manager)
+
+        try:
+            for chunk in stream:
+                if _has_content(chunk):
+                    metrics.on_token()
+                ca.update(chunk)
+                yield from _chunk_deltas(chunk)
+        finally:
+            stream.close()
+
+        metrics.on_response()
+        completion = self._finalize_completion(ca.to_chat_completion(), msgs, tools=tools)
+        self._set_cached(cache_key, completion, ca.tokens)
+
+        yield UsageDelta(_to_token_usage(completion.usage))
+        yield completion
+
+    async def _astream_completion(self, msgs, max_tokens, temperature, metrics, tools=None):
+        kwargs = self._build_completion_kwargs(msgs, max_tokens, 1, temperature, tools, stream=True)
+
+        cache_key = self._get_cache_key(kwargs)
+        completion, tokens = self._get_cached(cache_key, ChatCompletion)
+        if completion is not None:
+            for delta in self._replay_deltas(completion, tokens, metrics):
+                yield delta
+            yield completion
+            return
+
+        stream = await self._acreate_completion(kwargs, metrics)
+        ca = ChunkAggregator(event_manger=self.event_manager)
+
+        try:
+            async for chunk in stream:
+                if _has_content(chunk):
+                    metrics.on_token()
+                ca.update(chunk)
+                for delta in _chunk_deltas(chunk):
+                    yield delta
+        finally:
+            await stream.close()
+
+        metrics.on_response()
+        completion = self._finalize_completion(ca.to_chat_completion(), msgs, tools=tools)
+        self._set_cached(cache_key, completion, ca.tokens)
+
+        yield UsageDelta(_to_token_usage(completion.usage))
+        yield completion
+
+    def _run_tool_calls(self, tool_calls, metrics):
+        start = time.perf_counter()
+        messages = self.tool_executor.run(tool_calls)
+        metrics.on_tools(time.perf_counter() - start)
+        return messages
+
+    async def _arun_tool_calls(self, tool_calls, metrics):
+        start = time.perf_counter()
+        messages = await self.tool_executor.arun(tool_calls)
+        metrics.on_tools(time.perf_counter() - start)
+        return messages
+
+    def _round_tools(self, tools, tool_round):
+        # the last follow-up gets no tools so the model has to answer
+        return tools if tool_round + 1 < self.config.max_tool_rounds else None
+
+    def _describe_tool_calls(self, tool_calls):
+        res = []
+        for tool_call in tool_calls:
+            function_name = tool_call.function.name
+            function_args = json.loads(tool_call.function.arguments)
+
+            res.append(f"{function_name}({function_args})")
+
+        print("\n".join(res))
+        return ""
+
+    def _finish_chat(self, completion, user_contents, metrics):
+        response = ChatResponse(
+            content=completion.choices[0].message.content,
+            model=self.config.model_name,
+            finish_reason=completion.choices[0].finish_reason,
+            usage=_to_token_usage(completion.usage),
+            input_contents=user_contents,
+        )
+        self._finish_call(metrics, response.usage)
+
+        self.event_manager.publish_finish_chat(response)
+
+        return response
+
     def chat(
         self,
         user_input,
@@ -181,64 +473,134 @@ class OpenAIAgent(Agent):
         full_response=False,
         temperature=None,
         max_tokens=None,
+        return_all=False,
         **kwargs,
     ):
-        # if kwargs is not None, loop it to format the user_input
-        if kwargs:
-            user_input = user_input.format(**kwargs)
+        self._compact_history()
+        metrics = self._start_call()
+        user_contents, msgs = self._prepare_request(user_input, image, kwargs)
+        tools = self._get_tool_signatures()
 
-        user_contents = [mdict(type="text", text=user_input)]
-        if image is not None:
-            user_contents.append(_create_image_content(image))
-        msgs = self._assemble_request_messages(user_contents)
+        completion = self._call_completion(msgs, max_tokens, 1, temperature, metrics, tools=tools)
+
+        for tool_round in range(self.config.max_tool_rounds):
+            tool_calls = completion.choices[0].message.tool_calls
+            if not tool_calls:
+                break
+            if not self.config.execute_tools:
+                return self._describe_tool_calls(tool_calls)
 
-        tools = [build_function_signature(tool) for tool in self.tools.values()]
+            msgs.append(completion.choices[0].message)
+            msgs.extend(self._run_tool_calls(tool_calls, metrics))
+
+            completion = self._call_completion(
+                msgs, max_tokens, 1, temperature, metrics, self._round_tools(tools, tool_round)
+            )
+
+        response = self._finish_chat(completion, user_contents, metrics)
+
+        return response if full_response or return_all else response.content
 
-        completion = self._call_completion(msgs, max_tokens, 1, temperature, tools=tools)
+    async def achat(
+        self,
+        user_input,
+        image=None,
+        full_response=False,
+        temperature=None,
+        max_tokens=None,
+        return_all=False,
+        **kwargs,
+    ):
+        await self._acompact_history()
+        metrics = self._start_call()
+        user_contents, msgs = self._prepare_request(user_input, image, kwargs)
+        tools = self._get_tool_signatures()
+
+        completion = await self._acall_completion(
+            msgs, max_tokens, 1, temperature, metrics, tools=tools
+        )
+
+        for tool_round in range(self.config.max_tool_rounds):
+            tool_calls = completion.choices[0].message.tool_calls
+            if not tool_calls:
+                break
+            if not self.config.execute_tools:
+                return self._describe_tool_calls(tool_calls)
 
-        if completion.choices[0].message.tool_calls:
             msgs.append(completion.choices[0].message)
+            msgs.extend(await self._arun_tool_calls(tool_calls, metrics))
 
-            if self.config.execute_tools:
-                for tool_call in completion.choices[0].message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
+            completion = await self._acall_completion(
+                msgs, max_tokens, 1, temperature, metrics, self._round_tools(tools, tool_round)
+            )
 
-                    res = self.tools[function_name]._run(**function_args)
-                    logger.info(f"Tool call: {function_name}({function_args}) ->\n###\n{res}\n###")
+        response = self._finish_chat(completion, user_contents, metrics)
 
-                    msgs.append(
-                        mdict(
-                            tool_call_id=tool_call.id,
-                            role="tool",
-                            name=function_name,
-                            content=f"{res}",
-                        )
-                    )
-            else:
-                res = []
-                for tool_call in completion.choices[0].message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
+        return response if full_response or return_all else response.content
 
-                    res.append(f"{function_name}({function_args})")
+    def chat_stream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        self._compact_history()
+        metrics = self._start_call()
+        user_contents, msgs = self._prepare_request(user_input, image, kwargs)
+        tools = self._get_tool_signatures()
 
-                print("\n".join(res))
-                return ""
+        round_tools = tools
+        for tool_round in range(self.config.max_tool_rounds + 1):
+            for item in self._stream_completion(
+                msgs, max_tokens, temperature, metrics, round_tools
+            ):
+                if isinstance(item, ChatCompletion):
+                    completion = item
+                else:
+                    yield item
 
-            completion = self._call_completion(msgs, max_tokens, 1, temperature)
+            tool_calls = completion.choices[0].message.tool_calls
+            if not tool_calls or tool_round == self.config.max_tool_rounds:
+                break
+            if not self.config.execute_tools:
+                self._describe_tool_calls(tool_calls)
+                return
 
-        response = ChatResponse(
-            content=completion.choices[0].message.content,
-            model=self.config.model_name,
-            finish_reason=completion.choices[0].finish_reason,
-            usage=TokenUsage(
-                prompt=completion.usage.prompt_tokens,
-                completion=completion.usage.completion_tokens,
-            ),
-            input_contents=user_contents,
-        )
+            msgs.append(completion.choices[0].message)
+            msgs.extend(self._run_tool_calls(tool_calls, metrics))
+            round_tools = self._round_tools(tools, tool_round)
 
-        self.event_manager.publish_finish_chat(response)
+        yield self._finish_chat(completion, user_contents, metrics)
+
+    async def achat_stream(
+        self, user_input, image=None, temperature=None, max_tokens=None, **kwargs
+    ):
+        await self._acompact_history()
+        metrics = self._start_call()
+        user_contents, msgs = self._prepare_request(user_input, image, kwargs)
+        tools = self._get_tool_signatures()
+
+        round_tools = tools
+        for tool_round in range(self.config.max_tool_rounds + 1):
+            async for item in self._astream_completion(
+                msgs, max_tokens, temperature, metrics, round_tools
+            ):
+                if isinstance(item, ChatCompletion):
+                    completion = item
+                else:
+                    yield item
+
+            tool_calls = completion.choices[0].message.tool_calls
+            if not tool_calls or tool_round == self.config.max_tool_rounds:
+                break
+            if not self.config.execute_tools:
+                self._describe_tool_calls(tool_calls)
+                return
+
+            msgs.append(completion.choices[0].message)
+            msgs.extend(await self._arun_tool_calls(tool_calls, metrics))
+            round_tools = self._round_tools(tools, tool_round)
+
+        yield self._finish_chat(completion, user_contents, metrics)
 
-        return response if full_response else response.content
+    async def astream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        async for item in self.achat_stream(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        ):
+            if isinstance(item, TextDelta):
+                yield item.text
@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from pydantic import ValidationError
+
+from mosaicpy.collections import dict as mdict
+from mosaicpy.llm.openai.function import compile_tool
+
+logger = logging.getLogger(__name__)
+
+
+class ToolExecutor:
+    """
+    Run the tool calls of one model response concurrently, either on a thread pool or
+    on the running event loop, and turn them into tool messages.
+
+    Each call is bounded by its tool's `timeout` (or the executor default); a call that
+    times out is reported back to the model as an error instead of blocking the turn.
+    Results of tools marked `pure` are memoized on their arguments.
+
+    Args:
+        tools (dict): The agent's tools by name.
+        max_workers (int, optional): The size of the thread pool.
+        timeout (float, optional): The default per-call timeout in seconds.
+        cache_size (int, optional): The number of memoized pure-tool results.
+    """
+
+    def __init__(
+        self,
+        tools: dict,
+        max_workers: int = 8,
+        timeout: Optional[float] = None,
+        cache_size: int = 1024,
+    ):
+        self.tools = tools
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_size = cache_size
+
+        self._pool = None
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="mosaicpy-tool"
+                )
+            return self._pool
+
+    def _get_timeout(self, tool):
+        timeout = getattr(tool, "timeout", None)
+        return self.timeout if timeout is None else timeout
+
+    def _parse(self, tool_call):
+        """
+        Validate the arguments of a tool call with the tool's compiled validator.
+        Returns the tool, its arguments, the memoization key (pure tools only) and the
+        validation error, if any.
+        """
+        name = tool_call.function.name
+        tool = self.tools[name]
+        try:
+            args = compile_tool(tool).validate(tool_call.function.arguments)
+        except ValidationError as e:
+            return tool, tool_call.function.arguments, None, e
+
+        key = None
+        if getattr(tool, "pure", False):
+            key = (name, json.dumps(args, sort_keys=True, default=str))
+        return tool, args, key, None
+
+    def _get_cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, self._cache[key]
+        return False, None
+
+    def _set_cached(self, key, result):
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _message(self, tool_call, args, result):
+        logger.info(f"Tool call: {tool_call.function.name}({args}) ->\n###\n{result}\n###")
+
+        return mdict(
+            tool_call_id=tool_call.id,
+            role="tool",
+            name=tool_call.function.name,
+            content=f"{result}",
+        )
+
+    def _error_message(self, tool_call, args, error):
+        logger.warning(f"Tool call {tool_call.function.name}({args}) has invalid arguments")
+        return self._message(tool_call, args, f"Error: invalid arguments: {error}")
+
+    def _timeout_message(self, tool_call, args, timeout):
+        logger.warning(f"Tool call {tool_call.function.name}({args}) timed out after {timeout}s")
+        return self._message(
+            tool_call, args, f"Error: the tool did not finish within {timeout} seconds"
+        )
+
+    def run(self, tool_calls) -> list[dict]:
+        """
+        Run the tool calls on the thread pool and return their tool messages in order.
+        """
+        parsed = [self._parse(tool_call) for tool_call in tool_calls]
+
+        results, pending = [None] * len(parsed), {}
+        for i, (tool, args, key, error) in enumerate(parsed):
+            if error is not None:
+                results[i] = self._error_message(tool_calls[i], args, error)
+                continue
+            if key is not None:
+                hit, result = self._get_cached(key)
+                if hit:
+                    results[i] = self._message(tool_calls[i], args, result)
+                    continue
+
+            timeout = self._get_timeout(tool)
+            if len(parsed) == 1 and timeout is None:
+                result = tool._run(**args)
+                if key is not None:
+                    self._set_cached(key, result)
+                results[i] = self._message(tool_calls[i], args, result)
+            else:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                pending[i] = (self._get_pool().submit(tool._run, **args), deadline, timeout)
+
+        for i, (future, deadline, timeout) in pending.items():
+            tool, args, key, _ = parsed[i]
+            try:
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                result = future.result(timeout=remaining)
+            except concurrent.futures.TimeoutError:
+                results[i] = self._timeout_message(tool_calls[i], args, timeout)
+                continue
+
+            if key is not None:
+                self._set_cached(key, result)
+            results[i] = self._message(tool_calls[i], args, result)
+
+        return results
+
+    async def _arun_one(self, tool_call, tool, args, key, error):
+        if error is not None:
+            return self._error_message(tool_call, args, error)
+        if key is not None:
+            hit, result = self._get_cached(key)
+            if hit:
+                return self._message(tool_call, args, result)
+
+        # tools may provide a native coroutine `_arun`, others run in a worker thread
+        if hasattr(tool, "_arun"):
+            call = tool._arun(**args)
+        else:
+            call = asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), lambda: tool._run(**args)
+            )
+
+        timeout = self._get_timeout(tool)
+        try:
+            result = await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            return self._timeout_message(tool_call, args, timeout)
+
+        if key is not None:
+            self._set_cached(key, result)
+        return self._message(tool_call, args, result)
+
+    async def arun(self, tool_calls) -> list[dict]:
+        """
+        Async version of `run`, running the tool calls concurrently on the event loop.
+        """
+        return await asyncio.gather(
+            *(self._arun_one(tool_call, *self._parse(tool_call)) for tool_call in tool_calls)
+        )
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
@@ -1,5 +1,12 @@
+import inspect
+import threading
+from typing import Any
+
+from pydantic import create_model
+
 from mosaicpy.collections import dict as mdict
 from mosaicpy.llm.openai.tools import Tool
+from mosaicpy.llm.token import DEFAULT_ENCODING, count_openai_token, tool_text
 
 
 TYPE_MAP = {
@@ -16,7 +23,12 @@ TYPE_MAP = {
 }
 
 
-def build_function_signature(func: Tool):
+def build_function_signature(func: Tool, include_metadata: bool = False):
+    """
+    Build the OpenAI function-calling signature of a tool. With `include_metadata`,
+    the execution hints of the tool (pure, timeout) are added under "metadata"; they
+    are for local use and not sent to the API.
+    """
     func_signature = {
         "name": func.name,
         "description": func.description,
@@ -31,8 +43,6 @@ def build_function_signature(func: Tool):
         func_signature["parameters"]["properties"] = schema["properties"]
         func_signature["parameters"]["required"] = schema["required"]
     else:
-        import inspect
-
         _run_signature = inspect.signature(func._run)
         exclude_params = set(["return", "run_manager", "args", "kwargs"])
 
@@ -44,9 +54,9 @@ def build_function_signature(func: Tool):
                 continue
 
             type_ = param.annotation
-            assert (
-                type_ in TYPE_MAP
-            ), f"Unsupported type: {type_} for auto-generation of function signature"
+            assert type_ in TYPE_MAP, (
+                f"Unsupported type: {type_} for auto-generation of function signature"
+            )
 
             params[name] = mdict(type=TYPE_MAP.get(type_))
 
@@ -56,4 +66,75 @@ def build_function_signature(func: Tool):
         func_signature["parameters"]["properties"] = params
         func_signature["parameters"]["required"] = required_params
 
-    return {"type": "function", "function": func_signature}
+    signature = {"type": "function", "function": func_signature}
+    if include_metadata:
+        signature["metadata"] = mdict(
+            pure=getattr(func, "pure", False), timeout=getattr(func, "timeout", None)
+        )
+
+    return signature
+
+
+def _build_args_model(func: Tool):
+    if getattr(func, "args_schema", None) is not None:
+        return func.args_schema
+
+    fields = {}
+    for name, param in inspect.signature(func._run).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        annotation = Any if param.annotation is inspect._empty else param.annotation
+        default = ... if param.default is inspect._empty else param.default
+        fields[name] = (annotation, default)
+
+    return create_model(f"{type(func).__name__}Args", **fields)
+
+
+class CompiledTool:
+    """
+    Everything derived from a tool's definition, built once: the function signature
+    sent to the API, its token counts per encoding and the validator for the arguments
+    the model returns.
+    """
+
+    __slots__ = ("tool", "signature", "text", "args_model", "_tokens")
+
+    def __init__(self, tool: Tool):
+        self.tool = tool
+        self.signature = build_function_signature(tool)
+        self.text = tool_text(self.signature)
+        self.args_model = _build_args_model(tool)
+        self._tokens = {}
+
+    def count_tokens(self, encoding_name=DEFAULT_ENCODING) -> int:
+        tokens = self._tokens.get(encoding_name)
+        if tokens is None:
+            tokens = self._tokens[encoding_name] = count_openai_token(self.text, encoding_name)
+        return tokens
+
+    def validate(self, arguments: str) -> dict:
+        """
+        Parse and validate the JSON arguments of a tool call. Arguments the model left
+        out are omitted, so the tool's own defaults apply.
+
+        Raises:
+            pydantic.ValidationError: If the arguments do not match the schema.
+        """
+        return self.args_model.model_validate_json(arguments or "{}").model_dump(exclude_unset=True)
+
+
+_compile_lock = threading.Lock()
+
+
+def compile_tool(func: Tool) -> CompiledTool:
+    """
+    Return the compiled form of a tool, building it on first use and keeping it on
+    the tool instance.
+    """
+    compiled = func._compiled
+    if compiled is None:
+        with _compile_lock:
+            compiled = func._compiled
+            if compiled is None:
+                compiled = func._compiled = CompiledTool(func)
+    return compiled
@@ -1,17 +1,26 @@
-from typing import Optional
 from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionMessageToolCall
 from openai.types.chat.chat_completion import Choice
 from openai.types.chat.chat_completion_message_tool_call import Function
-from pydantic import BaseModel, ConfigDict
-from mosaicpy.llm import LLMEventManager
 
+from mosaicpy.llm.schema import Event
 
 
-class ToolCallAggregator(BaseModel):
-    id: Optional[str] = None
-    name: Optional[str] = None
-    type: Optional[str] = None
-    arguments: Optional[str] = None
+class ToolCallAggregator:
+    __slots__ = ("id", "type", "_name", "_arguments")
+
+    def __init__(self):
+        self.id = None
+        self.type = None
+        self._name = []
+        self._arguments = []
+
+    @property
+    def name(self):
+        return "".join(self._name) if self._name else None
+
+    @property
+    def arguments(self):
+        return "".join(self._arguments) if self._arguments else None
 
     def update(self, tool_call):
         if tool_call.id and not self.id:
@@ -20,84 +29,99 @@ class ToolCallAggregator(BaseModel):
             self.type = tool_call.type
 
         func = tool_call.function
-
+        if func is None:
+            return
         if func.name:
-            if not self.name:
-                self.name = func.name
-            else:
-                self.name += func.name
-
+            self._name.append(func.name)
         if func.arguments:
-            if not self.arguments:
-                self.arguments = func.arguments
-            else:
-                self.arguments += func.arguments
+            self._arguments.append(func.arguments)
 
     def to_tool_call(self):
         return ChatCompletionMessageToolCall(
-            id=self.id, function=Function(arguments=self.arguments, name=self.name), type=self.type
+            id=self.id,
+            function=Function(arguments=self.arguments or "", name=self.name),
+            type=self.type or "function",
         )
 
 
-class ChoiceAggregator(BaseModel):
-    event_manager: Optional[LLMEventManager] = None
-    content: Optional[str] = None
-    role: Optional[int] = None
-    finish_reason: Optional[str] = None
-    tool_calls: Optional[ToolCallAggregator] = None
+class ChoiceAggregator:
+    __slots__ = ("role", "finish_reason", "_content", "tool_calls", "_listeners")
+
+    def __init__(self, listeners=None):
+        self.role = None
+        self.finish_reason = None
+        self._content = []
+        # tool calls by their stream index, which is not the position within a delta
+        self.tool_calls = {}
+        self._listeners = listeners
 
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+    @property
+    def content(self):
+        return "".join(self._content) if self._content else None
 
     def update(self, choice):
         if choice.finish_reason and not self.finish_reason:
             self.finish_reason = choice.finish_reason
-        elif hasattr(choice, "finish_details") and choice.finish_details and not self.finish_reason:
-            self.finish_reason = choice.finish_details["type"]
+        elif not self.finish_reason:
+            finish_details = getattr(choice, "finish_details", None)
+            if finish_details:
+                self.finish_reason = finish_details["type"]
 
         delta = choice.delta
-        if delta.content:
-            if not self.content:
-                self.content = delta.content
-            else:
-                self.content += delta.content
-
-            if self.event_manager:
-                self.event_manager.publish_new_chat_token(delta.content)
-        if delta.role and not self.role:
-            self.role = delta.role
-        if delta.tool_calls:
-            if not self.tool_calls:
-                self.tool_calls = []
+        content = delta.content
+        if content:
+            self._content.append(content)
 
-            for i, tool_call in enumerate(delta.tool_calls):
-                if i >= len(self.tool_calls):
-                    self.tool_calls.append(ToolCallAggregator())
+            listeners = self._listeners
+            if listeners:
+                data = {"content": content}
+                for listener in listeners:
+                    listener(data=data)
 
-                self.tool_calls[i].update(tool_call)
+        if delta.role and not self.role:
+            self.role = delta.role
 
-    def to_choice(self):
+        if delta.tool_calls:
+            tool_calls = self.tool_calls
+            for position, tool_call in enumerate(delta.tool_calls):
+                index = tool_call.index if tool_call.index is not None else position
+                aggregator = tool_calls.get(index)
+                if aggregator is None:
+                    aggregator = tool_calls[index] = ToolCallAggregator()
+                aggregator.update(tool_call)
+
+    def to_choice(self, index=0):
+        tool_calls = [self.tool_calls[i].to_tool_call() for i in sorted(self.tool_calls)]
         return Choice(
-            index=0,
+            index=index,
             finish_reason=self.finish_reason,
             message=ChatCompletionMessage(
                 content=self.content,
-                role=self.role,
-                tool_calls=[tool_call.to_tool_call() for tool_call in self.tool_calls]
-                if self.tool_calls
-                else None,
+                role=self.role or "assistant",
+                tool_calls=tool_calls or None,
             ),
         )
 
 
-class ChunkAggregator(BaseModel):
-    event_manger: LLMEventManager = None
-    id: Optional[str] = None
-    created: Optional[int] = None
-    model: Optional[str] = None
-    choices: Optional[ChoiceAggregator] = None
-    chunk_cnt: int = 0
-
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+class ChunkAggregator:
+    """
+    Rebuild a ChatCompletion from streamed chunks. Text and tool-call arguments are
+    collected as fragments and joined once, and the tokens of the first choice are
+    handed straight to the NEW_CHAT_TOKEN listeners of `event_manger`, if any.
+    """
+
+    __slots__ = ("id", "created", "model", "choices", "chunk_cnt", "_listeners")
+
+    def __init__(self, event_manger=None):
+        self.id = None
+        self.created = None
+        self.model = None
+        self.choices = {}
+        self.chunk_cnt = 0
+        # the live listener list, so callbacks added mid-stream still fire
+        self._listeners = (
+            event_manger.listeners[Event.NEW_CHAT_TOKEN] if event_manger is not None else None
+        )
 
     def update(self, chunk):
         if chunk.id and not self.id:
@@ -107,28 +131,31 @@ class ChunkAggregator(BaseModel):
         if chunk.created and not self.created:
             self.created = chunk.created
 
-        if chunk.choices:
-            if not self.choices:
-                self.choices = []
-
-            for i, choice in enumerate(chunk.choices):
-                if i >= len(self.choices):
-                    self.choices.append(
-                        ChoiceAggregator(
-                            # only emit event for the first choice
-                            event_manager=self.event_manger if i == 0 else None
-                        )
-                    )
-
-                self.choices[i].update(choice)
+        for position, choice in enumerate(chunk.choices or ()):
+            index = choice.index if choice.index is not None else position
+            aggregator = self.choices.get(index)
+            if aggregator is None:
+                # only emit events for the first choice
+                aggregator = self.choices[index] = ChoiceAggregator(
+                    self._listeners if index == 0 else None
+                )
+            aggregator.update(choice)
 
         self.chunk_cnt += 1
 
+    @property
+    def tokens(self):
+        """
+        The text fragments of the first choice, in the order they were streamed.
+        """
+        choice = self.choices.get(0)
+        return list(choice._content) if choice is not None else []
+
     def to_chat_completion(self):
         return ChatCompletion(
-            id=self.id,
-            created=self.created,
-            model=self.model,
-            choices=[choice.to_choice() for choice in self.choices],
+            id=self.id or "",
+            created=self.created or 0,
+            model=self.model or "",
+            choices=[self.choices[i].to_choice(i) for i in sorted(self.choices)],
             object="chat.completion",
         )
@@ -1,12 +1,19 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Type
-from pydantic import BaseModel, Field
+from typing import Any, Optional, Type
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class Tool(BaseModel, ABC):
     name: str
     description: str
     args_schema: Optional[Type[BaseModel]] = None
+    # the result depends only on the arguments, so it can be memoized
+    pure: bool = False
+    # seconds before a call is abandoned and reported to the model as failed
+    timeout: Optional[float] = None
+
+    # set by mosaicpy.llm.openai.function.compile_tool
+    _compiled: Any = PrivateAttr(default=None)
 
     @abstractmethod
     def _run(self, *args, **kwargs):
@@ -21,6 +28,7 @@ class CalculatorTool(Tool):
     name: str = "Calculator"
     description: str = "A simple calculator"
     args_schema: Type[BaseModel] = CalculatorSchema
+    pure: bool = True
 
     def _run(self, expr: str):
         import numexpr as ne
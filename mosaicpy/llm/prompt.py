@@ -1,7 +1,16 @@
+import functools
+
 from mosaicpy.utils.time import get_dt_local
 
 
+@functools.lru_cache(maxsize=128)
+def _replace_date(prompt: str, date: str) -> str:
+    return prompt.replace("__DATE__", date)
+
+
 def replace_magic_placeholders(prompt: str) -> str:
-    prompt = prompt.replace("__DATE__", get_dt_local("%Y-%m-%d (%a)"))
+    # memoized per day, so a long prompt yields the same string object every turn
+    if "__DATE__" not in prompt:
+        return prompt
 
-    return prompt
+    return _replace_date(prompt, get_dt_local("%Y-%m-%d (%a)"))
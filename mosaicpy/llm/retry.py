@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# status codes worth retrying: timeouts, conflicts, rate limits, server errors, overloaded
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+# errors raised before a response arrives, named the same in the OpenAI and Anthropic SDKs
+RETRYABLE_ERRORS = frozenset({"APITimeoutError", "APIConnectionError"})
+
+
+def get_retry_after(error) -> Optional[float]:
+    """
+    Read the server's Retry-After hint (in seconds) from an API error, if any.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name == "retry-after-ms" else seconds
+
+    return None
+
+
+def is_retryable(error) -> bool:
+    """
+    Whether an API error is transient: a timeout, a dropped connection, a rate limit
+    or a server error. Client errors such as a bad request are not retried.
+    """
+    if any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+class RetryAttempt(NamedTuple):
+    """
+    A failed attempt that is about to be retried, as passed to the `on_retry` callback.
+    """
+
+    attempt: int
+    error: Exception
+    # the seconds until the next attempt
+    delay: float
+    elapsed: float
+    retry_after: Optional[float]
+
+
+class RetryPolicy:
+    """
+    Retry transient API errors with decorrelated jitter: each delay is drawn uniformly
+    between `base_delay` and three times the previous delay, capped at `max_delay`, so
+    clients that failed together do not retry together. A server's Retry-After hint is
+    used as the lower bound of the delay.
+
+    The policy gives up after `max_attempts` attempts, or as soon as the next attempt
+    would start after `deadline` seconds from the first one, and re-raises the last
+    error.
+
+    Args:
+        max_attempts (int, optional): The maximum number of attempts, including the first.
+        base_delay (float, optional): The minimum delay between attempts in seconds.
+        max_delay (float, optional): The maximum delay between attempts in seconds.
+        deadline (float, optional): The total time budget in seconds. Unbounded if None.
+        retryable (callable, optional): Decides whether an error is retried.
+        seed (int, optional): The seed of the jitter.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        deadline: Optional[float] = 120.0,
+        retryable: Callable[[Exception], bool] = is_retryable,
+        seed: Optional[int] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retryable = retryable
+
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.sleep_time = 0.0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "RetryPolicy":
+        return cls(
+            max_attempts=config.max_retry,
+            base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay,
+            deadline=config.retry_deadline,
+        )
+
+    def next_delay(self, previous: Optional[float], retry_after: Optional[float] = None):
+        with self._lock:
+            upper = max(self.base_delay, (previous or self.base_delay) * 3)
+            delay = min(self.max_delay, self._random.uniform(self.base_delay, upper))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _on_error(self, error, attempt, previous, start):
+        """
+        Decide what to do after a failed attempt. Returns the delay before the next
+        attempt, or None to give up.
+        """
+        if not self.retryable(error) or attempt >= self.max_attempts:
+            return None
+
+        delay = self.next_delay(previous, get_retry_after(error))
+        if self.deadline is not None and time.monotonic() - start + delay > self.deadline:
+            return None
+        return delay
+
+    def _record(self, attempts, retries, sleep_time, failed):
+        with self._lock:
+            self.calls += 1
+            self.attempts += attempts
+            self.retries += retries
+            self.sleep_time += sleep_time
+            self.failures += failed
+
+    def _report(self, on_retry, attempt, error, delay, start):
+        retry_after = get_retry_after(error)
+        if delay is None:
+            if attempt > 1:
+                logger.warning(f"Giving up after {attempt} attempts: {error!r}")
+            return
+        logger.warning(f"Attempt {attempt} failed ({error!r}), retrying in {delay:.2f}s")
+        if on_retry is not None:
+            on_retry(RetryAttempt(attempt, error, delay, time.monotonic() - start, retry_after))
+
+    def call(self, func: Callable, on_retry: Optional[Callable[[RetryAttempt], None]] = None):
+        """
+        Call `func` until it succeeds or the policy gives up.
+
+        Args:
+            func (callable): The function to call, without arguments.
+            on_retry (callable, optional): Called with a RetryAttempt before each retry.
+
+        Returns:
+            The result of `func`.
+        """
+        start, delay, slept = time.monotonic(), None, 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._on_error(e, attempt, delay, start)
+                self._report(on_retry, attempt, e, delay, start)
+                if delay is None:
+                    self._record(attempt, attempt - 1, slept, 1)
+                    raise
+                time.sleep(delay)
+                slept += delay
+                continue
+
+            self._record(attempt, attempt - 1, slept, 0)
+            return result
+
+    async def acall(
+        self, func: Callable, on_retry: Optional[Callable[[RetryAttempt], None]] = None
+    ):
+        """
+        Async version of `call`; `func` returns an awaitable.
+        """
+        start, delay, slept = time.monotonic(), None, 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._on_error(e, attempt, delay, start)
+                self._report(on_retry, attempt, e, delay, start)
+                if delay is None:
+                    self._record(attempt, attempt - 1, slept, 1)
+                    raise
+                await asyncio.sleep(delay)
+                slept += delay
+                continue
+
+            self._record(attempt, attempt - 1, slept, 0)
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                calls=self.calls,
+                attempts=self.attempts,
+                retries=self.retries,
+                failures=self.failures,
+                sleep_time=self.sleep_time,
+            )
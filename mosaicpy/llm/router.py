@@ -0,0 +1,399 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+from mosaicpy.llm import Agent
+from mosaicpy.llm.schema import BaseConfig, ChatResponse, TextDelta, TokenUsage
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """
+    The background event loop that runs the attempts of synchronous calls. Async
+    requests can be cancelled mid-read, so a losing hedged attempt is torn down at
+    once instead of holding a thread and an HTTP stream until it finishes.
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop, _loop_pid = asyncio.new_event_loop(), os.getpid()
+            threading.Thread(target=_loop.run_forever, name="mosaicpy-router", daemon=True).start()
+        return _loop
+
+
+class CircuitBreaker:
+    """
+    Stop routing to an agent after `failure_threshold` consecutive failures. After
+    `reset_timeout` seconds one trial request is let through; its success closes the
+    breaker again, its failure keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """
+        Whether `allow` would let a request through now. Unlike `allow`, it does not
+        claim the half-open trial, so it is safe to use when ranking agents.
+        """
+        return self.state != "open"
+
+    def allow(self) -> bool:
+        """
+        Claim permission to send a request, using up the half-open trial if any.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # let a single trial through per reset window
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class _Route:
+    __slots__ = ("agent", "breaker", "latency")
+
+    def __init__(self, agent, breaker):
+        self.agent = agent
+        self.breaker = breaker
+        # moving average of the time to first token, in seconds
+        self.latency = None
+
+
+class RouterConfig(BaseConfig):
+    model_name: str = "router"
+    # send a second request if the first has not produced a token after this long
+    hedge_after_ms: Optional[float] = None
+    # the number of extra requests a single call may hedge with
+    max_hedges: int = 1
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    # the weight of the newest sample in the per-agent latency average
+    latency_alpha: float = 0.2
+
+
+class RouterAgent(Agent):
+    """
+    An agent that routes each call to one of several agents.
+
+    Agents are picked at random with weights inversely proportional to their recent
+    time to first token, skipping agents whose circuit breaker is open. A failed call
+    falls back to the next agent. With `hedge_after_ms`, a call that has produced no
+    token by then is raced against a request to the next agent; the first to produce
+    a token wins and the other is cancelled.
+
+    Synchronous calls run their attempts on a background event loop through the
+    agents' async API, so a cancelled attempt closes its request even before the first
+    token. Agents without a native async client cannot be interrupted and run their
+    request to completion.
+
+    The child agents should not keep conversation state of their own.
+    """
+
+    def __init__(
+        self,
+        agents: list[Agent],
+        config: RouterConfig = None,
+        seed: Optional[int] = None,
+        **kwargs,
+    ):
+        if config is None:
+            config = RouterConfig(**kwargs)
+        super().__init__(config=config, tools=None, **kwargs)
+
+        if not agents:
+            raise ValueError("RouterAgent needs at least one agent")
+
+        self.agents = list(agents)
+        self._routes = [
+            _Route(agent, CircuitBreaker(config.failure_threshold, config.reset_timeout))
+            for agent in self.agents
+        ]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def get_token_usage(self) -> TokenUsage:
+        """
+        The usage of all child agents, including hedged requests that also finished.
+        """
+        usage = TokenUsage()
+        for agent in self.agents:
+            usage.update(agent.get_token_usage())
+        return usage
+
+    def stats(self) -> list[dict]:
+        return [
+            dict(
+                agent=type(route.agent).__name__,
+                model=route.agent.config.model_name,
+                latency=route.latency,
+                failures=route.breaker.failures,
+                state=route.breaker.state,
+            )
+            for route in self._routes
+        ]
+
+    def _order_routes(self):
+        """
+        Order the available routes by weighted random sampling without replacement,
+        weighting each route by the inverse of its latency.
+        """
+        routes = [route for route in self._routes if route.breaker.available()]
+        if not routes:
+            raise RuntimeError("All agents are unavailable (circuit breakers open)")
+
+        known = [route.latency for route in routes if route.latency]
+        default = sum(known) / len(known) if known else 1.0
+        with self._lock:
+            keys = [self._random.random() ** (route.latency or default) for route in routes]
+        return [route for _, route in sorted(zip(keys, routes), key=lambda x: -x[0])]
+
+    def _record_latency(self, route, latency):
+        alpha = self.config.latency_alpha
+        with self._lock:
+            if route.latency is None:
+                route.latency = latency
+            else:
+                route.latency = alpha * latency + (1 - alpha) * route.latency
+
+    def _hedge_timeout(self, num_started):
+        hedge_after = self.config.hedge_after_ms
+        if hedge_after is None or num_started > self.config.max_hedges:
+            return None
+        return hedge_after / 1000
+
+    @staticmethod
+    def _next_route(routes):
+        """
+        Take the next route whose breaker lets a request through, claiming its
+        half-open trial, or None when no route is left.
+        """
+        for route in routes:
+            if route.breaker.allow():
+                return route
+        return None
+
+    def chat_stream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        routes = iter(self._order_routes())
+        args = (user_input,)
+        kwargs = dict(kwargs, image=image, temperature=temperature, max_tokens=max_tokens)
+
+        loop = _get_loop()
+        events = queue.Queue()
+        started, attempts = {}, {}
+
+        def start():
+            route = self._next_route(routes)
+            if route is None:
+                return False
+            started[route] = time.monotonic()
+            # cancelling the returned future cancels the attempt's task on the loop
+            attempts[route] = asyncio.run_coroutine_threadsafe(
+                self._arun_attempt(route, events.put, args, kwargs), loop
+            )
+            return True
+
+        if not start():
+            raise RuntimeError("All agents are unavailable (circuit breakers open)")
+        winner, last_error, exhausted = None, None, False
+        try:
+            while True:
+                timeout = None
+                if winner is None and not exhausted:
+                    timeout = self._hedge_timeout(len(started))
+                try:
+                    route, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    logger.info("No first token yet, hedging with the next agent")
+                    exhausted = not start()
+                    continue
+
+                if winner is not None and route is not winner:
+                    continue
+
+                if kind == "error":
+                    route.breaker.record_failure()
+                    attempts.pop(route)
+                    logger.warning(f"Agent {type(route.agent).__name__} failed: {payload}")
+                    if winner is not None:
+                        raise payload
+                    last_error = payload
+                    if not attempts and not start():
+                        raise last_error
+                    continue
+
+                if winner is None:
+                    winner = route
+                    self._record_latency(route, time.monotonic() - started[route])
+                    for other, attempt in attempts.items():
+                        if other is not winner:
+                            attempt.cancel()
+
+                if isinstance(payload, TextDelta):
+                    self.event_manager.publish_new_chat_token(payload.text)
+                elif isinstance(payload, ChatResponse):
+                    winner.breaker.record_success()
+                    self.event_manager.publish_finish_chat(payload)
+                    yield payload
+                    return
+
+                yield payload
+        finally:
+            for attempt in attempts.values():
+                attempt.cancel()
+
+    def chat(
+        self,
+        user_input,
+        image=None,
+        return_all=False,
+        temperature=None,
+        max_tokens=None,
+        **kwargs,
+    ):
+        for event in self.chat_stream(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        ):
+            response = event
+
+        return response if return_all else response.content
+
+    async def _arun_attempt(self, route, put, args, kwargs):
+        """
+        Stream one attempt, passing (route, kind, payload) tuples to `put`.
+        """
+        try:
+            async for event in route.agent.achat_stream(*args, **kwargs):
+                put((route, "event", event))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            put((route, "error", e))
+
+    async def achat_stream(
+        self, user_input, image=None, temperature=None, max_tokens=None, **kwargs
+    ):
+        routes = iter(self._order_routes())
+        args = (user_input,)
+        kwargs = dict(kwargs, image=image, temperature=temperature, max_tokens=max_tokens)
+
+        events = asyncio.Queue()
+        started, tasks = {}, {}
+
+        def start():
+            route = self._next_route(routes)
+            if route is None:
+                return False
+            started[route] = time.monotonic()
+            tasks[route] = asyncio.create_task(
+                self._arun_attempt(route, events.put_nowait, args, kwargs)
+            )
+            return True
+
+        if not start():
+            raise RuntimeError("All agents are unavailable (circuit breakers open)")
+        winner, last_error, exhausted = None, None, False
+        try:
+            while True:
+                timeout = None
+                if winner is None and not exhausted:
+                    timeout = self._hedge_timeout(len(started))
+                try:
+                    route, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.info("No first token yet, hedging with the next agent")
+                    exhausted = not start()
+                    continue
+
+                if winner is not None and route is not winner:
+                    continue
+
+                if kind == "error":
+                    route.breaker.record_failure()
+                    tasks.pop(route)
+                    logger.warning(f"Agent {type(route.agent).__name__} failed: {payload}")
+                    if winner is not None:
+                        raise payload
+                    last_error = payload
+                    if not tasks and not start():
+                        raise last_error
+                    continue
+
+                if winner is None:
+                    winner = route
+                    self._record_latency(route, time.monotonic() - started[route])
+                    for other, task in tasks.items():
+                        if other is not winner:
+                            task.cancel()
+
+                if isinstance(payload, TextDelta):
+                    self.event_manager.publish_new_chat_token(payload.text)
+                elif isinstance(payload, ChatResponse):
+                    winner.breaker.record_success()
+                    self.event_manager.publish_finish_chat(payload)
+                    yield payload
+                    return
+
+                yield payload
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def achat(
+        self,
+        user_input,
+        image=None,
+        return_all=False,
+        temperature=None,
+        max_tokens=None,
+        **kwargs,
+    ):
+        async for event in self.achat_stream(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        ):
+            response = event
+
+        return response if return_all else response.content
+
+    async def astream(self, user_input, image=None, temperature=None, max_tokens=None, **kwargs):
+        async for event in self.achat_stream(
+            user_input, image=image, temperature=temperature, max_tokens=max_tokens, **kwargs
+        ):
+            if isinstance(event, TextDelta):
+                yield event.text
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import NamedTuple, Optional
 from mosaicpy.collections import dict as mdict
 
 from pydantic import BaseModel, ConfigDict
@@ -18,8 +18,16 @@ class BaseConfig(BaseModel):
     # system
     json_output: bool = False
     keep_conversation_state: bool = False
-    max_retry: int = 16
+    max_history_tokens: Optional[int] = None
+    history_strategy: str = "sliding_window"
+    history_keep_last: int = 2
+    # the maximum number of attempts per request, and the total time they may take
+    max_retry: int = 6
+    retry_deadline: Optional[float] = 120
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 30
     timeout: int = 60
+    base_url: Optional[str] = None
     stream: bool = False
     enable_magic_placeholders: bool = True
     verbose: bool = False
@@ -27,6 +35,9 @@ class BaseConfig(BaseModel):
     # tools
     execute_tools: bool = True
     support_tools: bool = True
+    max_tool_rounds: int = 1
+    max_tool_workers: int = 8
+    tool_timeout: Optional[float] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True, protected_namespaces=())
 
@@ -44,16 +55,24 @@ class SimpleMessage(BaseModel):
 class TokenUsage(BaseModel):
     prompt: int = 0
     completion: int = 0
+    # prompt tokens served from / written to the provider's prompt cache
+    cache_read: int = 0
+    cache_write: int = 0
 
     def update(self, usage):
         self.prompt += usage.prompt
         self.completion += usage.completion
+        self.cache_read += usage.cache_read
+        self.cache_write += usage.cache_write
 
 
 class Event(Enum):
     NEW_CHAT_TOKEN = 1
     USE_TOOL = 2
     FINISH_CHAT = 3
+    RATE_LIMIT = 4
+    RETRY = 5
+    CALL_METRICS = 6
 
 
 class ChatResponse(BaseModel):
@@ -62,3 +81,21 @@ class ChatResponse(BaseModel):
     finish_reason: str
     usage: TokenUsage
     input_contents: list[dict]
+
+
+# events yielded by chat_stream, ending with the ChatResponse
+
+
+class TextDelta(NamedTuple):
+    text: str
+
+
+class ToolCallDelta(NamedTuple):
+    index: int
+    id: Optional[str] = None
+    name: Optional[str] = None
+    arguments: Optional[str] = None
+
+
+class UsageDelta(NamedTuple):
+    usage: TokenUsage
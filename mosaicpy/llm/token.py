@@ -1,60 +1,156 @@
+import collections
+import functools
+import hashlib
 import json
+import threading
 
+DEFAULT_ENCODING = "cl100k_base"
 
-def count_openai_token(text, encoding_name="cl100k_base"):
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name: str = DEFAULT_ENCODING):
+    """
+    Return the tiktoken encoding for an encoding or model name, loading it once per
+    process. Unknown models fall back to the default encoding.
+    """
     import tiktoken
 
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(text))
-    return num_tokens
-
-
-def estimate_request_tokens(msgs, tools=None):
-    text = ""
-    for msg in msgs:
-        if isinstance(msg, dict):
-            text += f"{msg.get('role')}:\n"
-            if msg.get("tool_calls"):
-                tool_calls = msg.get("tool_calls")
-                for tool_call in tool_calls:
-                    text += f"{tool_call.id} {tool_call.function.name}({tool_call.function.arguments})\n"
-            if msg.get("content"):
-                content = msg.get("content")
-                if isinstance(content, list):
-                    for content in content:
-                        if content.get("type") == "text":
-                            text += f"{content.get('text')}\n"
-                else:
-                    text += f"{content}\n"
+    try:
+        return tiktoken.get_encoding(name)
+    except ValueError:
+        pass
+
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_openai_token(text, encoding_name=DEFAULT_ENCODING):
+    return len(get_encoding(encoding_name).encode(text))
+
+
+def encode_batch(texts, encoding_name=DEFAULT_ENCODING, num_threads=8):
+    """
+    Encode many texts at once, using tiktoken's native thread pool.
+    """
+    return get_encoding(encoding_name).encode_batch(list(texts), num_threads=num_threads)
+
+
+def count_tokens_batch(texts, encoding_name=DEFAULT_ENCODING, num_threads=8):
+    return [len(tokens) for tokens in encode_batch(texts, encoding_name, num_threads)]
+
+
+class _CountCache:
+    """
+    An LRU cache of token counts keyed on a digest of the text, so it holds 16-byte
+    keys rather than every prompt it has seen.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.misses = 0
+        self._counts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text, encoding_name):
+        key = (hashlib.blake2b(text.encode(), digest_size=16).digest(), encoding_name)
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+            self.misses += 1
+
+        count = count_openai_token(text, encoding_name)
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_count_cache = _CountCache(maxsize=65536)
+
+
+def _count_cached(text, encoding_name):
+    return _count_cache.count(text, encoding_name)
+
+
+def _content_text(content):
+    if isinstance(content, list):
+        return "".join(f"{part.get('text')}\n" for part in content if part.get("type") == "text")
+    return f"{content}\n"
+
+
+def _message_text(msg):
+    if isinstance(msg, dict):
+        role, tool_calls, content = msg.get("role"), msg.get("tool_calls"), msg.get("content")
+    else:
+        role, tool_calls, content = msg.role, msg.tool_calls, msg.content
+
+    text = f"{role}:\n"
+    for tool_call in tool_calls or []:
+        if isinstance(tool_call, dict):
+            function = tool_call["function"]
+            text += f"{function['name']}({function['arguments']})\n"
         else:
-            text += f"{msg.role}:\n"
-            if msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    text += f"{tool_call.function.name}({tool_call.function.arguments})\n"
+            text += f"{tool_call.function.name}({tool_call.function.arguments})\n"
+    if content:
+        text += _content_text(content)
+
+    return text + "\n"
 
-        text += "\n"
 
-    if tools:
-        text += "Tools:\n"
-        for tool in tools:
-            func = tool.get("function")
-            text += (
-                f"{func['name']}:\n{func['description']}\n"
-                + json.dumps(func.get("parameters"))
-                + "\n"
-            )
+def count_message_tokens(msg, encoding_name=DEFAULT_ENCODING):
+    """
+    Count the tokens of one chat message. Counts are memoized on the message text, so
+    re-estimating a growing conversation only tokenizes the new turns.
+    """
+    return _count_cached(_message_text(msg), encoding_name)
 
-    return count_openai_token(text) + len(msgs) * 2
 
+def tool_text(signature: dict) -> str:
+    """
+    The text a tool signature is counted as.
+    """
+    func = signature["function"]
+    return f"{func['name']}:\n{func['description']}\n" + json.dumps(func.get("parameters")) + "\n"
 
-def estimate_response_tokens(completion):
-    tokens = 0
+
+def _tools_text(tools):
+    return "Tools:\n" + "".join(tool_text(tool) for tool in tools)
+
+
+def estimate_request_tokens(msgs, tools=None, encoding_name=DEFAULT_ENCODING, tool_tokens=None):
+    """
+    Estimate the prompt tokens of a request. `tool_tokens` is the precomputed count of
+    the tool definitions, which saves serializing `tools` again.
+    """
+    tokens = sum(count_message_tokens(msg, encoding_name) for msg in msgs)
+    if tool_tokens is not None:
+        tokens += tool_tokens
+    elif tools:
+        tokens += _count_cached(_tools_text(tools), encoding_name)
+
+    return tokens + len(msgs) * 2
+
+
+def estimate_response_tokens(completion, encoding_name=DEFAULT_ENCODING):
+    texts = []
     for choice in completion.choices:
         msg = choice.message
 
         if msg.content:
-            tokens += count_openai_token(msg.content)
+            texts.append(msg.content)
         else:
             for tool_call in msg.tool_calls:
-                tokens += count_openai_token(tool_call.function.name + tool_call.function.arguments)
-    return tokens
+                texts.append(tool_call.function.name + tool_call.function.arguments)
+
+    if len(texts) == 1:
+        return count_openai_token(texts[0], encoding_name)
+    return sum(count_tokens_batch(texts, encoding_name))
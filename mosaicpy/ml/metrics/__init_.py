@@ -1,3 +0,0 @@
-from .ranking import ndcg_at_k
-
-__all__ = ["ndcg_at_k"]
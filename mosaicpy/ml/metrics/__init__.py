@@ -0,0 +1,20 @@
+from .batch import (
+    dcg_at_k_batch,
+    evaluate_batch,
+    evaluate_stream,
+    mrr_at_k_batch,
+    ndcg_at_k_batch,
+    recall_at_k_batch,
+)
+from .ranking import dcg_at_k, ndcg_at_k
+
+__all__ = [
+    "dcg_at_k",
+    "ndcg_at_k",
+    "dcg_at_k_batch",
+    "ndcg_at_k_batch",
+    "mrr_at_k_batch",
+    "recall_at_k_batch",
+    "evaluate_batch",
+    "evaluate_stream",
+]
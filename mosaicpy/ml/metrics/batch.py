@@ -0,0 +1,195 @@
+"""
+Vectorized ranking metrics over many queries at once.
+
+Relevance can be given either as a 2-D array (one row per query, in ranked order,
+padded with zeros) or as a ragged CSR-style pair `(values, offsets)` where query `i`
+owns `values[offsets[i]:offsets[i + 1]]`. A relevance above zero counts as a hit for
+MRR and recall.
+"""
+
+import functools
+
+import numpy as np
+
+METRICS = ("dcg", "ndcg", "mrr", "recall")
+
+
+@functools.lru_cache(maxsize=64)
+def _discounts(k):
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    discounts.setflags(write=False)
+    return discounts
+
+
+def _is_ragged(relevance):
+    return isinstance(relevance, tuple) and len(relevance) == 2
+
+
+def _num_queries(relevance):
+    if _is_ragged(relevance):
+        return len(relevance[1]) - 1
+    return len(relevance)
+
+
+def _slice_queries(relevance, start, end):
+    if _is_ragged(relevance):
+        values, offsets = relevance
+        offsets = np.asarray(offsets)[start : end + 1]
+        return np.asarray(values)[offsets[0] : offsets[-1]], offsets - offsets[0]
+    return relevance[start:end]
+
+
+def _evaluate_dense(relevance, k, metrics):
+    relevance = np.asarray(relevance, dtype=np.float64)
+    if relevance.ndim != 2:
+        raise ValueError("relevance must be a 2-D array or a (values, offsets) pair")
+
+    top = relevance[:, :k]
+    discounts = _discounts(k)[: top.shape[1]]
+    hits = relevance > 0
+    results = {}
+
+    if "dcg" in metrics or "ndcg" in metrics:
+        dcg = top @ discounts
+        results["dcg"] = dcg
+
+    if "ndcg" in metrics:
+        if k < relevance.shape[1]:
+            ideal = -np.partition(-relevance, k - 1, axis=1)[:, :k]
+        else:
+            ideal = relevance
+        ideal = -np.sort(-ideal, axis=1)
+        idcg = ideal @ discounts
+        results["ndcg"] = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg != 0)
+
+    if "mrr" in metrics:
+        top_hits = hits[:, :k]
+        first = top_hits.argmax(axis=1)
+        results["mrr"] = np.where(top_hits.any(axis=1), 1 / (first + 1), 0.0)
+
+    if "recall" in metrics:
+        total = hits.sum(axis=1)
+        found = hits[:, :k].sum(axis=1)
+        results["recall"] = np.divide(
+            found, total, out=np.zeros(len(total), dtype=np.float64), where=total != 0
+        )
+
+    return results
+
+
+def _evaluate_ragged(values, offsets, k, metrics):
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    size = len(offsets) - 1
+
+    row_ids = np.repeat(np.arange(size), np.diff(offsets))
+    positions = np.arange(len(values)) - offsets[:-1][row_ids]
+    in_top = positions < k
+    top_rows, top_positions = row_ids[in_top], positions[in_top]
+    discounts = _discounts(k)
+    hits = values > 0
+    results = {}
+
+    if "dcg" in metrics or "ndcg" in metrics:
+        dcg = np.bincount(
+            top_rows, weights=values[in_top] * discounts[top_positions], minlength=size
+        )
+        results["dcg"] = dcg
+
+    if "ndcg" in metrics:
+        ideal = values[np.lexsort((-values, row_ids))]
+        idcg = np.bincount(
+            top_rows, weights=ideal[in_top] * discounts[top_positions], minlength=size
+        )
+        results["ndcg"] = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg != 0)
+
+    if "mrr" in metrics:
+        top_hits = hits & in_top
+        hit_rows, first = np.unique(row_ids[top_hits], return_index=True)
+        mrr = np.zeros(size)
+        mrr[hit_rows] = 1 / (positions[top_hits][first] + 1)
+        results["mrr"] = mrr
+
+    if "recall" in metrics:
+        total = np.bincount(row_ids[hits], minlength=size)
+        found = np.bincount(row_ids[hits & in_top], minlength=size)
+        results["recall"] = np.divide(
+            found, total, out=np.zeros(size, dtype=np.float64), where=total != 0
+        )
+
+    return results
+
+
+def _evaluate_chunk(relevance, k, metrics):
+    if _is_ragged(relevance):
+        results = _evaluate_ragged(relevance[0], relevance[1], k, metrics)
+    else:
+        results = _evaluate_dense(relevance, k, metrics)
+    return {metric: results[metric] for metric in metrics}
+
+
+def evaluate_batch(relevance, k, metrics=("ndcg",), chunk_size=None):
+    """
+    Compute ranking metrics@k for every query in one pass.
+
+    Args:
+        relevance: A 2-D relevance array or a ragged `(values, offsets)` pair.
+        k (int): The position up to which to consider.
+        metrics (tuple, optional): Any of "dcg", "ndcg", "mrr" and "recall".
+            Defaults to ("ndcg",).
+        chunk_size (int, optional): Evaluate this many queries at a time to bound the
+            temporary memory. Defaults to all queries at once.
+
+    Returns:
+        dict[str, np.ndarray]: One array of per-query values per metric.
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+
+    size = _num_queries(relevance)
+    if chunk_size is None or chunk_size >= size:
+        return _evaluate_chunk(relevance, k, metrics)
+
+    chunks = [
+        _evaluate_chunk(_slice_queries(relevance, start, min(start + chunk_size, size)), k, metrics)
+        for start in range(0, size, chunk_size)
+    ]
+    return {metric: np.concatenate([chunk[metric] for chunk in chunks]) for metric in metrics}
+
+
+def evaluate_stream(chunks, k, metrics=("ndcg",)):
+    """
+    Compute the mean of ranking metrics@k over an iterable of relevance chunks (each a
+    2-D array or a `(values, offsets)` pair), so the full input never has to fit in
+    memory.
+
+    Returns:
+        dict[str, float]: The mean value of each metric over all queries.
+    """
+    totals = {metric: 0.0 for metric in metrics}
+    count = 0
+
+    for chunk in chunks:
+        results = evaluate_batch(chunk, k, metrics)
+        for metric in metrics:
+            totals[metric] += float(results[metric].sum())
+        count += _num_queries(chunk)
+
+    return {metric: total / count if count else 0.0 for metric, total in totals.items()}
+
+
+def dcg_at_k_batch(relevance, k):
+    return evaluate_batch(relevance, k, ("dcg",))["dcg"]
+
+
+def ndcg_at_k_batch(relevance, k):
+    return evaluate_batch(relevance, k, ("ndcg",))["ndcg"]
+
+
+def mrr_at_k_batch(relevance, k):
+    return evaluate_batch(relevance, k, ("mrr",))["mrr"]
+
+
+def recall_at_k_batch(relevance, k):
+    return evaluate_batch(relevance, k, ("recall",))["recall"]
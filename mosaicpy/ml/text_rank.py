@@ -1,11 +1,82 @@
+from typing import NamedTuple
+
 import numpy as np
 
-from mosaicpy.ml.vector import cosine_similarity
+from mosaicpy.ml.vector import cosine_similarity_matrix, normalize_rows, top_k_similarity
+
+
+class RankStats(NamedTuple):
+    iterations: int
+    residual: float
+    converged: bool
+
+
+def _import_sparse():
+    try:
+        import scipy.sparse
+    except ImportError as e:
+        raise ImportError(
+            "Sparse similarity graphs (top_k, threshold and batch ranking) require scipy, "
+            "which is not installed: pip install scipy"
+        ) from e
+    return scipy.sparse
 
 
 def _norm_similarity_matrix(similarity_matrix):
-    for i in range(similarity_matrix.shape[0]):
-        similarity_matrix[i] /= similarity_matrix[i].sum()
+    row_sums = np.asarray(similarity_matrix.sum(axis=1)).ravel()
+    row_sums[row_sums == 0] = 1
+
+    if hasattr(similarity_matrix, "tocsr"):
+        from scipy.sparse import diags
+
+        return (diags(1 / row_sums) @ similarity_matrix).tocsr()
+
+    similarity_matrix /= row_sums[:, None]
+    return similarity_matrix
+
+
+def build_similarity_graph(
+    embeddings, top_k=None, threshold=None, block_size=1024, dtype=np.float32
+):
+    """
+    Build a sparse (CSR) cosine-similarity graph without materializing the dense
+    n x n matrix.
+
+    Args:
+        embeddings (array-like): An (n, d) array of embeddings.
+        top_k (int, optional): Keep only the `top_k` most similar neighbors of every row.
+        threshold (float, optional): Drop edges whose similarity is below `threshold`.
+        block_size (int, optional): Rows per similarity block. Defaults to 1024.
+        dtype (optional): Similarity dtype. Defaults to np.float32.
+
+    Returns:
+        scipy.sparse.csr_matrix: The (n, n) similarity graph.
+    """
+    if top_k is None and threshold is None:
+        raise ValueError("Either top_k or threshold must be given")
+    sparse = _import_sparse()
+
+    if top_k is not None:
+        indices, scores = top_k_similarity(embeddings, top_k, block_size=block_size, dtype=dtype)
+        size, k = indices.shape
+        indptr = np.arange(0, size * k + 1, k)
+        graph = sparse.csr_matrix((scores.ravel(), indices.ravel(), indptr), shape=(size, size))
+
+        if threshold is not None:
+            graph.data[graph.data < threshold] = 0
+            graph.eliminate_zeros()
+        return graph
+
+    embeddings = np.asarray(embeddings)
+    blocks = []
+    for start in range(0, len(embeddings), block_size):
+        block = cosine_similarity_matrix(
+            embeddings[start : start + block_size], embeddings, dtype=dtype
+        )
+        block[block < threshold] = 0
+        blocks.append(sparse.csr_matrix(block))
+
+    return sparse.vstack(blocks, format="csr")
 
 
 class TextRanker:
@@ -14,32 +85,224 @@ class TextRanker:
         self.max_iter = max_iter
         self.tol = tol
 
-    def _rank(self, similarity_matrix):
-        ranks = np.ones(similarity_matrix.shape[0])
+    def _rank(self, similarity_matrix, ranks=None, offsets=None, row_sums=None, return_stats=False):
+        """
+        Run the power iteration on a row-normalized dense or sparse matrix.
 
-        for iter in range(self.max_iter):
-            new_ranks = (1 - self.damping_factor) + self.damping_factor * np.dot(
-                similarity_matrix.T, ranks
-            )
+        If `row_sums` is given, the matrix is taken as unnormalized and the row sums
+        are applied to the rank vector instead, which avoids rewriting the matrix.
+        Rows summing to zero are dangling nodes; their rank is spread evenly over the
+        nodes of the same block, where blocks are delimited by `offsets` (defaults to
+        a single block covering the whole matrix).
+        """
+        size = similarity_matrix.shape[0]
+        ranks = np.ones(size) if ranks is None else np.array(ranks, dtype=np.float64)
+
+        if hasattr(similarity_matrix, "tocsr"):
+            similarity_matrix = similarity_matrix.tocsr()
+        transposed = similarity_matrix.T
+
+        if row_sums is None:
+            dangling = np.asarray(similarity_matrix.sum(axis=1)).ravel() == 0
+            scale = None
+        else:
+            dangling = row_sums == 0
+            scale = 1 / np.where(dangling, 1, row_sums)
+
+        if offsets is None:
+            offsets = np.array([0, size])
+        block_sizes = np.diff(offsets)
+        block_ids = np.repeat(np.arange(len(block_sizes)), block_sizes)
 
-            if np.linalg.norm(new_ranks - ranks, 2) < self.tol:
+        residual = np.inf
+        iter = 0
+        for iter in range(1, self.max_iter + 1):
+            flow = transposed.dot(ranks if scale is None else ranks * scale)
+            if dangling.any():
+                dangling_mass = np.bincount(
+                    block_ids, weights=np.where(dangling, ranks, 0), minlength=len(block_sizes)
+                )
+                flow = flow + (dangling_mass / np.maximum(block_sizes, 1))[block_ids]
+
+            new_ranks = (1 - self.damping_factor) + self.damping_factor * flow
+
+            residual = float(np.linalg.norm(new_ranks - ranks, 2))
+            if residual < self.tol:
                 break
 
             ranks = new_ranks
 
+        if return_stats:
+            return ranks, RankStats(iter, residual, residual < self.tol)
         return ranks
 
     def rank_sentences(self, sentences):
         pass
 
-    def rank_embeddings(self, embeddings):
-        size = len(embeddings)
-        similarity_matrix = np.zeros((size, size))
+    def rank_graph(self, adjacency, ranks=None, return_stats=False):
+        """
+        Rank the nodes of a weighted graph given as a dense array or a scipy sparse
+        (e.g. CSR) adjacency matrix.
+
+        Args:
+            adjacency: An (n, n) weighted adjacency matrix. It is not modified.
+            ranks (array-like, optional): Initial ranks to warm-start the iteration.
+            return_stats (bool, optional): Also return a RankStats. Defaults to False.
+        """
+        if hasattr(adjacency, "tocsr"):
+            adjacency = adjacency.tocsr().astype(np.float64)
+        else:
+            adjacency = np.array(adjacency, dtype=np.float64)
+
+        return self._rank(_norm_similarity_matrix(adjacency), ranks, return_stats=return_stats)
+
+    def rank_embeddings(
+        self,
+        embeddings,
+        top_k=None,
+        threshold=None,
+        ranks=None,
+        return_stats=False,
+        block_size=1024,
+        dtype=np.float32,
+    ):
+        """
+        Rank embeddings with TextRank over their cosine-similarity graph.
+
+        Args:
+            embeddings (array-like): An (n, d) array of embeddings.
+            top_k (int, optional): If given, keep only the `top_k` most similar neighbors
+                per row in a sparse graph instead of the dense n x n matrix.
+            threshold (float, optional): If given, drop edges below this similarity and
+                rank over a sparse graph.
+            ranks (array-like, optional): Initial ranks to warm-start the iteration.
+            return_stats (bool, optional): Also return a RankStats. Defaults to False.
+            block_size (int, optional): Rows per similarity block. Defaults to 1024.
+            dtype (optional): Similarity dtype. Defaults to np.float32.
+
+        Returns:
+            np.ndarray: The rank of each embedding.
+        """
+        if top_k is not None or threshold is not None:
+            similarity_matrix = build_similarity_graph(
+                embeddings, top_k, threshold, block_size=block_size, dtype=dtype
+            )
+        else:
+            similarity_matrix = cosine_similarity_matrix(
+                embeddings, block_size=block_size, dtype=dtype
+            )
+
+        similarity_matrix = _norm_similarity_matrix(similarity_matrix)
+
+        return self._rank(similarity_matrix, ranks, return_stats=return_stats)
+
+    def rank_embeddings_batch(
+        self, documents, top_k=None, threshold=None, return_stats=False, dtype=np.float32
+    ):
+        """
+        Rank many small documents in a single power iteration by laying their
+        similarity graphs out as one block-diagonal sparse matrix.
+
+        Args:
+            documents (list): A list of (n_i, d) embedding arrays, one per document.
+
+        Returns:
+            list[np.ndarray]: The ranks of each document, in input order.
+        """
+        sparse = _import_sparse()
+
+        graphs = []
+        for embeddings in documents:
+            if top_k is not None or threshold is not None:
+                graphs.append(build_similarity_graph(embeddings, top_k, threshold, dtype=dtype))
+            else:
+                graphs.append(sparse.csr_matrix(cosine_similarity_matrix(embeddings, dtype=dtype)))
+
+        offsets = np.concatenate([[0], np.cumsum([graph.shape[0] for graph in graphs])])
+        if offsets[-1] == 0:
+            return ([[] for _ in documents], RankStats(0, 0.0, True)) if return_stats else []
+
+        similarity_matrix = _norm_similarity_matrix(sparse.block_diag(graphs, format="csr"))
+        ranks, stats = self._rank(similarity_matrix, offsets=offsets, return_stats=True)
+        ranks = np.split(ranks, offsets[1:-1])
+
+        return (ranks, stats) if return_stats else ranks
+
+
+class IncrementalTextRanker:
+    """
+    A stateful TextRanker for embeddings that arrive over time.
+
+    Each call to `add` only computes the similarities of the new rows against the
+    existing ones (O(n * d)) and warm-starts the power iteration from the previous
+    ranks, so it usually converges in a few iterations.
+    """
+
+    def __init__(self, ranker=None, dtype=np.float32, initial_capacity=64):
+        self.ranker = ranker or TextRanker()
+        self.dtype = dtype
+        self.initial_capacity = initial_capacity
+        self.size = 0
+        self.ranks = np.empty(0)
+        self.stats = None
+
+        self._embeddings = None
+        self._similarity = None
+        self._row_sums = None
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size, dim):
+        if self._embeddings is None:
+            capacity = max(self.initial_capacity, size)
+            self._embeddings = np.zeros((capacity, dim), dtype=self.dtype)
+            self._similarity = np.zeros((capacity, capacity), dtype=self.dtype)
+            self._row_sums = np.zeros(capacity)
+            return
+
+        capacity = self._embeddings.shape[0]
+        if size <= capacity:
+            return
+
+        while capacity < size:
+            capacity *= 2
+
+        embeddings = np.zeros((capacity, dim), dtype=self.dtype)
+        embeddings[: self.size] = self._embeddings[: self.size]
+        similarity = np.zeros((capacity, capacity), dtype=self.dtype)
+        similarity[: self.size, : self.size] = self._similarity[: self.size, : self.size]
+        row_sums = np.zeros(capacity)
+        row_sums[: self.size] = self._row_sums[: self.size]
+
+        self._embeddings, self._similarity, self._row_sums = embeddings, similarity, row_sums
+
+    def add(self, embeddings):
+        """
+        Append one embedding (1-D) or a batch of embeddings (2-D) and update the ranks.
+
+        Returns:
+            np.ndarray: The ranks of all embeddings added so far.
+        """
+        new = normalize_rows(embeddings, dtype=self.dtype)
+        old_size, added = self.size, new.shape[0]
+        size = old_size + added
 
-        for i in range(size):
-            for j in range(size):
-                similarity_matrix[i][j] = cosine_similarity(embeddings[i], embeddings[j])
+        self._reserve(size, new.shape[1])
+        self._embeddings[old_size:size] = new
 
-        _norm_similarity_matrix(similarity_matrix)
+        block = new @ self._embeddings[:size].T
+        self._similarity[old_size:size, :size] = block
+        self._similarity[:old_size, old_size:size] = block[:, :old_size].T
+        self._row_sums[:old_size] += block[:, :old_size].sum(axis=0)
+        self._row_sums[old_size:size] = block.sum(axis=1)
+        self.size = size
 
-        return self._rank(similarity_matrix)
+        ranks = np.concatenate([self.ranks, np.ones(added)])
+        self.ranks, self.stats = self.ranker._rank(
+            self._similarity[:size, :size],
+            ranks,
+            row_sums=self._row_sums[:size],
+            return_stats=True,
+        )
+        return self.ranks
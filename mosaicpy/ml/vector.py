@@ -13,3 +13,85 @@ def min_max_norm(lst):
     max_val = np.max(lst)
     norm_lst = (lst - min_val) / (max_val - min_val)
     return norm_lst
+
+
+def normalize_rows(vectors, dtype=np.float32):
+    """
+    Scale every row of a 2-D array to unit L2 norm. Zero rows are left as zeros.
+    """
+    vectors = np.asarray(vectors, dtype=dtype)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _iter_blocks(size, block_size):
+    for start in range(0, size, block_size):
+        yield start, min(start + block_size, size)
+
+
+def cosine_similarity_matrix(vectors, other=None, block_size=1024, dtype=np.float32):
+    """
+    Compute all-pairs cosine similarity between the rows of `vectors` and `other`.
+
+    Rows are normalized once and the result is filled block by block with matrix
+    multiplies, so the temporary memory is bounded by `block_size` rows.
+
+    Args:
+        vectors (array-like): An (n, d) array of embeddings.
+        other (array-like, optional): An (m, d) array. Defaults to `vectors`.
+        block_size (int, optional): Rows per block. Defaults to 1024.
+        dtype (optional): Computation and output dtype. Defaults to np.float32.
+
+    Returns:
+        np.ndarray: An (n, m) similarity matrix.
+    """
+    left = normalize_rows(vectors, dtype=dtype)
+    right = left if other is None else normalize_rows(other, dtype=dtype)
+
+    result = np.empty((left.shape[0], right.shape[0]), dtype=dtype)
+    for start, end in _iter_blocks(left.shape[0], block_size):
+        np.matmul(left[start:end], right.T, out=result[start:end])
+
+    return result
+
+
+def top_k_similarity(vectors, k, block_size=1024, dtype=np.float32):
+    """
+    Find the `k` most similar rows (by cosine similarity) for every row of `vectors`
+    without materializing the full similarity matrix.
+
+    Args:
+        vectors (array-like): An (n, d) array of embeddings.
+        k (int): The number of neighbors to keep per row, self included.
+        block_size (int, optional): Rows per block. Defaults to 1024.
+        dtype (optional): Computation dtype. Defaults to np.float32.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, scores), both of shape (n, k), sorted by
+        descending score within each row.
+    """
+    normed = normalize_rows(vectors, dtype=dtype)
+    size = normed.shape[0]
+    k = min(k, size)
+
+    indices = np.empty((size, k), dtype=np.int64)
+    scores = np.empty((size, k), dtype=dtype)
+
+    for start, end in _iter_blocks(size, block_size):
+        block = normed[start:end] @ normed.T
+
+        if k < size:
+            top = np.argpartition(block, size - k, axis=1)[:, size - k :]
+        else:
+            top = np.broadcast_to(np.arange(size), block.shape)
+        top_scores = np.take_along_axis(block, top, axis=1)
+
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        indices[start:end] = np.take_along_axis(top, order, axis=1)
+        scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+    return indices, scores
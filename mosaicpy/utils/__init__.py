@@ -1,4 +1,4 @@
-from . import file, time
+from . import file, jsonl_index, stats, time
 
 
-__all__ = ["file", "time"]
+__all__ = ["file", "jsonl_index", "stats", "time"]
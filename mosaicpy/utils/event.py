@@ -7,6 +7,11 @@ class SimpleEventManager:
 
     def subscribe(self, event_name, listener):
         self.listeners[event_name].append(listener)
+        return listener
+
+    def unsubscribe(self, event_name, listener):
+        if listener in self.listeners[event_name]:
+            self.listeners[event_name].remove(listener)
 
     def publish(self, event_name, **kwargs):
         for listener in self.listeners[event_name]:
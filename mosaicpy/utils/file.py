@@ -1,29 +1,335 @@
 import json
 import gzip
+import os
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def load_jsonl(file_path, cb_func=None, skip_none=False):
-    open_func = gzip.open if file_path.endswith(".gz") else open
-    with open_func(file_path, "rt") as f:
-        data = []
+
+CODECS = {".gz": "gzip", ".zst": "zstd", ".lz4": "lz4"}
+
+
+def _get_loads(use_orjson=True):
+    if not use_orjson or orjson is None:
+        return json.loads
+
+    def loads(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which json.dumps writes by default
+            return json.loads(line)
+
+    return loads
+
+
+def _get_dumps(use_orjson=False):
+    if not use_orjson or orjson is None:
+        return lambda record: json.dumps(record).encode("utf-8")
+
+    def dumps(record):
+        try:
+            return orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return json.dumps(record).encode("utf-8")
+
+    return dumps
+
+
+def _infer_codec(file_path):
+    return CODECS.get(os.path.splitext(file_path)[1])
+
+
+def _get_compress(codec, level=None):
+    if codec == "gzip":
+        level = 6 if level is None else level
+        return lambda data: gzip.compress(data, compresslevel=level)
+    elif codec == "zstd":
+        import threading
+        import zstandard
+
+        # ZstdCompressor objects must not be shared between threads
+        local = threading.local()
+
+        def compress(data):
+            if not hasattr(local, "compressor"):
+                local.compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+            return local.compressor.compress(data)
+
+        return compress
+    elif codec == "lz4":
+        import lz4.frame
+
+        return lambda data: lz4.frame.compress(data, compression_level=level or 0)
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+
+
+def _open_binary(file_path):
+    codec = _infer_codec(file_path)
+    if codec == "gzip":
+        return gzip.open(file_path, "rb")
+    elif codec == "zstd":
+        import io
+        import zstandard
+
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(file_path, "rb"), read_across_frames=True
+        )
+        return io.BufferedReader(reader)
+    elif codec == "lz4":
+        import lz4.frame
+
+        return lz4.frame.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def _split_ranges(file_path, chunk_bytes):
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _decode_range(file_path, start, end, use_orjson=True):
+    loads = _get_loads(use_orjson)
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [loads(line) for line in data.split(b"\n") if line.strip()]
+
+
+def _iter_parallel(file_path, workers, chunk_bytes, use_orjson):
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges = iter(_split_ranges(file_path, chunk_bytes))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit_next():
+            byte_range = next(ranges, None)
+            if byte_range is not None:
+                pending.append(executor.submit(_decode_range, file_path, *byte_range, use_orjson))
+
+        pending = deque()
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            records = pending.popleft().result()
+            submit_next()
+            yield from records
+
+
+def _iter_serial(file_path, use_orjson):
+    loads = _get_loads(use_orjson)
+    with _open_binary(file_path) as f:
         for line in f:
-            line = json.loads(line)
+            if line.strip():
+                yield loads(line)
+
+
+def iter_jsonl(
+    file_path,
+    cb_func=None,
+    skip_none=False,
+    batch_size=None,
+    workers=1,
+    chunk_bytes=16 * 1024 * 1024,
+    use_orjson=True,
+):
+    """
+    Lazily read a JSONL file, yielding one record at a time.
+
+    Args:
+        file_path (str): The file to read. Files ending in ".gz", ".zst" or ".lz4" are
+            decompressed.
+        cb_func (callable, optional): Applied to every decoded record.
+        skip_none (bool, optional): Drop records that are (or that cb_func maps to) None.
+        batch_size (int, optional): If given, yield lists of up to `batch_size` records.
+        workers (int, optional): Decode uncompressed files in this many processes, one
+            byte range of about `chunk_bytes` at a time. Records keep the file order.
+        chunk_bytes (int, optional): The size of each byte range. Defaults to 16MB.
+        use_orjson (bool, optional): Decode with orjson when it is installed.
+    """
+    if workers > 1 and _infer_codec(file_path) is None:
+        records = _iter_parallel(file_path, workers, chunk_bytes, use_orjson)
+    else:
+        records = _iter_serial(file_path, use_orjson)
+
+    batch = []
+    for line in records:
+        if cb_func is not None:
+            line = cb_func(line)
+
+        if skip_none and line is None:
+            continue
+
+        if batch_size is None:
+            yield line
+            continue
+
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def load_jsonl(file_path, cb_func=None, skip_none=False, workers=1):
+    return list(iter_jsonl(file_path, cb_func=cb_func, skip_none=skip_none, workers=workers))
+
+
+class JsonlWriter:
+    """
+    A buffered JSONL writer. Records are serialized in batches and written one buffer
+    at a time; with a codec, every buffer becomes an independent compressed block
+    (gzip member, zstd or lz4 frame), which lets blocks be compressed in parallel.
+
+    Args:
+        file_path (str): The file to write.
+        mode (str, optional): "w" to truncate or "a" to append. Defaults to "w".
+        codec (str, optional): "gzip", "zstd", "lz4", None for plain text, or "auto"
+            to infer from the extension (".gz", ".zst", ".lz4"). Defaults to "auto".
+        level (int, optional): The compression level. Defaults to the codec default.
+        buffer_size (int, optional): Bytes to buffer before writing. Defaults to 4MB.
+        workers (int, optional): Threads used to compress blocks. Defaults to 1.
+        atomic (bool, optional): Write to a temporary file and rename it over
+            `file_path` on close, so readers never see a partial file. Defaults to False.
+        use_orjson (bool, optional): Serialize with orjson when it is installed. Faster,
+            but writes NaN and Infinity as null and leaves non-ASCII text unescaped, so
+            the output differs from json.dumps. Defaults to False.
+
+    Example usage:
+    >>> with JsonlWriter("out.jsonl.gz", level=1, workers=4) as writer:
+    ...     writer.write_many(records)
+    """
+
+    def __init__(
+        self,
+        file_path,
+        mode="w",
+        codec="auto",
+        level=None,
+        buffer_size=4 * 1024 * 1024,
+        workers=1,
+        atomic=False,
+        use_orjson=False,
+    ):
+        if mode not in ("w", "a"):
+            raise ValueError(f"Invalid mode: {mode}")
+        if atomic and mode == "a":
+            raise ValueError("Atomic writes are not supported in append mode")
+
+        self.file_path = file_path
+        self.codec = _infer_codec(file_path) if codec == "auto" else codec
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.atomic = atomic
+
+        self._dumps = _get_dumps(use_orjson)
+        self._compress = _get_compress(self.codec, level) if self.codec else None
+        self._target = f"{file_path}.tmp.{os.getpid()}" if atomic else file_path
+        self._file = open(self._target, mode + "b")
+        self._buffer = []
+        self._buffered = 0
+        self._blocks = 0
+        self._pending = None
+        self._executor = None
+        self.closed = False
+
+        if self._compress is not None and workers > 1:
+            from collections import deque
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._pending = deque()
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def write(self, record):
+        line = self._dumps(record) + b"\n"
+        self._buffer.append(line)
+        self._buffered += len(line)
+        if self._buffered >= self.buffer_size:
+            self._flush_block()
+
+    def write_many(self, records):
+        dumps = self._dumps
+        buffer = self._buffer
+        for record in records:
+            line = dumps(record) + b"\n"
+            buffer.append(line)
+            self._buffered += len(line)
+            if self._buffered >= self.buffer_size:
+                self._flush_block()
+                buffer = self._buffer
+
+    def _flush_block(self):
+        if not self._buffer:
+            return
+
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._blocks += 1
+
+        if self._compress is None:
+            self._file.write(block)
+        elif self._executor is None:
+            self._file.write(self._compress(block))
+        else:
+            self._pending.append(self._executor.submit(self._compress, block))
+            while len(self._pending) > self.workers * 2:
+                self._file.write(self._pending.popleft().result())
+
+    def flush(self):
+        self._flush_block()
+        while self._pending:
+            self._file.write(self._pending.popleft().result())
+        self._file.flush()
+
+    def close(self, discard=False):
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            if not discard:
+                if self._blocks == 0 and self._compress is not None:
+                    self._file.write(self._compress(b"".join(self._buffer)))
+                    self._buffer = []
+                self.flush()
+        finally:
+            self._file.close()
+            if self._executor is not None:
+                self._executor.shutdown()
 
-            if cb_func is not None:
-                line = cb_func(line)
+        if self.atomic:
+            if discard:
+                os.remove(self._target)
+            else:
+                os.replace(self._target, self.file_path)
 
-            if skip_none and line is None:
-                continue
+    def __enter__(self):
+        return self
 
-            data.append(line)
-        return data
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None and self.atomic)
 
 
-def dump_jsonl(data, file_path):
-    open_func = gzip.open if file_path.endswith(".gz") else open
-    with open_func(file_path, "wt") as f:
-        for line in data:
-            f.write(json.dumps(line) + "\n")
+def dump_jsonl(data, file_path, **kwargs):
+    with JsonlWriter(file_path, **kwargs) as writer:
+        writer.write_many(data)
 
 
 def load_pickle(file_path, default=None):
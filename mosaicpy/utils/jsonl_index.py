@@ -0,0 +1,265 @@
+import os
+import random
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
+
+import numpy as np
+
+from mosaicpy.utils.file import _get_loads, _infer_codec, iter_jsonl
+
+MAGIC = b"MPYIDX01"
+KIND_PLAIN = 0
+KIND_GZIP = 1
+
+_HEADER_FIELDS = 5
+_HEADER_SIZE = len(MAGIC) + 8 * _HEADER_FIELDS
+_READ_SIZE = 64 * 1024 * 1024
+
+
+def _line_starts(data, base=0, after_newline=True):
+    """
+    Start offsets (shifted by `base`) of the non-blank lines beginning in `data`, and
+    whether `data` ends with a newline. Blank lines are folded into the record before
+    them, so they never count as records.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer) == 0:
+        return np.empty(0, dtype=np.uint64), after_newline
+
+    is_newline = buffer == 10
+    begins = np.empty(len(buffer), dtype=bool)
+    begins[0] = after_newline
+    begins[1:] = is_newline[:-1]
+
+    starts = np.flatnonzero(begins & ~is_newline).astype(np.uint64) + np.uint64(base)
+    return starts, bool(is_newline[-1])
+
+
+def _scan_plain(file_path):
+    parts = []
+    base = 0
+    after_newline = True
+    with open(file_path, "rb") as f:
+        while chunk := f.read(_READ_SIZE):
+            starts, after_newline = _line_starts(chunk, base, after_newline)
+            parts.append(starts)
+            base += len(chunk)
+
+    return np.concatenate(parts + [np.array([base], dtype=np.uint64)])
+
+
+def _scan_gzip(file_path):
+    blocks = [0]
+    block_sizes = []
+    line_blocks = []
+    line_starts = []
+
+    with open(file_path, "rb") as f:
+        position = 0
+        member_size = 0
+        after_newline = True
+        decompressor = zlib.decompressobj(wbits=31)
+        pending = b""
+
+        while chunk := pending or f.read(_READ_SIZE):
+            pending = b""
+            position += len(chunk)
+
+            data = decompressor.decompress(chunk)
+            starts, after_newline = _line_starts(data, member_size, after_newline)
+            line_starts.append(starts)
+            line_blocks.append(np.full(len(starts), len(block_sizes), dtype=np.uint32))
+            member_size += len(data)
+
+            if decompressor.eof:
+                pending = decompressor.unused_data
+                position -= len(pending)
+                blocks.append(position)
+                block_sizes.append(member_size)
+
+                member_size = 0
+                after_newline = True
+                decompressor = zlib.decompressobj(wbits=31)
+
+        if member_size:
+            raise ValueError(f"Truncated gzip file: {file_path}")
+
+    return (
+        np.array(blocks, dtype=np.uint64),
+        np.array(block_sizes, dtype=np.uint64),
+        np.concatenate(line_blocks) if line_blocks else np.empty(0, dtype=np.uint32),
+        np.concatenate(line_starts) if line_starts else np.empty(0, dtype=np.uint64),
+    )
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_index(file_path, index_path=None):
+    """
+    Scan a JSONL file once and write its sidecar line-offset index.
+
+    Plain files store one uint64 offset per line. Gzip files store the compressed offset
+    of every gzip member plus (member, offset) per line, so a lookup only decompresses
+    one member. Files written by JsonlWriter have one member per buffer; a
+    single-member .gz still works, but every lookup decompresses from the start.
+    """
+    index_path = index_path or file_path + ".idx"
+    size, mtime_ns = _file_signature(file_path)
+
+    codec = _infer_codec(file_path)
+    if codec is None:
+        arrays = [_scan_plain(file_path)]
+        kind, num_lines, num_blocks = KIND_PLAIN, len(arrays[0]) - 1, 0
+    elif codec == "gzip":
+        blocks, block_sizes, line_blocks, line_starts = _scan_gzip(file_path)
+        padding = np.zeros(len(line_blocks) % 2, dtype=np.uint32)
+        arrays = [blocks, block_sizes, line_blocks, padding, line_starts]
+        kind, num_lines, num_blocks = KIND_GZIP, len(line_starts), len(block_sizes)
+    else:
+        raise ValueError(f"Random access is not supported for {codec} files")
+
+    header = np.array([kind, num_lines, num_blocks, size, mtime_ns], dtype=np.uint64)
+    tmp_path = f"{index_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(header.tobytes())
+        for array in arrays:
+            f.write(array.tobytes())
+    os.replace(tmp_path, index_path)
+
+    return index_path
+
+
+class JsonlIndex(Sequence):
+    """
+    Random access to the records of a JSONL file through a memory-mapped sidecar
+    index (`<file>.idx`), built on first use and rebuilt when the file changes.
+
+    Example usage:
+    >>> index = JsonlIndex("logs.jsonl")
+    >>> index[123456], index[-10:]
+    >>> mpy.sample(index, 100)  # only reads 100 lines
+    """
+
+    def __init__(self, file_path, index_path=None, rebuild=False, use_orjson=True, cache_blocks=4):
+        self.file_path = file_path
+        self.index_path = index_path or file_path + ".idx"
+        self.use_orjson = use_orjson
+        self._loads = _get_loads(use_orjson)
+        self._cache_blocks = cache_blocks
+        self._block_cache = OrderedDict()
+
+        if rebuild or not self._load():
+            build_index(file_path, self.index_path)
+            if not self._load():
+                raise ValueError(f"Invalid index file: {self.index_path}")
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return False
+
+        with open(self.index_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return False
+            header = np.frombuffer(f.read(8 * _HEADER_FIELDS), dtype=np.uint64)
+
+        kind, num_lines, num_blocks, size, mtime_ns = (int(x) for x in header)
+        if (size, mtime_ns) != _file_signature(self.file_path):
+            return False
+
+        self.kind = kind
+        self._size = num_lines
+        mmap = np.memmap(self.index_path, dtype=np.uint8, mode="r", offset=_HEADER_SIZE)
+
+        def take(dtype, count):
+            nonlocal mmap
+            nbytes = np.dtype(dtype).itemsize * count
+            array = mmap[:nbytes].view(dtype)
+            mmap = mmap[nbytes:]
+            return array
+
+        if kind == KIND_PLAIN:
+            self._offsets = take(np.uint64, num_lines + 1)
+        else:
+            self._blocks = take(np.uint64, num_blocks + 1)
+            self._block_sizes = take(np.uint64, num_blocks)
+            self._line_blocks = take(np.uint32, num_lines + num_lines % 2)[:num_lines]
+            self._line_starts = take(np.uint64, num_lines)
+        return True
+
+    def __len__(self):
+        return self._size
+
+    def _read_block(self, block):
+        data = self._block_cache.get(block)
+        if data is not None:
+            self._block_cache.move_to_end(block)
+            return data
+
+        start, end = int(self._blocks[block]), int(self._blocks[block + 1])
+        with open(self.file_path, "rb") as f:
+            f.seek(start)
+            data = zlib.decompress(f.read(end - start), wbits=31)
+
+        self._block_cache[block] = data
+        if len(self._block_cache) > self._cache_blocks:
+            self._block_cache.popitem(last=False)
+        return data
+
+    def get_raw(self, i):
+        """Return the raw bytes of record `i`."""
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("JsonlIndex index out of range")
+
+        if self.kind == KIND_PLAIN:
+            start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+            with open(self.file_path, "rb") as f:
+                f.seek(start)
+                return f.read(end - start)
+
+        block = int(self._line_blocks[i])
+        start = int(self._line_starts[i])
+        if i + 1 < self._size and int(self._line_blocks[i + 1]) == block:
+            end = int(self._line_starts[i + 1])
+        else:
+            end = int(self._block_sizes[block])
+        return self._read_block(block)[start:end]
+
+    def get(self, i):
+        return self._loads(self.get_raw(i))
+
+    def _get_range(self, start, stop):
+        if self.kind != KIND_PLAIN:
+            return [self.get(i) for i in range(start, stop)]
+
+        begin, end = int(self._offsets[start]), int(self._offsets[stop])
+        with open(self.file_path, "rb") as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return [self._loads(line) for line in data.split(b"\n") if line.strip()]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._size)
+            if step == 1:
+                return self._get_range(start, stop) if start < stop else []
+            return [self.get(i) for i in range(start, stop, step)]
+        return self.get(key)
+
+    def __iter__(self):
+        return iter_jsonl(self.file_path, use_orjson=self.use_orjson)
+
+    def sample(self, n, seed=None):
+        """
+        Return `n` random records, read in file order but returned in random order.
+        """
+        rng = random.Random(seed)
+        indices = rng.sample(range(self._size), min(n, self._size))
+        records = {i: self.get(i) for i in sorted(indices)}
+        return [records[i] for i in indices]
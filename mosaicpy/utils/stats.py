@@ -0,0 +1,96 @@
+import math
+import random
+import threading
+from typing import Iterable, Optional
+
+
+class Histogram:
+    """
+    A thread-safe distribution of observed values. Count, sum, min and max are exact;
+    quantiles are computed from a uniform reservoir sample of at most `max_samples`
+    values, so memory stays bounded however many values are observed.
+
+    Args:
+        max_samples (int, optional): The size of the reservoir.
+        seed (int, optional): The seed of the reservoir sampling.
+    """
+
+    def __init__(self, max_samples: int = 4096, seed: Optional[int] = None):
+        self.max_samples = max_samples
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+        self._samples = []
+        self._sorted = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+            if len(self._samples) < self.max_samples:
+                self._samples.append(value)
+            else:
+                i = self._random.randrange(self.count)
+                if i >= self.max_samples:
+                    return
+                self._samples[i] = value
+            self._sorted = None
+
+    def update(self, values: Iterable[float]):
+        for value in values:
+            self.observe(value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        The `q`-quantile (0 <= q <= 1) of the observed values, linearly interpolated.
+        """
+        with self._lock:
+            if not self._samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            values = self._sorted
+
+        pos = q * (len(values) - 1)
+        lo = math.floor(pos)
+        hi = min(lo + 1, len(values) - 1)
+        return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+    def percentiles(self, *qs: float) -> dict:
+        qs = qs or (50, 95, 99)
+        return {f"p{q:g}": self.quantile(q / 100) for q in qs}
+
+    def summary(self) -> dict:
+        return dict(
+            count=self.count,
+            mean=self.mean,
+            min=self.min if self.count else None,
+            max=self.max if self.count else None,
+            **self.percentiles(),
+        )
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+            self._samples = []
+            self._sorted = None
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"Histogram({self.summary()})"
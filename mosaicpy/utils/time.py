@@ -1,8 +1,38 @@
-import time
+import functools
 from datetime import datetime, timedelta
 
+import numpy as np
 import pytz
 
+# UTC offsets only change on quarter-hour boundaries and rarely more than once a day, so
+# batch conversions look up offsets per day, and per 15-minute bucket on days they change
+_DAY = 86400
+_OFFSET_BUCKET = 900
+
+# formats rendered with NumPy arithmetic, by their date/time separator (None: date only)
+_NUMPY_FORMATS = {
+    "%Y-%m-%d %H:%M:%S": " ",
+    "%Y-%m-%dT%H:%M:%S": "T",
+    "%Y-%m-%d": None,
+}
+# the epochs of 1000-01-01 and 10000-01-01; strftime does not pad years to four digits
+_MIN_EPOCH = -30610224000
+_MAX_EPOCH = 253402300800
+
+
+@functools.lru_cache(maxsize=None)
+def _get_timezone(name):
+    return pytz.timezone(name)
+
+
+def _get_target_timezone(timezone):
+    if not timezone:
+        return pytz.utc
+    try:
+        return _get_timezone(timezone)
+    except Exception as e:
+        raise ValueError(f"Invalid timezone: {e}")
+
 
 def from_unixtime(epoch, format="%Y-%m-%d %H:%M:%S", timezone=None) -> str:
     """
@@ -31,24 +61,115 @@ def from_unixtime(epoch, format="%Y-%m-%d %H:%M:%S", timezone=None) -> str:
     >>> from_unixtime(1609459200, timezone="America/New_York")
     '2020-12-31 19:00:00'
     """
-    local_time = time.localtime(epoch)
+    return datetime.fromtimestamp(epoch, tz=_get_target_timezone(timezone)).strftime(format)
 
-    readable_time = time.strftime(format, local_time)
 
-    utc_dt = datetime.utcfromtimestamp(epoch).replace(tzinfo=pytz.utc)
+def _offsets_many(seconds, offset_at):
+    """
+    The UTC offsets of `seconds` (an int64 array), given `offset_at(seconds)` for one
+    value. Looks up the start and end of each distinct day, and each 15-minute bucket
+    only on days whose offset changes.
+    """
+    days, day_index = np.unique(seconds // _DAY, return_inverse=True)
+    day_index = day_index.ravel()
+    start = np.array([offset_at(int(day) * _DAY) for day in days], dtype=np.int64)
+    end = np.array(
+        [offset_at(int(day) * _DAY + _DAY - _OFFSET_BUCKET) for day in days], dtype=np.int64
+    )
+
+    offsets = start[day_index]
+    changing = np.isin(day_index, np.flatnonzero(start != end))
+    if changing.any():
+        buckets, inverse = np.unique(seconds[changing] // _OFFSET_BUCKET, return_inverse=True)
+        offsets[changing] = np.array(
+            [offset_at(int(bucket) * _OFFSET_BUCKET) for bucket in buckets], dtype=np.int64
+        )[inverse.ravel()]
+    return offsets
+
+
+def _render_many(seconds, separator):
+    """
+    Render epochs as "YYYY-MM-DD" plus `separator` and "HH:MM:SS", if given, by writing
+    the digits straight into a character array.
+    """
+    days, seconds = np.divmod(seconds, _DAY)
+
+    # the proleptic Gregorian date of a day number, after Howard Hinnant's civil_from_days
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+
+    fields = [(year, 4, "-"), (month, 2, "-"), (day, 2, separator)]
+    if separator is not None:
+        hour, seconds = np.divmod(seconds, 3600)
+        minute, second = np.divmod(seconds, 60)
+        fields += [(hour, 2, ":"), (minute, 2, ":"), (second, 2, None)]
+
+    width = sum(digits + (sep is not None) for _, digits, sep in fields)
+    chars = np.empty((len(days), width), dtype=np.uint32)
+    pos = 0
+    for value, digits, sep in fields:
+        for i in range(digits - 1, -1, -1):
+            value, digit = np.divmod(value, 10)
+            chars[:, pos + i] = digit + ord("0")
+        pos += digits
+        if sep is not None:
+            chars[:, pos] = ord(sep)
+            pos += 1
+
+    return chars.view(f"U{width}").reshape(len(days))
+
+
+def _strftime_many(epochs, format, tz):
+    return np.array(
+        [datetime.fromtimestamp(epoch, tz=tz).strftime(format) for epoch in epochs.tolist()],
+        dtype=str,
+    )
+
+
+def from_unixtime_many(epochs, format="%Y-%m-%d %H:%M:%S", timezone=None) -> np.ndarray:
+    """
+    Batch version of `from_unixtime` for a list or NumPy array of epochs.
 
-    if timezone:
-        try:
-            target_tz = pytz.timezone(timezone)
-            localized_dt = utc_dt.astimezone(target_tz)
-        except Exception as e:
-            raise ValueError(f"Invalid timezone: {e}")
-    else:
-        localized_dt = utc_dt
+    The common formats ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S" and "%Y-%m-%d") are
+    rendered by NumPy without creating a datetime per element. Other formats fall back to
+    `strftime` per element.
+
+    Args:
+    - epochs (list | np.ndarray): Unix epoch times in seconds.
+    - format (str, optional): The output format. Defaults to "%Y-%m-%d %H:%M:%S".
+    - timezone (str, optional): The target timezone. If not specified, UTC is used.
+
+    Returns:
+    - np.ndarray: The formatted strings, in the shape of `epochs`.
+
+    Example:
+    >>> from_unixtime_many([1609459200, 1609462800], timezone="Asia/Tokyo")
+    array(['2021-01-01 09:00:00', '2021-01-01 10:00:00'], dtype='<U19')
+    """
+    tz = _get_target_timezone(timezone)
+    epochs = np.asarray(epochs)
+    flat = epochs.ravel()
+
+    if format not in _NUMPY_FORMATS:
+        return _strftime_many(flat, format, tz).reshape(epochs.shape)
 
-    readable_time = localized_dt.strftime(format)
+    seconds = np.floor(flat).astype(np.int64) if flat.dtype.kind == "f" else flat.astype(np.int64)
+    if tz is not pytz.utc and len(seconds):
+        seconds = seconds + _offsets_many(
+            seconds,
+            lambda utc: datetime.fromtimestamp(utc, tz=tz).utcoffset() // timedelta(seconds=1),
+        )
 
-    return readable_time
+    if len(seconds) and (seconds.min() < _MIN_EPOCH or seconds.max() >= _MAX_EPOCH):
+        return _strftime_many(flat, format, tz).reshape(epochs.shape)
+    return _render_many(seconds, _NUMPY_FORMATS[format]).reshape(epochs.shape)
 
 
 def from_unixtime_jp(epoch, format="%Y-%m-%d %H:%M:%S") -> str:
@@ -84,26 +205,129 @@ def to_unixtime(dt: str, format: str = None, timezone: str = "UTC") -> int:
     1669630200
     """
     if format is None:
-        match len(dt):
-            case 10:
-                format = "%Y-%m-%d"
-            case 19:
-                format = "%Y-%m-%d %H:%M:%S"
-            case 23:
-                format = "%Y-%m-%d %H:%M:%S.%f"
-            case 24:
-                format = "%Y-%m-%dT%H:%M:%S%z"
-                timezone = None
-            case _:
-                raise ValueError("Unknown datetime format")
-
-    dt = datetime.strptime(dt, format)
+        format, has_offset = _infer_format(len(dt))
+        if has_offset:
+            timezone = None
+            dt = datetime.strptime(dt, format)
+        else:
+            dt = datetime.fromisoformat(dt)
+    else:
+        dt = datetime.strptime(dt, format)
+
     if timezone is not None:
-        dt = pytz.timezone(timezone).localize(dt)
+        dt = _get_timezone(timezone).localize(dt)
     epoch = int(dt.timestamp())
     return epoch
 
 
+def _infer_format(length):
+    """
+    The format of a datetime string of `length` characters, and whether it carries its
+    own UTC offset.
+    """
+    match length:
+        case 10:
+            return "%Y-%m-%d", False
+        case 19:
+            return "%Y-%m-%d %H:%M:%S", False
+        case 23:
+            return "%Y-%m-%d %H:%M:%S.%f", False
+        case 24:
+            return "%Y-%m-%dT%H:%M:%S%z", True
+        case _:
+            raise ValueError("Unknown datetime format")
+
+
+def _local_offset(tz, local_seconds):
+    """
+    The UTC offset in seconds of the wall-clock time `local_seconds` in `tz`, or in the
+    system timezone if `tz` is None.
+    """
+    dt = datetime(1970, 1, 1) + timedelta(seconds=local_seconds)
+    dt = tz.localize(dt) if tz is not None else dt.astimezone()
+    return dt.utcoffset() // timedelta(seconds=1)
+
+
+def _localize_many(naive_us, timezone):
+    """
+    Convert wall-clock times (microseconds since the epoch, as if in UTC) in `timezone`
+    to UTC.
+    """
+    tz = _get_timezone(timezone) if timezone is not None else None
+    if tz is pytz.utc or not len(naive_us):
+        return naive_us
+
+    offsets = _offsets_many(naive_us // 10**6, lambda local: _local_offset(tz, local))
+    return naive_us - offsets * 10**6
+
+
+def _parse_with_offset_many(values):
+    """
+    Parse "YYYY-MM-DDTHH:MM:SS+HHMM" strings to microseconds since the epoch.
+    """
+    naive = values.astype("U19").astype("datetime64[us]").astype(np.int64)
+
+    chars = np.ascontiguousarray(values.astype("U24")).view("U1").reshape(-1, 24)
+    if not np.isin(chars[:, 19], ["+", "-"]).all():
+        raise ValueError("Unknown datetime format")
+    digits = chars[:, 20:].astype(np.int64)
+    minutes = (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 2] * 10 + digits[:, 3]
+    sign = np.where(chars[:, 19] == "-", -1, 1)
+    return naive - sign * minutes * 60 * 10**6
+
+
+def to_unixtime_many(dts, format: str = None, timezone: str = "UTC") -> np.ndarray:
+    """
+    Batch version of `to_unixtime` for a list or NumPy array of datetime strings.
+
+    Without `format`, the format is inferred once per distinct string length, and each
+    group is parsed by NumPy in one pass, with one timezone offset lookup per 15-minute
+    bucket of wall-clock time. With `format`, each string is parsed by `strptime`.
+
+    Args:
+    - dts (list | np.ndarray): The datetime strings to be converted.
+    - format (str, optional): The format of the datetime strings. If None, it is inferred.
+    - timezone (str, optional): The timezone of the datetime strings. Ignored for strings
+        with a UTC offset. If None, the system timezone is used. Defaults to 'UTC'.
+
+    Returns:
+    - np.ndarray: The Unix timestamps (int64), in the shape of `dts`.
+
+    Raises:
+    - ValueError: If a datetime string format is unknown or cannot be parsed.
+
+    Example:
+    >>> to_unixtime_many(["2023-11-28", "2023-11-28T12:30:00+0000"])
+    array([1701129600, 1701174600])
+    """
+    dts = np.asarray(dts, dtype=str)
+    flat = dts.ravel()
+
+    if format is not None:
+        tz = _get_timezone(timezone) if timezone is not None else None
+        epochs = np.empty(len(flat), dtype=np.int64)
+        for i, dt in enumerate(flat.tolist()):
+            dt = datetime.strptime(dt, format)
+            epochs[i] = int((tz.localize(dt) if tz is not None else dt).timestamp())
+        return epochs.reshape(dts.shape)
+
+    utc_us = np.empty(len(flat), dtype=np.int64)
+    lengths = np.char.str_len(flat)
+    for length in np.unique(lengths):
+        _, has_offset = _infer_format(int(length))
+        index = np.flatnonzero(lengths == length)
+        if has_offset:
+            utc_us[index] = _parse_with_offset_many(flat[index])
+        else:
+            naive_us = flat[index].astype("datetime64[us]").astype(np.int64)
+            utc_us[index] = _localize_many(naive_us, timezone)
+
+    # truncate towards zero like int(datetime.timestamp())
+    epochs = utc_us // 10**6
+    epochs += (utc_us < 0) & (utc_us % 10**6 != 0)
+    return epochs.reshape(dts.shape)
+
+
 def to_unixtime_jp(dt: str, format: str = None) -> int:
     return to_unixtime(dt, format, "Asia/Tokyo")
 
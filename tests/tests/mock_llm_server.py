@@ -0,0 +1,295 @@
+"""
+A local stand-in for the OpenAI chat completions and Anthropic messages APIs.
+
+The assistant replies "echo: <last user text>". If the last user text contains
+"calc" and tools are offered, it calls the first tool with {"expr": "1+2"} instead,
+once per occurrence of "calc", and after tool results it replies "tools: <tool
+results>". With "again" in the text it asks for a second round of tool calls.
+
+Prompt caching is emulated on the system prompt: a system prompt seen before reports
+8 cached prompt tokens (for Anthropic, only when it carries cache_control).
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mosaicpy.llm.anthropic.agent import AnthropicAgent
+from mosaicpy.llm.openai.agent import OpenAIAgent
+
+
+def _last_user_text(messages):
+    for message in reversed(messages):
+        if message["role"] != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            return content
+        texts = [block.get("text", "") for block in content if block.get("type") == "text"]
+        if texts:
+            return texts[-1]
+    return ""
+
+
+def _cached_tokens(server, system):
+    key = json.dumps(system, sort_keys=True)
+    with server.lock:
+        seen = key in server.prefixes
+        server.prefixes.add(key)
+    return 8 if seen else 0
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = event.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(
+            {"path": self.path, "headers": dict(self.headers), "body": body}
+        )
+
+        if self.server.fail_next > 0:
+            self.server.fail_next -= 1
+            if self.server.fail_status == 429:
+                error = {"type": "rate_limit_error", "message": "slow down"}
+            else:
+                error = {"type": "api_error", "message": "server error"}
+            self._send_json(
+                self.server.fail_status,
+                {"error": error},
+                {"retry-after": self.server.retry_after},
+            )
+            return
+
+        time.sleep(self.server.latency)
+        if self.path.endswith("/chat/completions"):
+            self._handle_openai(body)
+        elif self.path.endswith("/messages"):
+            self._handle_anthropic(body)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _handle_openai(self, body):
+        messages = body["messages"]
+        text = _last_user_text(messages)
+        tool_results = [m["content"] for m in messages if m.get("role") == "tool"]
+        tool_rounds = sum(1 for m in messages if m.get("tool_calls"))
+        tool_calls = None
+
+        if "calc" in text and body.get("tools") and tool_rounds < (2 if "again" in text else 1):
+            name = body["tools"][0]["function"]["name"]
+            tool_calls = [
+                {
+                    "id": f"call_{tool_rounds}_{i}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps({"expr": "1+2"})},
+                }
+                for i in range(text.count("calc"))
+            ]
+            content = None
+        elif tool_results:
+            content = "tools: " + ", ".join(tool_results)
+        else:
+            content = "echo: " + text
+
+        usage = {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}
+        usage["prompt_tokens_details"] = {"cached_tokens": _cached_tokens(self.server, messages[0])}
+        created = int(time.time())
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "finish_reason": "tool_calls" if tool_calls else "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        def chunk(delta, finish_reason=None):
+            data = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        events = [chunk({"role": "assistant", "content": ""})]
+        if tool_calls:
+            for index, tool_call in enumerate(tool_calls):
+                arguments = tool_call["function"]["arguments"]
+                first = dict(
+                    tool_call, index=index, function={"name": tool_call["function"]["name"]}
+                )
+                events.append(chunk({"tool_calls": [first]}))
+                for i in range(0, len(arguments), 4):
+                    fragment = {"index": index, "function": {"arguments": arguments[i : i + 4]}}
+                    events.append(chunk({"tool_calls": [fragment]}))
+            events.append(chunk({}, "tool_calls"))
+        else:
+            for word in content.split(" "):
+                events.append(chunk({"content": word + " " if word else ""}))
+            events[-1] = chunk({"content": content.split(" ")[-1]})
+            events.append(chunk({}, "stop"))
+        events.append("data: [DONE]\n\n")
+        self._send_events(events)
+
+    def _handle_anthropic(self, body):
+        content = "echo: " + _last_user_text(body["messages"])
+        usage = {"input_tokens": 10, "output_tokens": 3}
+        system = body.get("system")
+        if isinstance(system, list) and system[-1].get("cache_control"):
+            cached = _cached_tokens(self.server, system)
+            usage["cache_read_input_tokens"] = cached
+            usage["cache_creation_input_tokens"] = 0 if cached else 8
+        message = {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [{"type": "text", "text": content}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+        if not body.get("stream"):
+            self._send_json(200, message)
+            return
+
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps(dict(data, type=name))}\n\n"
+
+        words = content.split(" ")
+        deltas = [word + " " for word in words[:-1]] + [words[-1]]
+        events = [
+            event(
+                "message_start",
+                {"message": dict(message, content=[], usage=dict(usage, output_tokens=0))},
+            ),
+            event(
+                "content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}
+            ),
+        ]
+        for delta in deltas:
+            events.append(
+                event(
+                    "content_block_delta",
+                    {"index": 0, "delta": {"type": "text_delta", "text": delta}},
+                )
+            )
+        events += [
+            event("content_block_stop", {"index": 0}),
+            event(
+                "message_delta",
+                {
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": 3},
+                },
+            ),
+            event("message_stop", {}),
+        ]
+        self._send_events(events)
+
+
+class MockLLMServer:
+    def __init__(self, latency=0.0, token_delay=0.0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockLLMHandler)
+        self.server.requests = []
+        self.server.latency = latency
+        self.server.token_delay = token_delay
+        self.server.fail_next = 0
+        self.server.fail_status = 429
+        self.server.retry_after = "0"
+        self.server.prefixes = set()
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def fail_next(self, count, status=429, retry_after="0"):
+        self.server.fail_next = count
+        self.server.fail_status = status
+        self.server.retry_after = retry_after
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def openai_agent(self, **kwargs):
+        return OpenAIAgent(api_key="test", base_url=self.base_url + "/v1", **kwargs)
+
+    def anthropic_agent(self, **kwargs):
+        return AnthropicAgent(api_key="test", base_url=self.base_url, **kwargs)
+
+    def agents(self, **kwargs):
+        return self.openai_agent(**kwargs), self.anthropic_agent(**kwargs)
+
+
+class MockServerMixin:
+    """
+    Serve each test from a fresh MockLLMServer, started with `server_kwargs`, as
+    `self.server`.
+    """
+
+    server_kwargs = {}
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_server(**self.server_kwargs)
+
+    def start_server(self, **kwargs):
+        server = MockLLMServer(**kwargs).__enter__()
+        self.addCleanup(server.__exit__)
+        return server
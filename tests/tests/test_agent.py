@@ -1,15 +1,37 @@
+import asyncio
+import os
+import tempfile
+import time
 import unittest
 
-from mosaicpy.llm import get_agent
+from mock_llm_server import MockLLMServer, MockServerMixin
+
+from mosaicpy.llm import Agent, ResponseCache, batch_chat, get_agent
+from mosaicpy.llm.batch import _estimate_tokens
+from mosaicpy.llm.router import CircuitBreaker, RouterAgent
+from mosaicpy.llm import router as router_module
+from mosaicpy.llm.cache import make_cache_key
+from mosaicpy.llm.metrics import MetricsRecorder, queued_since
+from mosaicpy.llm.retry import RetryPolicy
+from mosaicpy.llm.schema import (
+    ChatResponse,
+    SimpleMessage,
+    TextDelta,
+    ToolCallDelta,
+    UsageDelta,
+)
+from mosaicpy.llm import token
+from mosaicpy.llm.history import ConversationHistory, KeepLastN, Summarize
 from mosaicpy.llm.anthropic.agent import AnthropicAgent
 from mosaicpy.llm.openai.agent import OpenAIAgent
 
+from types import SimpleNamespace
 from typing import Optional, Type
 
-from pydantic import BaseModel, Field
-from mosaicpy.llm.openai.function import build_function_signature
+from pydantic import BaseModel, Field, ValidationError
+from mosaicpy.llm.openai.function import build_function_signature, compile_tool
 
-from mosaicpy.llm.openai.tools import Tool
+from mosaicpy.llm.openai.tools import CalculatorTool, Tool
 
 
 class TestAgentBasic(unittest.TestCase):
@@ -59,6 +81,9 @@ class TestOpenAIFunctions(unittest.TestCase):
         }
         self.assertDictEqual(signature, expected_signature)
 
+        signature = build_function_signature(CalculatorTool(), include_metadata=True)
+        self.assertEqual(signature["metadata"], {"pure": True, "timeout": None})
+
 
 class TestOpenAIAgent(unittest.TestCase):
     def test_basic(self):
@@ -74,5 +99,814 @@ class TestAnthropicAgent(unittest.TestCase):
         self.assertEqual(result, "3")
 
 
+class SlowCalculatorTool(CalculatorTool):
+    name: str = "SlowCalculator"
+    pure: bool = False
+    delay: float = 0.2
+    calls: int = 0
+
+    def _run(self, expr: str):
+        self.calls += 1
+        time.sleep(self.delay)
+        return super()._run(expr)
+
+
+class TestAsyncAgent(MockServerMixin, unittest.IsolatedAsyncioTestCase):
+    async def test_achat(self):
+        for agent in (self.server.openai_agent(), self.server.anthropic_agent()):
+            for stream in (False, True):
+                agent.config.stream = stream
+                self.assertEqual(
+                    await agent.achat("hello {name}", name="world"), "echo: hello world"
+                )
+
+            agent.config.stream = False
+            response = await agent.achat("hi", return_all=True)
+            self.assertEqual(response.content, "echo: hi")
+            self.assertEqual(response.usage.prompt, 10)
+
+    async def test_astream(self):
+        for agent in (self.server.openai_agent(), self.server.anthropic_agent()):
+            tokens = []
+            agent.on_new_chat_token(tokens.append)
+            finished = []
+            agent.on_finish_chat(finished.append)
+
+            streamed = [token async for token in agent.astream("hello there")]
+
+            self.assertGreater(len(streamed), 1)
+            self.assertEqual("".join(streamed), "echo: hello there")
+            self.assertEqual(tokens, streamed)
+            self.assertEqual(finished[0].content, "echo: hello there")
+
+    async def test_concurrent_tools(self):
+        for stream in (False, True):
+            agent = self.server.openai_agent(tools=[SlowCalculatorTool()], stream=stream)
+            results = await asyncio.gather(*(agent.achat("calc please") for _ in range(5)))
+            self.assertEqual(results, ["tools: 3"] * 5)
+
+        agent = self.server.openai_agent(tools=[SlowCalculatorTool()])
+        self.assertEqual("".join([t async for t in agent.astream("calc please")]), "tools: 3")
+
+    async def test_shared_client(self):
+        first, second = self.server.openai_agent(), self.server.openai_agent()
+        self.assertIs(first._get_async_client(), second._get_async_client())
+        self.assertIs(first._get_client(), second._get_client())
+        self.assertIs(self.server.anthropic_agent()._client, self.server.anthropic_agent()._client)
+
+    def test_sync_chat(self):
+        agent = self.server.openai_agent(stream=True)
+        self.assertEqual(agent.chat("hello"), "echo: hello")
+        self.assertEqual(agent.chat("hello", return_all=True).content, "echo: hello")
+
+        agent = self.server.anthropic_agent()
+        self.assertEqual(agent.chat("hello"), "echo: hello")
+
+
+class TestPromptCaching(unittest.TestCase):
+    def test_openai(self):
+        with MockLLMServer() as server:
+            agent = server.openai_agent(system_prompt="Today is __DATE__. " + "Be helpful. " * 100)
+            self.assertIs(agent._get_system_msg(), agent._get_system_msg())
+            self.assertNotIn("__DATE__", agent._get_system_msg().content[0]["text"])
+
+            first = agent.chat("a", return_all=True)
+            second = agent.chat("b", return_all=True)
+            self.assertEqual((first.usage.cache_read, second.usage.cache_read), (0, 8))
+            self.assertEqual(agent.token_usage.cache_read, 8)
+
+    def test_anthropic(self):
+        with MockLLMServer() as server:
+            for stream in (False, True):
+                agent = server.anthropic_agent(
+                    prompt_caching=True,
+                    keep_conversation_state=True,
+                    stream=stream,
+                    system_prompt=f"system {stream}",
+                )
+                agent.chat("a")
+                agent.chat("b")
+                self.assertEqual(agent.token_usage.cache_write, 8)
+                self.assertEqual(agent.token_usage.cache_read, 8)
+
+            body = server.requests[-1]["body"]
+            self.assertEqual(body["system"][0]["cache_control"], {"type": "ephemeral"})
+            self.assertEqual(
+                body["messages"][-2]["content"][-1]["cache_control"], {"type": "ephemeral"}
+            )
+            self.assertNotIn("cache_control", body["messages"][-1]["content"][-1])
+            self.assertEqual(
+                server.requests[-1]["headers"]["anthropic-beta"], "prompt-caching-2024-07-31"
+            )
+            # the stored history is left untouched
+            self.assertNotIn("cache_control", agent.conversation_state[-1].content[-1])
+
+
+class TestStreamAggregator(unittest.TestCase):
+    def test_tool_call_index(self):
+        from openai.types.chat import ChatCompletionChunk
+
+        from mosaicpy.llm import LLMEventManager
+        from mosaicpy.llm.openai.stream_aggregator import ChunkAggregator
+
+        def chunk(delta, finish_reason=None):
+            return ChatCompletionChunk.model_validate(
+                dict(
+                    id="c",
+                    object="chat.completion.chunk",
+                    created=1,
+                    model="m",
+                    choices=[dict(index=0, delta=delta, finish_reason=finish_reason)],
+                )
+            )
+
+        def call(index, **kwargs):
+            return dict(tool_calls=[dict(index=index, **kwargs)])
+
+        event_manager = LLMEventManager()
+        tokens = []
+        event_manager.on_new_chat_token(tokens.append)
+
+        aggregator = ChunkAggregator(event_manger=event_manager)
+        for delta in [
+            dict(role="assistant", content="Let "),
+            dict(content="me"),
+            call(0, id="a", type="function", function=dict(name="f", arguments='{"x"')),
+            call(1, id="b", type="function", function=dict(name="g", arguments="")),
+            call(0, function=dict(arguments=": 1}")),
+            call(1, function=dict(arguments="{}")),
+        ]:
+            aggregator.update(chunk(delta))
+        aggregator.update(chunk({}, "tool_calls"))
+
+        message = aggregator.to_chat_completion().choices[0].message
+        self.assertEqual(message.content, "Let me")
+        self.assertEqual(tokens, ["Let ", "me"])
+        self.assertEqual(
+            [(c.id, c.function.name, c.function.arguments) for c in message.tool_calls],
+            [("a", "f", '{"x": 1}'), ("b", "g", "{}")],
+        )
+
+
+class TestToken(unittest.TestCase):
+    def test_encoding(self):
+        self.assertIs(token.get_encoding("gpt-3.5-turbo"), token.get_encoding())
+        self.assertIs(token.get_encoding("unknown-model"), token.get_encoding())
+        self.assertEqual(token.count_openai_token("hello world"), 2)
+        self.assertEqual(token.count_tokens_batch(["hello world", "hi"]), [2, 1])
+
+    def test_estimate_request(self):
+        msgs = [SimpleMessage.from_text("user", f"turn {i} " * 50) for i in range(10)]
+        first = token.estimate_request_tokens(msgs)
+        self.assertGreater(first, 500)
+
+        msgs.append(SimpleMessage.from_text("assistant", "done"))
+        misses = token._count_cache.misses
+        self.assertGreater(token.estimate_request_tokens(msgs), first)
+        self.assertEqual(token._count_cache.misses, misses + 1)
+
+    def test_count_cache(self):
+        cache = token._CountCache(maxsize=2)
+        for text in ("a b", "c", "a b", "d", "e"):
+            cache.count(text, token.DEFAULT_ENCODING)
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(len(cache._counts), 2)
+        self.assertTrue(all(isinstance(key[0], bytes) for key in cache._counts))
+
+
+class TestConversationHistory(unittest.TestCase):
+    def _turns(self, history, n):
+        for i in range(n):
+            history.extend(
+                [
+                    SimpleMessage.from_text("user", f"question {i} " * 20),
+                    SimpleMessage.from_text("assistant", f"answer {i} " * 20),
+                ]
+            )
+
+    def test_sliding_window(self):
+        history = ConversationHistory(max_tokens=300)
+        self._turns(history, 20)
+        self.assertLessEqual(history.total_tokens, 300)
+        self.assertEqual(history[0].role, "user")
+        self.assertEqual(history[-1].content[0]["text"], "answer 19 " * 20)
+        self.assertEqual(history.total_tokens, sum(token.count_message_tokens(m) for m in history))
+
+    def test_keep_last(self):
+        history = ConversationHistory(strategy=KeepLastN(4))
+        self._turns(history, 5)
+        self.assertEqual(
+            [m.content[0]["text"][:10] for m in history][::2], ["question 3", "question 4"]
+        )
+
+    def test_summarize(self):
+        summarized = []
+
+        def summarizer(messages):
+            summarized.append(len(messages))
+            return "they talked"
+
+        history = ConversationHistory(max_tokens=300, strategy=Summarize(summarizer))
+        self._turns(history, 10)
+        self.assertTrue(summarized)
+        self.assertLessEqual(history.total_tokens, 300 + 50)
+        self.assertTrue(history[0].content[0]["text"].endswith("they talked"))
+        self.assertEqual(history[1].role, "assistant")
+
+    def test_summarize_failure_keeps_turns(self):
+        def summarizer(messages):
+            raise RuntimeError("summary request failed")
+
+        history = ConversationHistory(max_tokens=100, strategy=Summarize(summarizer))
+        for i in range(4):
+            history.extend(
+                [
+                    SimpleMessage.from_text("user", f"question {i} " * 20),
+                    SimpleMessage.from_text("assistant", f"answer {i} " * 20),
+                ],
+                trim=False,
+            )
+        with self.assertRaises(RuntimeError):
+            history.trim()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(history.atrim())
+        self.assertEqual(len(history), 8)
+        self.assertEqual(history[0].content[0]["text"], "question 0 " * 20)
+
+    def test_agent(self):
+        with MockLLMServer() as server:
+            agent = server.openai_agent(
+                keep_conversation_state=True,
+                max_history_tokens=40,
+                history_strategy="summarize",
+            )
+            for i in range(5):
+                self.assertEqual(agent.chat(f"message number {i}"), f"echo: message number {i}")
+
+            summary = agent.conversation_state[0].content[0]["text"]
+            self.assertIn("echo: Summarize", summary)
+            self.assertEqual(
+                agent.conversation_state[-1].content[0]["text"], "echo: message number 4"
+            )
+            # summary calls stay out of the agent's own metrics
+            self.assertEqual(agent.metrics.calls[agent.config.model_name], 5)
+            self.assertEqual(agent.retry_policy.stats()["calls"], 5)
+
+        with self.assertRaises(ValueError):
+            OpenAIAgent(api_key="test", history_strategy="unknown")
+
+    def test_agent_async(self):
+        async def run(agent):
+            # summarizing in the finish listener would call the sync chat here
+            agent.chat = None
+            for i in range(5):
+                self.assertEqual(await agent.achat(f"message {i}"), f"echo: message {i}")
+
+        with MockLLMServer() as server:
+            agent = server.openai_agent(
+                keep_conversation_state=True,
+                max_history_tokens=40,
+                history_strategy="summarize",
+            )
+            asyncio.run(run(agent))
+
+            self.assertIn("echo: Summarize", agent.conversation_state[0].content[0]["text"])
+            self.assertEqual(agent.metrics.calls[agent.config.model_name], 5)
+
+
+class TestToolExecution(MockServerMixin, unittest.IsolatedAsyncioTestCase):
+    def _agent(self, *tools, **kwargs):
+        return self.server.openai_agent(tools=list(tools), **kwargs)
+
+    def test_parallel(self):
+        agent = self._agent(SlowCalculatorTool())
+        start = time.perf_counter()
+        self.assertEqual(agent.chat("calc calc calc"), "tools: 3, 3, 3")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    async def test_parallel_async(self):
+        agent = self._agent(SlowCalculatorTool())
+        start = time.perf_counter()
+        self.assertEqual(await agent.achat("calc calc calc"), "tools: 3, 3, 3")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_rounds(self):
+        self.assertEqual(self._agent(CalculatorTool()).chat("calc again"), "tools: 3")
+        agent = self._agent(CalculatorTool(), max_tool_rounds=2)
+        self.assertEqual(agent.chat("calc again"), "tools: 3, 3")
+        events = list(agent.chat_stream("calc again"))
+        self.assertEqual(events[-1].content, "tools: 3, 3")
+
+    def test_pure(self):
+        tool = SlowCalculatorTool(pure=True, delay=0)
+        agent = self._agent(tool)
+        agent.chat("calc please")
+        agent.chat("calc please")
+        self.assertEqual(tool.calls, 1)
+
+    async def test_timeout(self):
+        agent = self._agent(SlowCalculatorTool(timeout=0.05, delay=0.5))
+        self.assertIn("did not finish", agent.chat("calc calc"))
+        self.assertIn("did not finish", await agent.achat("calc"))
+
+
+class TestCompiledTools(unittest.TestCase):
+    def test_compile(self):
+        tool = CalculatorTool()
+        compiled = compile_tool(tool)
+        self.assertIs(compile_tool(tool), compiled)
+        self.assertEqual(compiled.signature, build_function_signature(tool))
+        self.assertEqual(
+            compiled.count_tokens(), token.count_openai_token(token.tool_text(compiled.signature))
+        )
+        self.assertEqual(compiled.validate('{"expr": "1+2"}'), {"expr": "1+2"})
+        with self.assertRaises(ValidationError):
+            compiled.validate('{"expr": 1}')
+
+    def test_signature_validator(self):
+        class AddTool(Tool):
+            name: str = "add"
+            description: str = "add two numbers"
+
+            def _run(self, a: int, b: int = 2):
+                return a + b
+
+        compiled = compile_tool(AddTool())
+        self.assertEqual(compiled.validate('{"a": "3"}'), {"a": 3})
+        with self.assertRaises(ValidationError):
+            compiled.validate("{}")
+
+    def test_agent(self):
+        agent = OpenAIAgent(api_key="test", tools=[CalculatorTool()])
+        signatures = agent._get_tool_signatures()
+        self.assertIs(agent._get_tool_signatures(), signatures)
+
+        agent.add_tool(SlowCalculatorTool())
+        self.assertEqual(
+            [s["function"]["name"] for s in agent._get_tool_signatures()],
+            ["Calculator", "SlowCalculator"],
+        )
+        self.assertGreater(agent._get_tool_tokens(), compile_tool(CalculatorTool()).count_tokens())
+
+    def test_invalid_arguments(self):
+        agent = OpenAIAgent(api_key="test", tools=[CalculatorTool()])
+        tool_call = SimpleNamespace(
+            id="call_1", function=SimpleNamespace(name="Calculator", arguments='{"x": 1}')
+        )
+        (message,) = agent.tool_executor.run([tool_call])
+        self.assertIn("invalid arguments", message["content"])
+
+
+class TestChatStream(MockServerMixin, unittest.IsolatedAsyncioTestCase):
+    def _check(self, events, content):
+        self.assertIsInstance(events[-1], ChatResponse)
+        self.assertEqual(events[-1].content, content)
+        texts = [e.text for e in events if isinstance(e, TextDelta)]
+        self.assertGreater(len(texts), 1)
+        self.assertEqual("".join(texts), content)
+        self.assertTrue(any(isinstance(e, UsageDelta) for e in events))
+
+    def test_chat_stream(self):
+        for agent in self.server.agents():
+            self._check(list(agent.chat_stream("hello there")), "echo: hello there")
+
+    async def test_achat_stream(self):
+        for agent in self.server.agents():
+            events = [e async for e in agent.achat_stream("hello there")]
+            self._check(events, "echo: hello there")
+
+    def test_tool_calls(self):
+        agent = self.server.openai_agent(tools=[CalculatorTool()])
+        events = list(agent.chat_stream("calc please"))
+        fragments = [e for e in events if isinstance(e, ToolCallDelta)]
+        self.assertEqual(fragments[0].name, CalculatorTool().name)
+        self.assertEqual("".join(f.arguments or "" for f in fragments), '{"expr": "1+2"}')
+        self.assertEqual(events[-1].content, "tools: 3")
+
+    def test_cancel(self):
+        with MockLLMServer(token_delay=0.2) as server:
+            agent = server.openai_agent()
+            start = time.perf_counter()
+            stream = agent.chat_stream("one two three four five six")
+            self.assertIsInstance(next(stream), TextDelta)
+            stream.close()
+            self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class FailingAgent(Agent):
+    def __init__(self, **kwargs):
+        super().__init__(config=OpenAIAgent(api_key="test").config, tools=None, **kwargs)
+        self.calls = 0
+
+    def _assemble_request_messages(self, user_contents):
+        return []
+
+    def chat(self, user_input, **kwargs):
+        self.calls += 1
+        raise RuntimeError("provider down")
+
+
+class TestRouterAgent(MockServerMixin, unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fast = self.server
+        self.slow = self.start_server(latency=1.0)
+
+    def _agent(self, server):
+        return server.openai_agent(stream=True)
+
+    def test_fallback(self):
+        failing = FailingAgent()
+        router = get_agent("router", agents=[failing, self._agent(self.fast)], seed=0)
+        for _ in range(3):
+            self.assertEqual(router.chat("hi"), "echo: hi")
+        self.assertGreater(failing.calls, 0)
+        self.assertEqual(router.get_token_usage().prompt, router.agents[1].token_usage.prompt)
+        self.assertEqual(router.token_usage.completion, router.agents[1].token_usage.completion)
+
+        tokens = []
+        router.on_new_chat_token(tokens.append)
+        self.assertEqual(router.chat("hello there"), "echo: hello there")
+        self.assertEqual("".join(tokens), "echo: hello there")
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+        failing = FailingAgent()
+        router = RouterAgent([failing], failure_threshold=2, reset_timeout=60)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                router.chat("hi")
+        self.assertEqual(failing.calls, 2)
+        self.assertEqual(router.stats()[0]["state"], "open")
+
+    def test_circuit_breaker_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+        breaker.record_failure()
+        self.assertFalse(breaker.available())
+        time.sleep(0.1)
+        # checking availability does not use up the half-open trial
+        self.assertTrue(breaker.available())
+        self.assertTrue(breaker.available())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.available())
+
+        # a recovered agent ranked behind a healthy one keeps its trial until it is tried
+        recovered = self._agent(self.fast)
+        router = RouterAgent([recovered, self._agent(self.fast)], reset_timeout=0.1, seed=0)
+        router._routes[0].breaker.opened_at = time.monotonic() - 1
+        router._routes[0].latency = 100.0
+        router._routes[1].latency = 0.001
+        self.assertEqual(router.chat("hi"), "echo: hi")
+        self.assertEqual(router.stats()[0]["state"], "half_open")
+
+    def test_hedge(self):
+        router = RouterAgent(
+            [self._agent(self.slow), self._agent(self.fast)], hedge_after_ms=100, seed=0
+        )
+        for _ in range(3):
+            start = time.perf_counter()
+            self.assertEqual(router.chat("hi"), "echo: hi")
+            self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertLess(router.stats()[1]["latency"], 0.5)
+
+    def test_hedge_cancels_loser(self):
+        slow, fast = self._agent(self.slow), self._agent(self.fast)
+        slow_finished = []
+        slow.on_finish_chat(slow_finished.append)
+
+        router = RouterAgent([slow, fast], hedge_after_ms=50, seed=0)
+        router._routes[0].latency, router._routes[1].latency = 0.001, 100.0
+        start = time.perf_counter()
+        self.assertEqual(router.chat("hi"), "echo: hi")
+        self.assertLess(time.perf_counter() - start, 0.8)
+
+        async def pending_tasks():
+            return len(asyncio.all_tasks()) - 1
+
+        time.sleep(0.1)
+        loop = router_module._get_loop()
+        self.assertEqual(asyncio.run_coroutine_threadsafe(pending_tasks(), loop).result(), 0)
+        # the slow request was closed, so it never finishes
+        time.sleep(1.0)
+        self.assertEqual(slow_finished, [])
+
+    async def test_hedge_async(self):
+        router = RouterAgent(
+            [self._agent(self.slow), self._agent(self.fast)], hedge_after_ms=100, seed=1
+        )
+        for _ in range(3):
+            start = time.perf_counter()
+            self.assertEqual(await router.achat("hi"), "echo: hi")
+            self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual(
+            "".join([t async for t in router.astream("hello there")]), "echo: hello there"
+        )
+
+        router = RouterAgent([FailingAgent(), self._agent(self.fast)], seed=0)
+        for _ in range(3):
+            self.assertEqual(await router.achat("hi"), "echo: hi")
+
+
+class TestCallMetrics(MockServerMixin, unittest.IsolatedAsyncioTestCase):
+    server_kwargs = dict(latency=0.02, token_delay=0.01)
+
+    def _check_streamed(self, metrics):
+        self.assertEqual(metrics.requests, 1)
+        self.assertGreaterEqual(metrics.ttft, 0.02)
+        self.assertGreater(metrics.total_time, metrics.ttft)
+        self.assertIsNotNone(metrics.inter_token_latency)
+        self.assertGreater(metrics.tokens_per_second, 0)
+        self.assertGreater(metrics.completion_tokens, 0)
+        self.assertLess(metrics.queue_time, metrics.ttft)
+
+    def test_chat_stream(self):
+        for agent in self.server.agents():
+            calls = []
+            agent.on_call_metrics(calls.append)
+            list(agent.chat_stream("hello there"))
+            self.assertEqual(len(calls), 1)
+            self._check_streamed(calls[0])
+            self.assertGreater(calls[0].inter_token_latency, 0.005)
+
+        for agent in self.server.agents(stream=True):
+            calls = []
+            agent.on_call_metrics(calls.append)
+            agent.chat("hello there")
+            self._check_streamed(calls[0])
+
+    async def test_achat(self):
+        for agent in self.server.agents():
+            calls = []
+            agent.on_call_metrics(calls.append)
+            await agent.achat("hello there")
+            [e async for e in agent.achat_stream("hello there")]
+            self.assertIsNone(calls[0].inter_token_latency)
+            self.assertAlmostEqual(calls[0].ttft, calls[0].total_time, delta=0.01)
+            self._check_streamed(calls[1])
+
+    def test_retries_and_tools(self):
+        agent = self.server.openai_agent(
+            tools=[SlowCalculatorTool(delay=0.05)], retry_base_delay=0.01
+        )
+        calls = []
+        agent.on_call_metrics(calls.append)
+        self.server.fail_next(1)
+        agent.chat("calc")
+        self.assertEqual(calls[0].retries, 1)
+        self.assertGreater(calls[0].retry_time, 0)
+        self.assertEqual(calls[0].requests, 2)
+        self.assertGreaterEqual(calls[0].tool_time, 0.05)
+
+    def test_recorder(self):
+        recorder = MetricsRecorder()
+        agents = self.server.agents(metrics=recorder)
+        for agent in agents:
+            for _ in range(3):
+                agent.chat("hello there")
+        self.assertEqual(recorder.calls, {agent.config.model_name: 3 for agent in agents})
+
+        summary = recorder.summary(agents[0].config.model_name)
+        self.assertEqual(summary["total_time"]["count"], 3)
+        self.assertLessEqual(summary["ttft"]["p50"], summary["ttft"]["p99"])
+
+        text = recorder.to_prometheus()
+        self.assertIn("# TYPE mosaicpy_llm_ttft summary", text)
+        self.assertIn(
+            f'mosaicpy_llm_total_time_count{{model="{agents[1].config.model_name}"}} 3', text
+        )
+
+    def test_queue_time(self):
+        agent = self.server.agents()[0]
+        calls = []
+        agent.on_call_metrics(calls.append)
+        with queued_since(time.perf_counter() - 0.5):
+            agent.chat("hello there")
+        self.assertGreaterEqual(calls[0].queue_time, 0.5)
+        self.assertGreater(calls[0].ttft, calls[0].queue_time)
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def _flaky(self, errors):
+        errors = list(errors)
+        calls = []
+
+        def func():
+            calls.append(time.monotonic())
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        return func, calls
+
+    def test_retries_transient_errors(self):
+        policy = RetryPolicy(max_attempts=4, base_delay=0.001, max_delay=0.01, seed=0)
+        func, calls = self._flaky([FakeAPIError(429), FakeAPIError(503)])
+        attempts = []
+        self.assertEqual(policy.call(func, attempts.append), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([a.attempt for a in attempts], [1, 2])
+        self.assertTrue(all(0.001 <= a.delay <= 0.01 for a in attempts))
+        self.assertEqual(policy.stats()["retries"], 2)
+
+    def test_gives_up(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01)
+        func, calls = self._flaky([FakeAPIError(500)] * 5)
+        attempts = []
+        with self.assertRaises(FakeAPIError):
+            policy.call(func, attempts.append)
+        self.assertEqual(len(calls), 3)
+        # giving up is not a retry
+        self.assertEqual([a.attempt for a in attempts], [1, 2])
+
+        # client errors are not retried
+        func, calls = self._flaky([FakeAPIError(400)])
+        with self.assertRaises(FakeAPIError):
+            policy.call(func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(policy.stats()["failures"], 2)
+
+    def test_deadline_and_retry_after(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=0.001, max_delay=0.01, deadline=1)
+        func, calls = self._flaky([FakeAPIError(429, {"retry-after-ms": "100"})])
+        self.assertEqual(policy.call(func), "ok")
+        self.assertGreaterEqual(calls[1] - calls[0], 0.1)
+
+        # a Retry-After beyond the deadline fails fast
+        func, calls = self._flaky([FakeAPIError(429, {"retry-after": "5"})])
+        start = time.monotonic()
+        with self.assertRaises(FakeAPIError):
+            policy.call(func)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_decorrelated_jitter(self):
+        policy = RetryPolicy(base_delay=1, max_delay=20, seed=1)
+        delay = None
+        for _ in range(50):
+            delay = policy.next_delay(delay)
+            self.assertTrue(1 <= delay <= 20)
+
+    def test_agents(self):
+        with MockLLMServer() as server:
+            for agent in server.agents(retry_base_delay=0.01):
+                attempts = []
+                agent.event_manager.on_retry(attempts.append)
+                server.fail_next(2, status=503)
+                self.assertEqual(agent.chat("hi"), "echo: hi")
+                self.assertEqual([a.attempt for a in attempts], [1, 2])
+
+                server.fail_next(2, status=503)
+                self.assertEqual(asyncio.run(agent.achat("hi")), "echo: hi")
+
+                agent.retry_policy.max_attempts = 2
+                server.fail_next(2, status=503)
+                attempts.clear()
+                with self.assertRaises(Exception):
+                    agent.chat("hi")
+                self.assertEqual([a.attempt for a in attempts], [1])
+
+                # a client error fails without a retry event
+                server.fail_next(1, status=400)
+                attempts.clear()
+                with self.assertRaises(Exception):
+                    agent.chat("hi")
+                self.assertEqual(attempts, [])
+
+
+class TestBatchChat(MockServerMixin, unittest.TestCase):
+    server_kwargs = dict(latency=0.05)
+
+    def setUp(self):
+        super().setUp()
+        self.agent = self.server.openai_agent()
+
+    def test_ordered(self):
+        prompts = [f"q{i}" for i in range(20)] + [dict(user_input="hi {name}", name="bob")]
+        responses = list(batch_chat(self.agent, prompts, max_concurrency=8, tokens_per_minute=1e6))
+        self.assertEqual(
+            [r.content for r in responses], [f"echo: q{i}" for i in range(20)] + ["echo: hi bob"]
+        )
+        self.assertEqual(self.agent.token_usage.prompt, 10 * 21)
+        self.assertEqual(len(self.agent.conversation_state), 0)
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            progress_file = os.path.join(tmp_dir, "progress.pkl")
+            prompts = [f"q{i}" for i in range(6)]
+            for i, response in enumerate(
+                batch_chat(self.agent, prompts, progress_file=progress_file)
+            ):
+                if i == 2:
+                    break
+
+            sent = len(self.server.requests)
+            responses = list(batch_chat(self.agent, prompts, progress_file=progress_file))
+            self.assertEqual([r.content for r in responses], [f"echo: {p}" for p in prompts])
+            self.assertLess(len(self.server.requests) - sent, len(prompts))
+
+    def test_rate_limit(self):
+        rate_limits = []
+        self.agent.on_rate_limit(lambda error, retry_after: rate_limits.append(retry_after))
+        self.agent.retry_policy.base_delay = 0.01
+        self.server.fail_next(1)
+        responses = list(batch_chat(self.agent, ["a", "b"], max_concurrency=1))
+        self.assertEqual([r.content for r in responses], ["echo: a", "echo: b"])
+        self.assertEqual(rate_limits, [0])
+
+    def test_estimate_tokens(self):
+        agent = OpenAIAgent(api_key="test", system_prompt="be brief " * 500)
+        estimate = _estimate_tokens(agent, dict(user_input="hi {name}", name="bob"))
+        self.assertGreater(estimate, 1000 + agent.config.max_tokens)
+
+        request = dict(user_input="hi {name}", name="bob", max_tokens=10)
+        without_tools = _estimate_tokens(agent, request)
+        self.assertEqual(without_tools, estimate - agent.config.max_tokens + 10)
+
+        agent.add_tool(CalculatorTool())
+        self.assertEqual(_estimate_tokens(agent, request) - without_tools, agent._get_tool_tokens())
+
+    def test_stateful_agent(self):
+        agent = OpenAIAgent(api_key="test", keep_conversation_state=True)
+        with self.assertRaises(ValueError):
+            list(batch_chat(agent, ["a"]))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "cache.sqlite")
+
+    def test_key(self):
+        key = make_cache_key(dict(model="m", messages=[dict(role="user", content="hi")]))
+        self.assertEqual(
+            key,
+            make_cache_key(
+                dict(messages=[dict(content="hi", role="user")], model="m", stream=True, seed=None)
+            ),
+        )
+        self.assertNotEqual(key, make_cache_key(dict(model="m2", messages=[])))
+
+    def test_tiers(self):
+        with ResponseCache(self.path, max_entries=1) as cache:
+            cache.set("a", {"v": 1})
+            cache.set("b", {"v": 2})
+            self.assertEqual(cache.get("a"), {"v": 1})
+            self.assertIsNone(cache.get("c"))
+
+        with ResponseCache(self.path) as cache:
+            self.assertEqual(cache.get("b"), {"v": 2})
+            self.assertEqual(len(cache), 2)
+
+    def test_eviction(self):
+        with ResponseCache(self.path, max_disk_entries=2, ttl=60) as cache:
+            for key in "abc":
+                cache.set(key, {"v": key})
+            self.assertEqual(len(cache), 2)
+
+            cache.set("d", {"v": "d"}, ttl=-1)
+            self.assertIsNone(cache.get("d"))
+
+        with ResponseCache(self.path, max_disk_bytes=20) as cache:
+            cache.set("e", {"v": "e"})
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.get("e"), {"v": "e"})
+
+    def test_agent(self):
+        with MockLLMServer() as server:
+            for stream in (False, True):
+                for agent in server.agents(stream=stream):
+                    agent.cache = ResponseCache()
+                    self.assertEqual(agent.chat("hello"), "echo: hello")
+                    sent = len(server.requests)
+
+                    tokens = []
+                    agent.on_new_chat_token(tokens.append)
+                    self.assertEqual(agent.chat("hello"), "echo: hello")
+                    self.assertEqual(len(server.requests), sent)
+                    self.assertEqual(agent.cache.hits, 1)
+                    if stream:
+                        self.assertEqual("".join(tokens), "echo: hello")
+
+                    agent.chat("hello", temperature=0.5)
+                    self.assertEqual(len(server.requests), sent + 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,13 @@
+import os
+import tempfile
+import time
 import unittest
 
-from mosaicpy.collections import pmap, sample
+import numpy as np
+
+from mosaicpy.collections import ipmap, pmap, pmap_array, sample
 from mosaicpy.collections.lists import sort_by_scores, values_to_rank
+from mosaicpy.collections.parallel import MapResult, get_pool, shutdown_pools
 
 
 def my_function(x):
@@ -9,7 +15,6 @@ def my_function(x):
 
 
 class TestParallelMapLite(unittest.TestCase):
-
     def test_single_worker(self):
         result = pmap(range(5), my_function, workers=1)
         self.assertEqual(result, [0, 2, 4, 6, 8])
@@ -32,7 +37,6 @@ class TestParallelMapLite(unittest.TestCase):
 
 
 class TestParallelMap(unittest.TestCase):
-
     def test_single_worker(self):
         result = pmap(range(5), my_function, workers=1, use_process=True)
         self.assertEqual(result, [0, 2, 4, 6, 8])
@@ -42,8 +46,7 @@ class TestParallelMap(unittest.TestCase):
         self.assertEqual(result, [0, 2, 4, 6, 8])
 
     def test_progress_bar(self):
-        result = pmap(range(5), my_function, workers=2,
-                      use_process=True, show_progress=True)
+        result = pmap(range(5), my_function, workers=2, use_process=True, show_progress=True)
         self.assertEqual(result, [0, 2, 4, 6, 8])
 
     def test_negative_workers(self):
@@ -55,6 +58,158 @@ class TestParallelMap(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+def slow_identity(x):
+    time.sleep(0.05 if x == 0 else 0)
+    return x
+
+
+class TestParallelIterMap(unittest.TestCase):
+    def test_generator(self):
+        for use_process in (False, True):
+            result = pmap((x for x in range(5)), my_function, workers=2, use_process=use_process)
+            self.assertEqual(result, [0, 2, 4, 6, 8])
+            result = pmap((x for x in range(3)), my_function, collect_as_dict=True)
+            self.assertEqual(result, {0: 0, 1: 2, 2: 4})
+
+    def test_ordered(self):
+        for use_process in (False, True):
+            result = list(ipmap(range(20), slow_identity, workers=4, use_process=use_process))
+            self.assertEqual(result, list(range(20)))
+
+    def test_unordered(self):
+        result = list(ipmap(range(20), slow_identity, workers=4, ordered=False))
+        self.assertEqual(sorted(result), list(range(20)))
+        self.assertNotEqual(result[0], 0)
+
+    def test_bounded_in_flight(self):
+        pulled = []
+
+        def items():
+            for x in range(100):
+                pulled.append(x)
+                yield x
+
+        results = ipmap(items(), my_function, workers=2, max_in_flight=3)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(pulled), 4)
+        results.close()
+
+    def test_chunksize(self):
+        result = pmap(range(50), my_function, workers=2, use_process=True, chunksize=7)
+        self.assertEqual(result, [x * 2 for x in range(50)])
+
+
+def row_stats(row):
+    return np.array([row.sum(), row.max()], dtype=np.float32)
+
+
+class TestParallelMapPools(unittest.TestCase):
+    def test_adaptive_chunksize(self):
+        result = list(ipmap((x for x in range(500)), my_function, workers=2, use_process=True))
+        self.assertEqual(result, [x * 2 for x in range(500)])
+
+    def test_persistent_pool(self):
+        for _ in range(2):
+            result = pmap(range(10), my_function, workers=2, use_process=True, persistent=True)
+            self.assertEqual(result, [x * 2 for x in range(10)])
+        self.assertIs(get_pool(2), get_pool(2))
+        shutdown_pools()
+        self.assertEqual(pmap(range(3), my_function, workers=2, persistent=True), [0, 2, 4])
+        shutdown_pools()
+
+    def test_pmap_array(self):
+        array = np.random.default_rng(0).random((101, 16))
+        result = pmap_array(array, row_stats, workers=2, chunksize=10)
+        self.assertEqual(result.shape, (101, 2))
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_allclose(result[:, 0], array.sum(axis=1), rtol=1e-5)
+        np.testing.assert_allclose(result[:, 1], array.max(axis=1), rtol=1e-5)
+
+        result = pmap_array(array, my_function, workers=2, persistent=True)
+        np.testing.assert_allclose(result, array * 2)
+        shutdown_pools()
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("three")
+    return x * 2
+
+
+class TestParallelMapFaultTolerance(unittest.TestCase):
+    def test_raise_by_default(self):
+        with self.assertRaises(ValueError):
+            pmap(range(5), fail_on_three, workers=2)
+
+    def test_capture_errors(self):
+        for use_process in (False, True):
+            results = pmap(
+                range(5), fail_on_three, workers=2, use_process=use_process, capture_errors=True
+            )
+            self.assertEqual([r.value for r in results if r.ok], [0, 2, 4, 8])
+            self.assertIsInstance(results[3], MapResult)
+            self.assertIsInstance(results[3].error, ValueError)
+            self.assertEqual(results[3].index, 3)
+
+    def test_retries(self):
+        attempts = {}
+
+        def flaky(x):
+            attempts[x] = attempts.get(x, 0) + 1
+            if attempts[x] < 3:
+                raise RuntimeError("flaky")
+            return x
+
+        results = pmap(range(4), flaky, workers=2, retries=2, backoff=0.01, capture_errors=True)
+        self.assertEqual([r.value for r in results], [0, 1, 2, 3])
+        self.assertEqual([r.attempts for r in results], [3, 3, 3, 3])
+
+        with self.assertRaises(RuntimeError):
+            pmap(range(2), lambda x: 1 / 0 if x else flaky(5), workers=2, retries=0)
+
+    def test_timeout(self):
+        results = pmap(
+            [0.5, 0, 0],
+            lambda x: time.sleep(x) or x,
+            workers=3,
+            timeout=0.1,
+            capture_errors=True,
+        )
+        self.assertIsInstance(results[0].error, TimeoutError)
+        self.assertEqual([r.value for r in results[1:]], [0, 0])
+
+    def test_timeout_excludes_queue_time(self):
+        # one worker runs the items in turn; the later ones wait longer than the timeout
+        results = pmap(
+            range(3),
+            lambda x: time.sleep(0.6) or x,
+            workers=1,
+            timeout=1.0,
+            capture_errors=True,
+        )
+        self.assertTrue(all(r.ok for r in results), results)
+        self.assertEqual([r.attempts for r in results], [1, 1, 1])
+
+    def test_checkpoint(self):
+        calls = []
+
+        def record(x):
+            calls.append(x)
+            return fail_on_three(x)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = os.path.join(tmp_dir, "checkpoint.pkl")
+            results = pmap(range(6), record, workers=2, capture_errors=True, checkpoint=checkpoint)
+            self.assertFalse(results[3].ok)
+
+            calls.clear()
+            results = pmap(range(6), my_function, workers=2, checkpoint=checkpoint)
+            self.assertEqual(results, [0, 2, 4, 6, 8, 10])
+            self.assertEqual(calls, [])
+            self.assertEqual(len(pmap(range(6), record, checkpoint=checkpoint)), 6)
+            self.assertEqual(calls, [])
+
+
 class TestSample(unittest.TestCase):
     def test_sample(self):
         d_dict = dict({str(x): x for x in range(10)})
@@ -73,11 +228,10 @@ class TestLists(unittest.TestCase):
         self.assertEqual(values_to_rank(scores, start_rank=1), [2, 3, 1, 4])
 
     def test_sort_by_scores(self):
-        items = ['a', 'b', 'c', 'd']
+        items = ["a", "b", "c", "d"]
         scores = [4.5, 8.2, 3.1, 11.0]
-        self.assertEqual(sort_by_scores(items, scores), ['c', 'a', 'b', 'd'])
-        self.assertEqual(sort_by_scores(
-            items, scores, reverse=True), ['d', 'b', 'a', 'c'])
+        self.assertEqual(sort_by_scores(items, scores), ["c", "a", "b", "d"])
+        self.assertEqual(sort_by_scores(items, scores, reverse=True), ["d", "b", "a", "c"])
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
+import math
 import unittest
 import os
-from mosaicpy.utils.file import load_jsonl, dump_jsonl
+from mosaicpy.collections import sample
+from mosaicpy.utils.file import JsonlWriter, iter_jsonl, load_jsonl, dump_jsonl
+from mosaicpy.utils.jsonl_index import JsonlIndex
 
 
 class TestJsonlFunctions(unittest.TestCase):
@@ -28,6 +31,113 @@ class TestJsonlFunctions(unittest.TestCase):
             if os.path.exists(file_path):
                 os.remove(file_path)
 
+    def test_iter_jsonl(self):
+        data = [{"key": i} for i in range(1000)]
+        dump_jsonl(data, self.test_file_path)
+
+        self.assertEqual(list(iter_jsonl(self.test_file_path)), data)
+        self.assertEqual(list(iter_jsonl(self.test_file_path, use_orjson=False)), data)
+        self.assertEqual(list(iter_jsonl(self.test_file_path, workers=2, chunk_bytes=100)), data)
+
+        batches = list(
+            iter_jsonl(
+                self.test_file_path,
+                cb_func=lambda x: x if x["key"] % 2 else None,
+                skip_none=True,
+                batch_size=300,
+            )
+        )
+        self.assertEqual([len(batch) for batch in batches], [300, 200])
+        self.assertEqual(batches[0][0], {"key": 1})
+
+    def test_iter_jsonl_non_finite(self):
+        with open(self.test_file_path, "w") as f:
+            f.write('{"key": NaN}\n{"key": Infinity}\n{"key": -Infinity}\n')
+        for workers in (1, 2):
+            records = list(iter_jsonl(self.test_file_path, workers=workers, chunk_bytes=10))
+            self.assertTrue(math.isnan(records[0]["key"]))
+            self.assertEqual([r["key"] for r in records[1:]], [math.inf, -math.inf])
+
+    def test_dump_jsonl_non_finite(self):
+        data = [{"key": math.nan, "text": "café"}, {"key": math.inf}]
+        dump_jsonl(data, self.test_file_path)
+        with open(self.test_file_path) as f:
+            self.assertEqual(f.read(), '{"key": NaN, "text": "caf\\u00e9"}\n{"key": Infinity}\n')
+
+        records = load_jsonl(self.test_file_path)
+        self.assertTrue(math.isnan(records[0]["key"]))
+        self.assertEqual(records[0]["text"], "café")
+        self.assertEqual(records[1]["key"], math.inf)
+
+    def test_jsonl_writer(self):
+        data = [{"key": i, "value": "x" * (i % 7)} for i in range(1000)]
+        for suffix, codec in [("", None), (".gz", "gzip"), (".zst", "zstd"), (".lz4", "lz4")]:
+            file_path = self.test_file_path + suffix
+            try:
+                with JsonlWriter(file_path, buffer_size=256, workers=3) as writer:
+                    self.assertEqual(writer.codec, codec)
+                    writer.write_many(data[:600])
+                with JsonlWriter(file_path, mode="a", buffer_size=256) as writer:
+                    for record in data[600:]:
+                        writer.write(record)
+            except ImportError:
+                continue
+
+            self.assertEqual(load_jsonl(file_path), data)
+            os.remove(file_path)
+
+    def test_jsonl_writer_atomic(self):
+        dump_jsonl(self.test_data, self.test_file_path)
+
+        with self.assertRaises(RuntimeError):
+            with JsonlWriter(self.test_file_path, atomic=True) as writer:
+                writer.write({"key": "partial"})
+                raise RuntimeError()
+        self.assertEqual(load_jsonl(self.test_file_path), self.test_data)
+
+        with JsonlWriter(self.test_file_path, atomic=True) as writer:
+            writer.write({"key": "new"})
+            self.assertEqual(load_jsonl(self.test_file_path), self.test_data)
+        self.assertEqual(load_jsonl(self.test_file_path), [{"key": "new"}])
+
+    def test_jsonl_index(self):
+        data = [{"key": i} for i in range(500)]
+        for file_path, kwargs in [
+            (self.test_file_path, {}),
+            (self.test_file_path + ".gz", {"buffer_size": 200}),
+            (self.test_file_path + ".gz", {}),
+        ]:
+            dump_jsonl(data, file_path, **kwargs)
+            index = JsonlIndex(file_path)
+
+            self.assertEqual(len(index), 500)
+            self.assertEqual(index[0], data[0])
+            self.assertEqual(index[321], data[321])
+            self.assertEqual(index[-1], data[-1])
+            self.assertEqual(index[10:20], data[10:20])
+            self.assertEqual(index[490::3], data[490::3])
+            self.assertEqual(list(index), data)
+
+            sampled = sample(index, 10, seed=1)
+            self.assertEqual(len(sampled), 10)
+            self.assertTrue(all(record in data for record in sampled))
+            self.assertEqual(index.sample(5, seed=3), index.sample(5, seed=3))
+
+            os.remove(file_path)
+            os.remove(file_path + ".idx")
+
+    def test_jsonl_index_rebuild(self):
+        with open(self.test_file_path, "w") as f:
+            f.write('\n{"key": 1}\n\n\n{"key": 2}\n{"key": 3}')
+        index = JsonlIndex(self.test_file_path)
+        self.assertEqual(index[:], [{"key": 1}, {"key": 2}, {"key": 3}])
+        self.assertEqual(index[1], {"key": 2})
+
+        dump_jsonl(self.test_data, self.test_file_path)
+        os.utime(self.test_file_path, ns=(0, 0))
+        self.assertEqual(JsonlIndex(self.test_file_path)[:], self.test_data)
+        os.remove(self.test_file_path + ".idx")
+
     def tearDown(self):
         # Clean up the test environment.
         if os.path.exists(self.test_file_path):
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from mosaicpy.ml.metrics import (
+    dcg_at_k,
+    evaluate_batch,
+    evaluate_stream,
+    ndcg_at_k,
+    ndcg_at_k_batch,
+)
+
+
+class TestBatchRankingMetrics(unittest.TestCase):
+    def setUp(self):
+        self.rows = [[3, 2, 0, 1], [0, 0, 1], [0, 0, 0, 0, 0], [1]]
+        width = max(len(row) for row in self.rows)
+        self.dense = np.array([row + [0] * (width - len(row)) for row in self.rows])
+        self.ragged = (
+            np.concatenate(self.rows),
+            np.cumsum([0] + [len(row) for row in self.rows]),
+        )
+
+    def test_matches_scalar(self):
+        for k in (1, 2, 3, 10):
+            expected_dcg = [dcg_at_k(row, k) for row in self.rows]
+            expected_ndcg = [ndcg_at_k(row, k) for row in self.rows]
+            for relevance in (self.dense, self.ragged):
+                results = evaluate_batch(relevance, k, ("dcg", "ndcg"))
+                np.testing.assert_allclose(results["dcg"], expected_dcg)
+                np.testing.assert_allclose(results["ndcg"], expected_ndcg)
+
+    def test_mrr_and_recall(self):
+        for relevance in (self.dense, self.ragged):
+            results = evaluate_batch(relevance, 2, ("mrr", "recall"))
+            np.testing.assert_allclose(results["mrr"], [1, 0, 0, 1])
+            np.testing.assert_allclose(results["recall"], [2 / 3, 0, 0, 1])
+
+    def test_chunked(self):
+        for relevance in (self.dense, self.ragged):
+            np.testing.assert_allclose(
+                evaluate_batch(relevance, 3, ("ndcg",), chunk_size=3)["ndcg"],
+                ndcg_at_k_batch(relevance, 3),
+            )
+
+    def test_stream(self):
+        means = evaluate_stream([self.dense[:2], self.dense[2:]], 3, ("ndcg", "mrr"))
+        self.assertAlmostEqual(means["ndcg"], ndcg_at_k_batch(self.dense, 3).mean())
+        self.assertAlmostEqual(means["mrr"], 0.5 + 1 / 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
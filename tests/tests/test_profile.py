@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from mosaicpy.annotations import ProfileRegistry, profile, time_it, timer
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.registry = ProfileRegistry()
+
+    def test_profile(self):
+        @profile(registry=self.registry)
+        def double(x):
+            """Double x."""
+            return x * 2
+
+        self.assertEqual([double(i) for i in range(10)], [i * 2 for i in range(10)])
+        self.assertEqual(double.__name__, "double")
+        self.assertEqual(double.__doc__, "Double x.")
+
+        stats = self.registry.stats()
+        self.assertEqual(list(stats), [f"{__name__}.TestProfile.test_profile.<locals>.double"])
+        stat = next(iter(stats.values()))
+        self.assertEqual((stat["calls"], stat["samples"]), (10, 10))
+        self.assertLessEqual(stat["min"], stat["p50"])
+        self.assertLessEqual(stat["p50"], stat["max"])
+
+    def test_async(self):
+        @profile(name="sleep", registry=self.registry)
+        async def sleep():
+            await asyncio.sleep(0.01)
+            return "done"
+
+        async def main():
+            async with timer("block", registry=self.registry) as t:
+                await asyncio.gather(sleep(), sleep())
+            return t
+
+        t = asyncio.run(main())
+        stats = self.registry.stats()
+        self.assertEqual(stats["sleep"]["calls"], 2)
+        self.assertGreaterEqual(stats["sleep"]["mean"], 0.01)
+        self.assertGreaterEqual(t.elapsed, 0.01)
+        self.assertLess(stats["block"]["total"], 0.02 + 0.05)
+
+    def test_sampling(self):
+        @profile(name="hot", sample_rate=0.1, registry=self.registry)
+        def hot():
+            pass
+
+        threads = [threading.Thread(target=lambda: [hot() for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stat = self.registry.stats()["hot"]
+        self.assertEqual(stat["samples"], 40)
+        self.assertEqual(stat["calls"], 400)
+
+        self.registry.enabled = False
+        hot()
+        self.assertEqual(self.registry.stats()["hot"]["samples"], 40)
+
+    def test_exceptions_are_timed(self):
+        @profile(name="fail", registry=self.registry)
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertEqual(self.registry.stats()["fail"]["calls"], 1)
+
+    def test_report(self):
+        with timer("slow", registry=self.registry):
+            time.sleep(0.01)
+        with timer("fast", registry=self.registry):
+            pass
+
+        lines = self.registry.report().splitlines()
+        self.assertEqual(
+            lines[0].split(), ["name", "calls", "total", "mean", "p50", "p95", "p99", "max"]
+        )
+        self.assertEqual([line.split()[0] for line in lines[1:]], ["slow", "fast"])
+
+        data = json.loads(self.registry.report(format="json"))
+        self.assertEqual(list(data), ["slow", "fast"])
+        self.assertGreaterEqual(data["slow"]["total"], 0.01)
+
+        self.registry.reset()
+        self.assertEqual(self.registry.stats(), {})
+
+    def test_time_it(self):
+        @time_it(registry=self.registry)
+        def add(a, b):
+            return a + b
+
+        @time_it(verbose=False, registry=self.registry)
+        async def aadd(a, b):
+            return a + b
+
+        out = StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(add(1, 2), 3)
+            self.assertEqual(asyncio.run(aadd(1, 2)), 3)
+        self.assertEqual(out.getvalue().count("took"), 1)
+        self.assertEqual(add.__name__, "add")
+        self.assertEqual(len(self.registry.stats()), 2)
+
+        # a disabled registry records nothing; verbose calls are still printed
+        self.registry.enabled = False
+        with redirect_stdout(out):
+            add(1, 2)
+            asyncio.run(aadd(1, 2))
+        self.assertEqual(out.getvalue().count("took"), 2)
+        self.assertEqual([stat["calls"] for stat in self.registry.stats().values()], [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import threading
+import unittest
+
+from mosaicpy.utils.stats import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantiles(self):
+        hist = Histogram()
+        hist.update(range(1, 101))
+        self.assertEqual(hist.count, 100)
+        self.assertEqual(hist.mean, 50.5)
+        self.assertEqual((hist.min, hist.max), (1, 100))
+        self.assertAlmostEqual(hist.quantile(0.5), 50.5)
+        self.assertAlmostEqual(hist.percentiles()["p99"], 99.01)
+        self.assertEqual(set(hist.summary()), {"count", "mean", "min", "max", "p50", "p95", "p99"})
+
+        self.assertIsNone(Histogram().quantile(0.5))
+        self.assertIsNone(Histogram().summary()["min"])
+
+    def test_reservoir(self):
+        hist = Histogram(max_samples=100, seed=0)
+        hist.update(range(10000))
+        self.assertEqual(hist.count, 10000)
+        self.assertEqual(len(hist._samples), 100)
+        self.assertEqual(hist.max, 9999)
+        # a uniform sample keeps the median close to the true one
+        self.assertLess(abs(hist.quantile(0.5) - 5000), 1500)
+
+        hist.reset()
+        self.assertEqual(len(hist), 0)
+
+    def test_threads(self):
+        hist = Histogram()
+        threads = [threading.Thread(target=hist.update, args=(range(1000),)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(hist.count, 8000)
+        self.assertEqual(hist.sum, 8 * sum(range(1000)))
+
+
+if __name__ == "__main__":
+    unittest.main()
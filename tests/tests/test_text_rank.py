@@ -0,0 +1,117 @@
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mosaicpy.ml.text_rank import IncrementalTextRanker, TextRanker
+from mosaicpy.ml.vector import cosine_similarity, cosine_similarity_matrix, top_k_similarity
+
+
+def _reference_rank(embeddings, ranker):
+    size = len(embeddings)
+    similarity_matrix = np.zeros((size, size))
+    for i in range(size):
+        for j in range(size):
+            similarity_matrix[i][j] = cosine_similarity(embeddings[i], embeddings[j])
+    similarity_matrix /= similarity_matrix.sum(axis=1, keepdims=True)
+    return ranker._rank(similarity_matrix)
+
+
+class TestSimilarity(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).random((50, 8))
+
+    def test_cosine_similarity_matrix(self):
+        matrix = cosine_similarity_matrix(self.embeddings, block_size=7)
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertAlmostEqual(
+            float(matrix[3, 11]),
+            cosine_similarity(self.embeddings[3], self.embeddings[11]),
+            places=5,
+        )
+
+    def test_top_k_similarity(self):
+        indices, scores = top_k_similarity(self.embeddings, 5, block_size=7)
+        matrix = cosine_similarity_matrix(self.embeddings)
+        self.assertEqual(indices.shape, (50, 5))
+        self.assertTrue(np.all(indices[:, 0] == np.arange(50)))
+        np.testing.assert_allclose(scores, -np.sort(-matrix, axis=1)[:, :5], rtol=1e-5)
+
+
+class TestTextRanker(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).random((40, 8))
+        self.ranker = TextRanker()
+
+    def test_rank_embeddings(self):
+        ranks = self.ranker.rank_embeddings(self.embeddings, block_size=16)
+        expected = _reference_rank(self.embeddings, self.ranker)
+        np.testing.assert_allclose(ranks, expected, rtol=1e-4)
+
+    def test_rank_embeddings_top_k(self):
+        ranks = self.ranker.rank_embeddings(self.embeddings, top_k=40)
+        expected = _reference_rank(self.embeddings, self.ranker)
+        np.testing.assert_allclose(ranks, expected, rtol=1e-4)
+
+        ranks = self.ranker.rank_embeddings(self.embeddings, top_k=5)
+        self.assertEqual(ranks.shape, (40,))
+
+    def test_rank_embeddings_threshold(self):
+        ranks, stats = self.ranker.rank_embeddings(
+            self.embeddings, threshold=-1.0, return_stats=True
+        )
+        expected = _reference_rank(self.embeddings, self.ranker)
+        np.testing.assert_allclose(ranks, expected, rtol=1e-4)
+        self.assertTrue(stats.converged)
+        self.assertLess(stats.residual, self.ranker.tol)
+
+    def test_warm_start(self):
+        ranks, stats = self.ranker.rank_embeddings(self.embeddings, return_stats=True)
+        _, warm_stats = self.ranker.rank_embeddings(self.embeddings, ranks=ranks, return_stats=True)
+        self.assertLess(warm_stats.iterations, stats.iterations)
+
+    def test_rank_graph_dangling(self):
+        from scipy.sparse import csr_matrix
+
+        adjacency = csr_matrix(np.array([[0, 1, 1], [1, 0, 0], [0, 0, 0]], dtype=float))
+        ranks = self.ranker.rank_graph(adjacency)
+        self.assertAlmostEqual(ranks.sum(), 3, places=4)
+        np.testing.assert_allclose(ranks, self.ranker.rank_graph(adjacency.toarray()))
+
+    def test_sparse_without_scipy(self):
+        with mock.patch.dict(sys.modules, {"scipy": None, "scipy.sparse": None}):
+            with self.assertRaisesRegex(ImportError, "require scipy"):
+                self.ranker.rank_embeddings(self.embeddings, top_k=5)
+            # the dense path does not need scipy
+            self.assertEqual(self.ranker.rank_embeddings(self.embeddings).shape, (40,))
+
+    def test_rank_embeddings_batch(self):
+        rng = np.random.default_rng(1)
+        documents = [rng.random((n, 8)) for n in (3, 7, 1, 12)]
+        batch_ranks = self.ranker.rank_embeddings_batch(documents)
+        self.assertEqual(len(batch_ranks), 4)
+        for document, ranks in zip(documents, batch_ranks):
+            np.testing.assert_allclose(
+                ranks, self.ranker.rank_embeddings(document), rtol=1e-4, atol=1e-5
+            )
+
+
+class TestIncrementalTextRanker(unittest.TestCase):
+    def test_add(self):
+        embeddings = np.random.default_rng(2).random((30, 8))
+        ranker = IncrementalTextRanker(initial_capacity=4)
+
+        ranker.add(embeddings[:10])
+        for embedding in embeddings[10:]:
+            ranks = ranker.add(embedding)
+
+        self.assertEqual(len(ranker), 30)
+        np.testing.assert_allclose(
+            ranks, TextRanker().rank_embeddings(embeddings), rtol=1e-4, atol=1e-5
+        )
+        self.assertTrue(ranker.stats.converged)
+
+
+if __name__ == "__main__":
+    unittest.main()
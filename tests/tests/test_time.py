@@ -1,7 +1,14 @@
 from datetime import datetime
 import unittest
 from mosaicpy.annotations import time_it
-from mosaicpy.utils.time import from_unixtime, to_unixtime
+from mosaicpy.utils.time import (
+    from_unixtime,
+    from_unixtime_many,
+    to_unixtime,
+    to_unixtime_many,
+)
+
+import numpy as np
 
 
 class TestTimeFunctions(unittest.TestCase):
@@ -28,6 +35,56 @@ class TestTimeFunctions(unittest.TestCase):
         assert from_unixtime(1641049200, format="%Y-%m-%dT%H:%M:%S%z",
                              timezone="Asia/Omsk") == "2022-01-01T21:00:00+0600"
 
+    def test_to_unixtime_many(self):
+        dts = [
+            "2022-01-02 01:00:00",
+            "2022-01-01",
+            "2022-01-01 12:00:00.500",
+            "2022-01-01T21:00:00+0600",
+            "2022-01-01T21:00:00-0130",
+            "2021-03-14 02:30:00",
+            "2021-11-07 01:30:00",
+            "1969-12-31 23:59:59.500",
+        ]
+        for timezone in ("UTC", "Asia/Tokyo", "America/New_York", "Australia/Lord_Howe"):
+            assert to_unixtime_many(dts, timezone=timezone).tolist() == [
+                to_unixtime(dt, timezone=timezone) for dt in dts
+            ]
+
+        result = to_unixtime_many(np.array([["2022-01-01", "2022-01-01 01:00:00"]]))
+        assert result.dtype == np.int64
+        assert result.tolist() == [[1640995200, 1640998800]]
+        assert to_unixtime_many(["01/02/2022"], format="%m/%d/%Y").tolist() == [1641081600]
+        assert to_unixtime_many([]).tolist() == []
+
+        with self.assertRaises(ValueError):
+            to_unixtime_many(["2022-01-01", "2022/01/01T01"])
+        with self.assertRaises(ValueError):
+            to_unixtime_many(["2022-13-01"])
+
+    def test_from_unixtime_many(self):
+        epochs = np.concatenate(
+            [
+                [0, -1, -86401, 951782400, 1641049200, 1615705200, 1636264800],
+                np.arange(1615680000, 1615780000, 997),
+            ]
+        )
+        for timezone in (None, "Asia/Tokyo", "America/New_York", "Asia/Omsk"):
+            for format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S%z"):
+                assert from_unixtime_many(epochs, format, timezone).tolist() == [
+                    from_unixtime(int(epoch), format, timezone) for epoch in epochs
+                ]
+
+        assert from_unixtime_many([1.9, -0.5]).tolist() == [
+            "1970-01-01 00:00:01",
+            "1969-12-31 23:59:59",
+        ]
+        assert from_unixtime_many(np.array([[1641085200]]), timezone="Asia/Tokyo").tolist() == [
+            ["2022-01-02 10:00:00"]
+        ]
+        with self.assertRaises(ValueError):
+            from_unixtime_many([0], timezone="Mars/Olympus")
+
     def test_time_it(self):
         @time_it
         def my_function(x):